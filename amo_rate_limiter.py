@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from config import AMO_RATE_BURST, AMO_RATE_LIMIT, AMO_RATE_LIMIT_PATH
+from local_store import connect, transaction
+from metrics import observe
+
+logger = logging.getLogger("amo_rate_limiter")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_stats: Dict[str, float] = {"acquired": 0, "waited": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(AMO_RATE_LIMIT_PATH, _SCHEMA)
+
+
+def _reserve(name: str) -> float:
+    now = time.time()
+    conn = _conn()
+    with transaction(conn):
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            tokens = AMO_RATE_BURST
+        else:
+            tokens = min(AMO_RATE_BURST, row["tokens"] + max(0.0, now - row["updated_at"]) * AMO_RATE_LIMIT)
+        # Reserve the token up front; a negative balance is the queue of callers ahead of us.
+        tokens -= 1
+        wait = max(0.0, -tokens) / AMO_RATE_LIMIT
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+            (name, tokens, now),
+        )
+    return wait
+
+
+def acquire(name: str = "amocrm") -> float:
+    if AMO_RATE_LIMIT <= 0:
+        return 0.0
+    waited = _reserve(name)
+    if waited > 0:
+        time.sleep(waited)
+    _record(name, waited)
+    return waited
+
+
+async def acquire_async(name: str = "amocrm") -> float:
+    if AMO_RATE_LIMIT <= 0:
+        return 0.0
+    waited = await asyncio.to_thread(_reserve, name)
+    if waited > 0:
+        await asyncio.sleep(waited)
+    _record(name, waited)
+    return waited
+
+
+def _record(name: str, waited: float) -> None:
+    observe("rate_limiter_wait_seconds", waited, bucket=name)
+    with _stats_lock:
+        _stats["acquired"] += 1
+        if waited > 0:
+            _stats["waited"] += 1
+            _stats["wait_seconds_total"] += waited
+            _stats["wait_seconds_max"] = max(_stats["wait_seconds_max"], waited)
+    if waited > 0:
+        logger.debug("amo.rate_limiter.waited", extra={"bucket": name, "seconds": round(waited, 3)})
+
+
+def stats() -> Dict[str, float]:
+    with _stats_lock:
+        result = dict(_stats)
+    result["wait_seconds_total"] = round(result["wait_seconds_total"], 3)
+    result["wait_seconds_max"] = round(result["wait_seconds_max"], 3)
+    return result
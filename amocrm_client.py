@@ -1,53 +1,50 @@
 import logging
-from typing import Any, Dict, List, Optional
-
-import requests
-
-from config import AMO_BASE_URL, AMO_ACCESS_TOKEN, AMO_PURCHASES_CATALOG_ID
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from amo_rate_limiter import acquire as acquire_rate_slot
+from amocrm_common import (
+    bulk_custom_field_body,
+    catalog_elements_params,
+    custom_field_values,
+    embedded,
+    headers,
+    lead_links_params,
+    log_retry,
+    next_page,
+    parse_response,
+    retry_delay,
+    should_retry,
+)
+from config import AMO_BASE_URL
+from http_pool import http_request
 
 logger = logging.getLogger("amocrm_client")
 
 
-class AmoApiError(Exception):
-    def __init__(self, status_code: int, message: str, payload: Any = None) -> None:
-        super().__init__(message)
-        self.status_code = status_code
-        self.payload = payload
-
-
-def _headers() -> Dict[str, str]:
-    return {
-        "Authorization": f"Bearer {AMO_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
-
-
 def _http(
     method: str,
     path: str,
-    params: Optional[Dict[str, Any]] = None,
+    params: Optional[Any] = None,
     json: Optional[Any] = None,
 ) -> Any:
     url = f"{AMO_BASE_URL}{path}"
     logger.debug("amo.http", extra={"method": method, "url": url, "params": params})
-    resp = requests.request(method, url, headers=_headers(), params=params, json=json, timeout=10)
-    try:
-        data = resp.json()
-    except Exception:
-        data = resp.text
-    if resp.status_code >= 400:
-        message = ""
-        if isinstance(data, dict):
-            message = str(data.get("title") or data.get("message") or data)
-        else:
-            message = str(data)
-        logger.error(
-            "amo.error",
-            extra={"status": resp.status_code, "message": message, "preview": str(data)[:500]},
-        )
-        raise AmoApiError(resp.status_code, message, data)
-    return data
+    attempt = 0
+    while True:
+        acquire_rate_slot()
+        resp = http_request("amocrm", method, url, headers=headers(), params=params, json=json)
+        if not should_retry(resp, attempt):
+            break
+        attempt += 1
+        delay = retry_delay(resp, attempt)
+        log_retry(resp, attempt, delay, url)
+        time.sleep(delay)
+    return parse_response(resp)
+
+
+def api_get(path: str, params: Optional[Any] = None) -> Any:
+    return _http("GET", path, params=params)
 
 
 def get_lead(lead_id: int) -> Dict[str, Any]:
@@ -58,62 +55,33 @@ def get_contact(contact_id: int) -> Dict[str, Any]:
     return _http("GET", f"/api/v4/contacts/{contact_id}")
 
 
-def get_lead_links(lead_id: int) -> List[Dict[str, Any]]:
-    data = _http("GET", f"/api/v4/leads/{lead_id}/links", params={"limit": 250})
-    embedded = data.get("_embedded") or {}
-    links = embedded.get("links") or []
-    return links
+def iter_pages(path: str, params: Any, key: str) -> Iterator[List[Dict[str, Any]]]:
+    request: Optional[Tuple[str, Any]] = (path, params)
+    while request is not None:
+        data = _http("GET", request[0], params=request[1])
+        items = embedded(data, key)
+        if not items:
+            return
+        yield items
+        next_request = next_page(data)
+        request = next_request if next_request != request else None
+
+
+def iter_lead_links(lead_ids: List[int]) -> Iterator[Dict[str, Any]]:
+    for page in iter_pages("/api/v4/leads/links", lead_links_params(lead_ids), "links"):
+        yield from page
 
 
-def get_catalog_element(catalog_id: int, element_id: int) -> Dict[str, Any]:
-    return _http("GET", f"/api/v4/catalogs/{catalog_id}/elements/{element_id}")
+def iter_catalog_elements(catalog_id: int, element_ids: List[int]) -> Iterator[Dict[str, Any]]:
+    path = f"/api/v4/catalogs/{catalog_id}/elements"
+    for page in iter_pages(path, catalog_elements_params(element_ids), "elements"):
+        yield from page
 
 
 def update_lead_custom_field(lead_id: int, field_id: int, value: str) -> Dict[str, Any]:
-    body = {
-        "custom_fields_values": [
-            {
-                "field_id": field_id,
-                "values": [{"value": value}],
-            }
-        ]
-    }
+    body = {"custom_fields_values": custom_field_values(field_id, value)}
     return _http("PATCH", f"/api/v4/leads/{lead_id}", json=body)
 
 
-def get_purchases_for_lead(lead_id: int) -> List[Dict[str, Any]]:
-    links = get_lead_links(lead_id)
-    result: List[Dict[str, Any]] = []
-    by_element_id: Dict[int, Dict[str, Any]] = {}
-    for link in links:
-        if link.get("to_entity_type") != "catalog_elements":
-            continue
-        to_catalog_id = link.get("to_catalog_id")
-        if to_catalog_id != AMO_PURCHASES_CATALOG_ID:
-            continue
-        element_id = link.get("to_entity_id")
-        if not element_id:
-            continue
-        quantity = link.get("quantity") or 1
-        if element_id in by_element_id:
-            by_element_id[element_id]["quantity"] += quantity
-        else:
-            by_element_id[element_id] = {"element_id": element_id, "quantity": quantity}
-    for element_id, info in by_element_id.items():
-        try:
-            element = get_catalog_element(AMO_PURCHASES_CATALOG_ID, element_id)
-        except AmoApiError as e:
-            logger.error(
-                "amo.purchase.element_error",
-                extra={"element_id": element_id, "error": str(e)},
-            )
-            continue
-        result.append(
-            {
-                "id": element_id,
-                "name": element.get("name") or "Товар",
-                "quantity": info.get("quantity") or 1,
-                "raw_element": element,
-            }
-        )
-    return result
+def update_leads_custom_field(field_id: int, values: List[Tuple[int, str]]) -> Any:
+    return _http("PATCH", "/api/v4/leads", json=bulk_custom_field_body(field_id, values))
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from amo_rate_limiter import acquire_async as acquire_rate_slot
+from amocrm_common import (
+    bulk_custom_field_body,
+    catalog_elements_params,
+    custom_field_values,
+    embedded,
+    headers,
+    lead_links_params,
+    log_retry,
+    next_page,
+    parse_response,
+    retry_delay,
+    should_retry,
+)
+from async_http import http_request
+from config import AMO_BASE_URL
+
+logger = logging.getLogger("amocrm_client")
+
+
+async def _http(
+    method: str,
+    path: str,
+    params: Optional[Any] = None,
+    json: Optional[Any] = None,
+) -> Any:
+    url = f"{AMO_BASE_URL}{path}"
+    logger.debug("amo.http", extra={"method": method, "url": url, "params": params})
+    attempt = 0
+    while True:
+        await acquire_rate_slot()
+        resp = await http_request("amocrm", method, url, headers=headers(), params=params, json=json)
+        if not should_retry(resp, attempt):
+            break
+        attempt += 1
+        delay = retry_delay(resp, attempt)
+        log_retry(resp, attempt, delay, url)
+        await asyncio.sleep(delay)
+    return parse_response(resp)
+
+
+async def api_get(path: str, params: Optional[Any] = None) -> Any:
+    return await _http("GET", path, params=params)
+
+
+async def iter_pages(path: str, params: Any, key: str) -> AsyncIterator[List[Dict[str, Any]]]:
+    request: Optional[Tuple[str, Any]] = (path, params)
+    while request is not None:
+        data = await _http("GET", request[0], params=request[1])
+        items = embedded(data, key)
+        if not items:
+            return
+        yield items
+        next_request = next_page(data)
+        request = next_request if next_request != request else None
+
+
+async def iter_lead_links(lead_ids: List[int]) -> AsyncIterator[Dict[str, Any]]:
+    async for page in iter_pages("/api/v4/leads/links", lead_links_params(lead_ids), "links"):
+        for link in page:
+            yield link
+
+
+async def iter_catalog_elements(catalog_id: int, element_ids: List[int]) -> AsyncIterator[Dict[str, Any]]:
+    path = f"/api/v4/catalogs/{catalog_id}/elements"
+    async for page in iter_pages(path, catalog_elements_params(element_ids), "elements"):
+        for element in page:
+            yield element
+
+
+async def get_lead(lead_id: int) -> Dict[str, Any]:
+    return await _http("GET", f"/api/v4/leads/{lead_id}", params={"with": "contacts"})
+
+
+async def get_contact(contact_id: int) -> Dict[str, Any]:
+    return await _http("GET", f"/api/v4/contacts/{contact_id}")
+
+
+async def update_lead_custom_field(lead_id: int, field_id: int, value: str) -> Dict[str, Any]:
+    body = {"custom_fields_values": custom_field_values(field_id, value)}
+    return await _http("PATCH", f"/api/v4/leads/{lead_id}", json=body)
+
+
+async def update_leads_custom_field(field_id: int, values: List[Tuple[int, str]]) -> Any:
+    return await _http("PATCH", "/api/v4/leads", json=bulk_custom_field_body(field_id, values))
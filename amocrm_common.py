@@ -0,0 +1,109 @@
+import logging
+import random
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from config import AMO_ACCESS_TOKEN, AMO_BASE_URL, AMO_MAX_RETRIES, AMO_RETRY_BASE_DELAY
+
+logger = logging.getLogger("amocrm_client")
+
+PAGE_SIZE = 250
+
+
+class AmoApiError(Exception):
+    def __init__(self, status_code: int, message: str, payload: Any = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload
+
+
+def headers() -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {AMO_ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+
+
+def retry_delay(resp: Any, attempt: int) -> float:
+    retry_after = resp.headers.get("Retry-After") if resp.headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return AMO_RETRY_BASE_DELAY * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+def should_retry(resp: Any, attempt: int) -> bool:
+    return attempt < AMO_MAX_RETRIES and (resp.status_code == 429 or resp.status_code >= 500)
+
+
+def log_retry(resp: Any, attempt: int, delay: float, url: str) -> None:
+    logger.warning(
+        "amo.retry",
+        extra={"status": resp.status_code, "attempt": attempt, "delay": round(delay, 3), "url": url},
+    )
+
+
+def parse_response(resp: Any) -> Any:
+    try:
+        data = resp.json()
+    except Exception:
+        data = resp.text
+    if resp.status_code >= 400:
+        message = ""
+        if isinstance(data, dict):
+            message = str(data.get("title") or data.get("message") or data)
+        else:
+            message = str(data)
+        logger.error(
+            "amo.error",
+            extra={"status": resp.status_code, "message": message, "preview": str(data)[:500]},
+        )
+        raise AmoApiError(resp.status_code, message, data)
+    return data
+
+
+def embedded(data: Any, key: str) -> List[Dict[str, Any]]:
+    return ((data or {}).get("_embedded") or {}).get(key) or []
+
+
+def next_page(data: Any) -> Optional[Tuple[str, List[Tuple[str, str]]]]:
+    href = ((((data or {}).get("_links") or {}).get("next")) or {}).get("href")
+    if not href:
+        return None
+    parts = urlsplit(href)
+    path = parts.path
+    base_path = urlsplit(AMO_BASE_URL).path.rstrip("/")
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path) :]
+    return path, parse_qsl(parts.query, keep_blank_values=True)
+
+
+def _ids_params(key: str, ids: List[int]) -> List[Tuple[str, str]]:
+    return [(key, str(x)) for x in ids] + [("limit", str(PAGE_SIZE))]
+
+
+def lead_links_params(lead_ids: List[int]) -> List[Tuple[str, str]]:
+    return _ids_params("filter[entity_id][]", lead_ids)
+
+
+def catalog_elements_params(element_ids: List[int]) -> List[Tuple[str, str]]:
+    return _ids_params("filter[id][]", element_ids)
+
+
+def custom_field_values(field_id: int, value: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "field_id": field_id,
+            "values": [{"value": value}],
+        }
+    ]
+
+
+def bulk_custom_field_body(field_id: int, values: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+    return [
+        {"id": lead_id, "custom_fields_values": custom_field_values(field_id, value)}
+        for lead_id, value in values
+    ]
@@ -0,0 +1,260 @@
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from amocrm_common import AmoApiError
+from catalog_cache import get_items as cached_catalog_items, put_items as cache_catalog_items
+from config import (
+    AMO_BATCH_SIZE,
+    AMO_FIELD_CHECKBOX_STATUS,
+    AMO_FIELD_DISCOUNT,
+    AMO_FIELD_STATUS,
+    AMO_FIELD_TTN,
+    AMO_PURCHASE_ITEMS_FIELD_ID,
+    AMO_PURCHASES_CATALOG_ID,
+)
+from models import LeadData, PurchaseItem, to_milli, to_minor
+
+logger = logging.getLogger("amocrm_service")
+
+CATALOG_CHUNK_SIZE = 40
+
+
+def _find_cf_value_by_id(entity: Dict[str, Any], field_id: int) -> Optional[Any]:
+    for cf in entity.get("custom_fields_values") or []:
+        if cf.get("field_id") == field_id:
+            values = cf.get("values") or []
+            if values:
+                return values[0].get("value")
+    return None
+
+
+def extract_email_from_contact(contact: Dict[str, Any]) -> Optional[str]:
+    for cf in contact.get("custom_fields_values") or []:
+        field_code = str(cf.get("field_code") or "").lower()
+        if field_code == "email":
+            values = cf.get("values") or []
+            if values:
+                email = values[0].get("value")
+                if email:
+                    return str(email)
+    return None
+
+
+def _purchase_ids_from_links(links: List[Dict[str, Any]]) -> List[int]:
+    ids: List[int] = []
+    for link in links:
+        if link.get("to_entity_type") != "catalog_elements":
+            continue
+        md = link.get("metadata") or {}
+        catalog_id = md.get("catalog_id")
+        try:
+            catalog_id_int = int(catalog_id)
+        except Exception:
+            catalog_id_int = 0
+        if catalog_id_int != AMO_PURCHASES_CATALOG_ID:
+            continue
+        eid = link.get("to_entity_id")
+        if not eid:
+            continue
+        try:
+            ids.append(int(eid))
+        except Exception:
+            continue
+    return ids
+
+
+def extract_items_from_catalog_element(element: Dict[str, Any]) -> List[PurchaseItem]:
+    items: List[PurchaseItem] = []
+    cfs = element.get("custom_fields_values") or []
+    block = None
+    for cf in cfs:
+        if cf.get("field_id") == AMO_PURCHASE_ITEMS_FIELD_ID:
+            block = cf
+            break
+    element_id = element.get("id")
+    if not block:
+        logger.info(
+            "amo.purchases.element.no_items_field element_id=%s items_field_id=%s",
+            element_id,
+            AMO_PURCHASE_ITEMS_FIELD_ID,
+        )
+        return items
+    values = block.get("values") or []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("amo.purchases.element.items_field element_id=%s raw_values_len=%s", element_id, len(values))
+    for idx, v in enumerate(values):
+        obj = v.get("value") or {}
+        name = obj.get("description") or f"Товар {idx + 1}"
+        unit_price = obj.get("unit_price")
+        quantity = obj.get("quantity") or 1
+        try:
+            price_dec = Decimal(str(unit_price).replace(",", "."))
+        except Exception:
+            price_dec = Decimal("0")
+        try:
+            qty_dec = Decimal(str(quantity))
+        except Exception:
+            qty_dec = Decimal("1")
+        if debug:
+            logger.debug(
+                "amo.purchases.element.item_raw element_id=%s idx=%s name=%s unit_price=%s quantity=%s",
+                element_id,
+                idx,
+                name,
+                unit_price,
+                quantity,
+            )
+        if price_dec <= 0 or qty_dec <= 0:
+            continue
+        items.append(
+            PurchaseItem(name=str(name), quantity_milli=to_milli(qty_dec), price_minor=to_minor(price_dec))
+        )
+    if debug:
+        logger.debug("amo.purchases.element.items_parsed element_id=%s count=%s", element_id, len(items))
+    return items
+
+
+def split_cached(ids: List[int]) -> Tuple[Dict[int, List[PurchaseItem]], List[int]]:
+    items_by_id: Dict[int, List[PurchaseItem]] = {}
+    missing: List[int] = []
+    for element_id in dict.fromkeys(ids):
+        cached = cached_catalog_items(element_id)
+        if cached is None:
+            missing.append(element_id)
+        else:
+            items_by_id[element_id] = cached
+    return items_by_id, missing
+
+
+def store_elements(elements: List[Dict[str, Any]], items_by_id: Dict[int, List[PurchaseItem]]) -> None:
+    for el in elements:
+        items = extract_items_from_catalog_element(el)
+        try:
+            element_id = int(el.get("id"))
+        except (TypeError, ValueError):
+            continue
+        cache_catalog_items(element_id, el.get("updated_at"), items)
+        items_by_id[element_id] = items
+
+
+def purchases_from_items(ids: List[int], items_by_id: Dict[int, List[PurchaseItem]]) -> List[PurchaseItem]:
+    purchases: List[PurchaseItem] = []
+    for element_id in dict.fromkeys(ids):
+        purchases.extend(items_by_id.get(element_id) or [])
+    return purchases
+
+
+def _lead_fields(lead: Dict[str, Any]) -> Tuple[Any, Decimal, Any, Any]:
+    status_value = _find_cf_value_by_id(lead, AMO_FIELD_STATUS)
+    discount_raw = _find_cf_value_by_id(lead, AMO_FIELD_DISCOUNT)
+    checkbox_status_value = None
+    if AMO_FIELD_CHECKBOX_STATUS:
+        checkbox_status_value = _find_cf_value_by_id(lead, AMO_FIELD_CHECKBOX_STATUS)
+    ttn_value = _find_cf_value_by_id(lead, AMO_FIELD_TTN)
+    discount = Decimal("0")
+    if discount_raw not in (None, ""):
+        try:
+            discount = Decimal(str(discount_raw).replace(",", "."))
+        except Exception:
+            discount = Decimal("0")
+    return status_value, discount, checkbox_status_value, ttn_value
+
+
+def build_lead_data(
+    lead_id: int,
+    lead: Dict[str, Any],
+    email: Optional[str],
+    purchases: List[PurchaseItem],
+    keep_raw: bool = False,
+) -> LeadData:
+    fields = _lead_fields(lead)
+    status_value, discount, checkbox_status_value, ttn_value = fields
+    logger.info(
+        "amocrm.load_lead done lead_id=%s status_value=%s discount=%s checkbox_status=%s email=%s ttn=%s "
+        "purchases_flat=%s",
+        lead_id,
+        status_value,
+        discount,
+        checkbox_status_value,
+        email,
+        ttn_value,
+        len(purchases),
+    )
+    return _to_lead_data(lead_id, lead, fields, email, purchases, keep_raw)
+
+
+def _to_lead_data(
+    lead_id: int,
+    lead: Dict[str, Any],
+    fields: Tuple[Any, Decimal, Any, Any],
+    email: Optional[str],
+    purchases: List[PurchaseItem],
+    keep_raw: bool,
+) -> LeadData:
+    status_value, discount, checkbox_status_value, ttn_value = fields
+    return LeadData(
+        id=lead_id,
+        status_value=None if status_value is None else str(status_value),
+        discount_minor=to_minor(discount),
+        checkbox_status=None if checkbox_status_value is None else str(checkbox_status_value),
+        email=email,
+        ttn=None if ttn_value in (None, "") else str(ttn_value),
+        purchases=tuple(purchases),
+        raw=lead if keep_raw else None,
+    )
+
+
+def lead_summary(lead: Dict[str, Any]) -> LeadData:
+    return _to_lead_data(int(lead["id"]), lead, _lead_fields(lead), None, [], False)
+
+
+def chunk_ids(ids: List[int], size: int) -> List[List[int]]:
+    return [ids[i : i + size] for i in range(0, len(ids), size)]
+
+
+def leads_params(chunk: List[int]) -> List[Any]:
+    params: List[Any] = [("filter[id][]", str(x)) for x in chunk]
+    return params + [("with", "contacts"), ("limit", str(AMO_BATCH_SIZE))]
+
+
+def contacts_params(chunk: List[int]) -> List[Any]:
+    params: List[Any] = [("filter[id][]", str(x)) for x in chunk]
+    return params + [("limit", str(AMO_BATCH_SIZE))]
+
+
+def contact_ids_by_lead(leads: Dict[int, Dict[str, Any]]) -> Dict[int, int]:
+    contact_by_lead: Dict[int, int] = {}
+    for lead_id, lead in leads.items():
+        contacts = (lead.get("_embedded") or {}).get("contacts") or []
+        if contacts and contacts[0].get("id"):
+            contact_by_lead[lead_id] = int(contacts[0]["id"])
+    return contact_by_lead
+
+
+def emails_from_contacts(
+    contact_by_lead: Dict[int, int], contacts: List[Dict[str, Any]]
+) -> Dict[int, Optional[str]]:
+    contacts_by_id = {int(c["id"]): c for c in contacts}
+    return {
+        lead_id: extract_email_from_contact(contacts_by_id[contact_id])
+        for lead_id, contact_id in contact_by_lead.items()
+        if contact_id in contacts_by_id
+    }
+
+
+def purchase_ids_by_lead(links: List[Dict[str, Any]]) -> Dict[int, List[int]]:
+    links_by_lead: Dict[int, List[Dict[str, Any]]] = {}
+    for link in links:
+        try:
+            links_by_lead.setdefault(int(link.get("entity_id")), []).append(link)
+        except (TypeError, ValueError):
+            continue
+    return {lead_id: _purchase_ids_from_links(lead_links) for lead_id, lead_links in links_by_lead.items()}
+
+
+def mark_missing(lead_ids: List[int], leads: Dict[int, Dict[str, Any]], results: Dict[int, Any]) -> None:
+    for lead_id in lead_ids:
+        if lead_id not in leads and lead_id not in results:
+            results[lead_id] = AmoApiError(404, f"lead {lead_id} not found")
@@ -1,62 +1,51 @@
 import logging
-from decimal import Decimal
-from typing import Any, Dict, List, Optional
-
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from config import (
-    AMO_BASE_URL,
-    AMO_ACCESS_TOKEN,
-    AMO_FIELD_DISCOUNT,
-    AMO_FIELD_STATUS,
+    AMO_BATCH_SIZE,
+    AMO_FANOUT_WORKERS,
     AMO_FIELD_CHECKBOX_STATUS,
     AMO_STATUS_TARGET,
-    AMO_FIELD_TTN,
+    AMO_STATUS_WRITE_BEHIND,
     AMO_PURCHASES_CATALOG_ID,
-    AMO_PURCHASE_ITEMS_FIELD_ID,
-    AMO_PURCHASE_TOTAL_FIELD_ID,
 )
 from amocrm_client import (
-    AmoApiError,
+    api_get,
     get_contact,
     get_lead,
+    iter_catalog_elements,
+    iter_lead_links,
     update_lead_custom_field,
 )
+from amocrm_common import AmoApiError, embedded
+from amocrm_leads import (
+    CATALOG_CHUNK_SIZE,
+    build_lead_data,
+    chunk_ids,
+    contact_ids_by_lead,
+    contacts_params,
+    emails_from_contacts,
+    extract_email_from_contact,
+    leads_params,
+    mark_missing,
+    purchase_ids_by_lead,
+    purchases_from_items,
+    split_cached,
+    store_elements,
+)
+from models import LeadData, PurchaseItem
+from status_writer import enqueue as enqueue_status, pending_text as pending_status_text
 
 logger = logging.getLogger("amocrm_service")
 
+LEADS_PAGE_SIZE = 250
 
-def _amo_headers() -> Dict[str, str]:
-    return {
-        "Authorization": f"Bearer {AMO_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-
-def _find_cf_value_by_id(entity: Dict[str, Any], field_id: int) -> Optional[Any]:
-    for cf in entity.get("custom_fields_values") or []:
-        if cf.get("field_id") == field_id:
-            values = cf.get("values") or []
-            if values:
-                return values[0].get("value")
-    return None
-
-
-def _extract_email_from_contact(contact: Dict[str, Any]) -> Optional[str]:
-    for cf in contact.get("custom_fields_values") or []:
-        field_code = str(cf.get("field_code") or "").lower()
-        if field_code == "email":
-            values = cf.get("values") or []
-            if values:
-                email = values[0].get("value")
-                if email:
-                    return str(email)
-    return None
+_executor = ThreadPoolExecutor(max_workers=AMO_FANOUT_WORKERS, thread_name_prefix="amo-fanout")
 
 
 def _extract_email_from_lead(lead: Dict[str, Any]) -> Optional[str]:
-    embedded = lead.get("_embedded") or {}
-    contacts = embedded.get("contacts") or []
+    contacts = (lead.get("_embedded") or {}).get("contacts") or []
     if not contacts:
         return None
     contact_id = contacts[0].get("id")
@@ -67,185 +56,148 @@ def _extract_email_from_lead(lead: Dict[str, Any]) -> Optional[str]:
     except AmoApiError as e:
         logger.error(f"amo.contact.error contact_id={contact_id} error={e}")
         return None
-    return _extract_email_from_contact(contact)
-
-
-def _fetch_purchase_element_ids_for_lead(lead_id: int) -> List[int]:
-    url = f"{AMO_BASE_URL}/api/v4/leads/{lead_id}/links"
-    logger.info(f"amo.purchases.links.get start lead_id={lead_id} url={url}")
-    resp = requests.get(url, headers=_amo_headers(), params={"limit": 250}, timeout=15)
-    resp.raise_for_status()
-    data = resp.json()
-    links = (data.get("_embedded") or {}).get("links") or []
-    ids: List[int] = []
-    for link in links:
-        if link.get("to_entity_type") != "catalog_elements":
-            continue
-        md = link.get("metadata") or {}
-        catalog_id = md.get("catalog_id")
-        try:
-            catalog_id_int = int(catalog_id)
-        except Exception:
-            catalog_id_int = 0
-        if catalog_id_int != AMO_PURCHASES_CATALOG_ID:
-            continue
-        eid = link.get("to_entity_id")
-        if not eid:
-            continue
-        try:
-            ids.append(int(eid))
-        except Exception:
-            continue
-    logger.info(f"amo.purchases.links.done lead_id={lead_id} ids={ids}")
-    return ids
+    return extract_email_from_contact(contact)
+
+
+def _fetch_catalog_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return list(iter_catalog_elements(AMO_PURCHASES_CATALOG_ID, chunk))
 
 
 def _fetch_catalog_elements(ids: List[int]) -> List[Dict[str, Any]]:
     if not ids:
         return []
-    elements: List[Dict[str, Any]] = []
-    url = f"{AMO_BASE_URL}/api/v4/catalogs/{AMO_PURCHASES_CATALOG_ID}/elements"
-    chunk_size = 40
-    for i in range(0, len(ids), chunk_size):
-        chunk = ids[i : i + chunk_size]
-        params = [("filter[id][]", str(x)) for x in chunk]
-        logger.info(f"amo.purchases.elements.get chunk ids={chunk}")
-        resp = requests.get(url, headers=_amo_headers(), params=params, timeout=20)
-        resp.raise_for_status()
-        data = resp.json()
-        els = (data.get("_embedded") or {}).get("elements") or []
-        logger.info(f"amo.purchases.elements.chunk_done count={len(els)}")
-        elements.extend(els)
-    logger.info(f"amo.purchases.elements.total count={len(elements)}")
+    chunks = chunk_ids(ids, CATALOG_CHUNK_SIZE)
+    elements = _collect([_executor.submit(_fetch_catalog_chunk, chunk) for chunk in chunks])
+    logger.info("amo.purchases.elements.total count=%s", len(elements))
     return elements
 
 
-def _extract_items_from_catalog_element(element: Dict[str, Any]) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
-    cfs = element.get("custom_fields_values") or []
-    block = None
-    for cf in cfs:
-        if cf.get("field_id") == AMO_PURCHASE_ITEMS_FIELD_ID:
-            block = cf
-            break
-    if not block:
-        logger.info(
-            f"amo.purchases.element.no_items_field element_id={element.get('id')} "
-            f"items_field_id={AMO_PURCHASE_ITEMS_FIELD_ID}"
-        )
-        return items
-    values = block.get("values") or []
-    logger.info(
-        f"amo.purchases.element.items_field element_id={element.get('id')} raw_values_len={len(values)}"
-    )
-    for idx, v in enumerate(values):
-        obj = v.get("value") or {}
-        name = obj.get("description") or f"Товар {idx + 1}"
-        unit_price = obj.get("unit_price")
-        quantity = obj.get("quantity") or 1
-        try:
-            price_dec = Decimal(str(unit_price).replace(",", "."))
-        except Exception:
-            price_dec = Decimal("0")
-        try:
-            qty_dec = Decimal(str(quantity))
-        except Exception:
-            qty_dec = Decimal("1")
-        logger.info(
-            f"amo.purchases.element.item_raw element_id={element.get('id')} idx={idx} "
-            f"name={name} unit_price={unit_price} quantity={quantity} price_dec={price_dec} qty_dec={qty_dec}"
-        )
-        if price_dec <= 0 or qty_dec <= 0:
-            continue
-        items.append(
-            {
-                "name": name,
-                "quantity": qty_dec,
-                "price": price_dec,
-            }
-        )
-    logger.info(
-        f"amo.purchases.element.items_parsed element_id={element.get('id')} count={len(items)}"
-    )
-    return items
+def _load_items_by_element_id(ids: List[int]) -> Dict[int, List[PurchaseItem]]:
+    items_by_id, missing = split_cached(ids)
+    store_elements(_fetch_catalog_elements(missing), items_by_id)
+    return items_by_id
 
 
-def _fetch_purchases_for_lead(lead_id: int) -> List[Dict[str, Any]]:
+def _fetch_purchases_for_lead(lead_id: int) -> List[PurchaseItem]:
+    purchases = _load_purchases_for_leads([lead_id])[lead_id]
+    logger.info("amo.purchases.total_parsed lead_id=%s items=%s", lead_id, len(purchases))
+    return purchases
+
+
+def load_lead_with_details(lead_id: int, keep_raw: bool = False) -> LeadData:
+    logger.debug("amocrm.load_lead start lead_id=%s", lead_id)
+    lead = get_lead(lead_id)
+    email_future = _executor.submit(_extract_email_from_lead, lead)
+    purchases = _fetch_purchases_for_lead(lead_id)
     try:
-        ids = _fetch_purchase_element_ids_for_lead(lead_id)
+        email = email_future.result()
     except Exception as e:
-        logger.error(f"amo.purchases.links.error lead_id={lead_id} error={e}")
-        return []
-    if not ids:
-        logger.info(f"amo.purchases.links.empty lead_id={lead_id}")
-        return []
+        logger.error(f"amo.contact.error lead_id={lead_id} error={e}")
+        email = None
+    return build_lead_data(lead_id, lead, email, purchases, keep_raw)
+
+
+def fetch_leads_page(filters: List[Any], page: int) -> Tuple[List[Dict[str, Any]], bool]:
+    params = list(filters) + [("limit", str(LEADS_PAGE_SIZE)), ("page", str(page))]
+    data = api_get("/api/v4/leads", params=params)
+    leads = embedded(data, "leads")
+    return leads, len(leads) >= LEADS_PAGE_SIZE and bool(((data or {}).get("_links") or {}).get("next"))
+
+
+def _fetch_leads_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return embedded(api_get("/api/v4/leads", params=leads_params(chunk)), "leads")
+
+
+def _fetch_contacts_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return embedded(api_get("/api/v4/contacts", params=contacts_params(chunk)), "contacts")
+
+
+def _fetch_links_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return list(iter_lead_links(chunk))
+
+
+def _submit_chunks(fn: Any, ids: List[int]) -> List[Future]:
+    return [_executor.submit(fn, chunk) for chunk in chunk_ids(ids, AMO_BATCH_SIZE)]
+
+
+def _collect(futures: List[Future]) -> List[Dict[str, Any]]:
+    result: List[Dict[str, Any]] = []
+    for future in futures:
+        result.extend(future.result())
+    return result
+
+
+def _map_chunks(fn: Any, ids: List[int]) -> List[Dict[str, Any]]:
+    return _collect(_submit_chunks(fn, ids))
+
+
+def _load_purchases_for_leads(lead_ids: List[int]) -> Dict[int, List[PurchaseItem]]:
+    ids_by_lead = purchase_ids_by_lead(_map_chunks(_fetch_links_chunk, lead_ids))
+    all_ids = [element_id for ids in ids_by_lead.values() for element_id in ids]
+    items_by_id = _load_items_by_element_id(all_ids)
+    return {lead_id: purchases_from_items(ids_by_lead.get(lead_id) or [], items_by_id) for lead_id in lead_ids}
+
+
+def load_leads_with_details(lead_ids: List[int], keep_raw: bool = False) -> Dict[int, Any]:
+    lead_ids = list(dict.fromkeys(lead_ids))
+    logger.info(f"amocrm.load_leads start count={len(lead_ids)}")
+    results: Dict[int, Any] = {}
+    leads: Dict[int, Dict[str, Any]] = {}
+    chunk_futures = [
+        (chunk, _executor.submit(_fetch_leads_chunk, chunk)) for chunk in chunk_ids(lead_ids, AMO_BATCH_SIZE)
+    ]
+    for chunk, future in chunk_futures:
+        try:
+            for lead in future.result():
+                leads[int(lead["id"])] = lead
+        except Exception as e:
+            logger.error(f"amocrm.load_leads.chunk_error ids={chunk} error={e}")
+            for lead_id in chunk:
+                results[lead_id] = e
+    mark_missing(lead_ids, leads, results)
+    if not leads:
+        return results
+    contact_by_lead = contact_ids_by_lead(leads)
+    contact_futures = _submit_chunks(_fetch_contacts_chunk, list(dict.fromkeys(contact_by_lead.values())))
     try:
-        elements = _fetch_catalog_elements(ids)
+        purchases_by_lead = _load_purchases_for_leads(list(leads.keys()))
     except Exception as e:
-        logger.error(f"amo.purchases.elements.error lead_id={lead_id} error={e}")
-        return []
-    purchases: List[Dict[str, Any]] = []
-    for el in elements:
-        items = _extract_items_from_catalog_element(el)
-        purchases.extend(items)
-    logger.info(
-        f"amo.purchases.total_parsed lead_id={lead_id} elements={len(elements)} items={len(purchases)}"
-    )
-    return purchases
+        # A lead without its purchases must not reach Checkbox; callers reload these one by one.
+        logger.error(f"amo.purchases.batch_error leads={len(leads)} error={e}")
+        for lead_id in leads:
+            results[lead_id] = e
+        return results
+    try:
+        emails = emails_from_contacts(contact_by_lead, _collect(contact_futures))
+    except Exception as e:
+        logger.error(f"amo.contact.batch_error leads={len(leads)} error={e}")
+        emails = {}
+    for lead_id, lead in leads.items():
+        results[lead_id] = build_lead_data(
+            lead_id, lead, emails.get(lead_id), purchases_by_lead[lead_id], keep_raw
+        )
+    logger.info(f"amocrm.load_leads done loaded={len(leads)} failed={len(results) - len(leads)}")
+    return results
 
 
-def load_lead_with_details(lead_id: int) -> Dict[str, Any]:
-    logger.info(f"amocrm.load_lead start lead_id={lead_id}")
-    lead = get_lead(lead_id)
-    status_value = _find_cf_value_by_id(lead, AMO_FIELD_STATUS)
-    discount_raw = _find_cf_value_by_id(lead, AMO_FIELD_DISCOUNT)
-    checkbox_status_value = None
-    if AMO_FIELD_CHECKBOX_STATUS:
-        checkbox_status_value = _find_cf_value_by_id(lead, AMO_FIELD_CHECKBOX_STATUS)
-    ttn_value = _find_cf_value_by_id(lead, AMO_FIELD_TTN)
-    discount = Decimal("0")
-    if discount_raw not in (None, ""):
-        try:
-            discount = Decimal(str(discount_raw).replace(",", "."))
-        except Exception:
-            discount = Decimal("0")
-    email = _extract_email_from_lead(lead)
-    purchases = _fetch_purchases_for_lead(lead_id)
-    logger.info(
-        "amocrm.load_lead done "
-        f"lead_id={lead_id} status_value={status_value} discount={discount} "
-        f"checkbox_status={checkbox_status_value} email={email} ttn={ttn_value} "
-        f"purchases_flat={len(purchases)}"
-    )
-    return {
-        "id": lead_id,
-        "lead": lead,
-        "status_value": status_value,
-        "discount": discount,
-        "checkbox_status": checkbox_status_value,
-        "email": email,
-        "purchases": purchases,
-        "ttn": ttn_value,
-    }
-
-
-def is_target_status(lead_data: Dict[str, Any]) -> bool:
-    value = lead_data.get("status_value")
-    logger.info(f"amocrm.status.check status_value={value} target={AMO_STATUS_TARGET}")
+def is_target_status(lead_data: LeadData) -> bool:
+    value = lead_data.status_value
+    logger.debug("amocrm.status.check status_value=%s target=%s", value, AMO_STATUS_TARGET)
     if value is None:
         return False
     return str(value).strip() == AMO_STATUS_TARGET
 
 
-def is_already_processed(lead_data: Dict[str, Any]) -> bool:
+def is_already_processed(lead_data: LeadData) -> bool:
     if not AMO_FIELD_CHECKBOX_STATUS:
         return False
-    value = lead_data.get("checkbox_status") or ""
-    if not isinstance(value, str):
-        value = str(value)
+    value = lead_data.checkbox_status or ""
+    if AMO_STATUS_WRITE_BEHIND:
+        value = pending_status_text(lead_data.id) or value
     value_lower = value.lower().strip()
-    logger.info(f"amocrm.checkbox_status.check value={value_lower}")
-    if value_lower.startswith("ok:"):
+    logger.debug("amocrm.checkbox_status.check value=%s", value_lower)
+    # "pending:" marks a sell whose outcome the receipt reconciler has not settled yet.
+    if value_lower.startswith(("ok:", "pending:")):
         return True
     return False
 
@@ -254,6 +206,9 @@ def set_checkbox_status(lead_id: int, text: str) -> None:
     if not AMO_FIELD_CHECKBOX_STATUS:
         return
     logger.info(f"amocrm.checkbox_status.set lead_id={lead_id} text={text}")
+    if AMO_STATUS_WRITE_BEHIND:
+        enqueue_status(lead_id, text)
+        return
     try:
         update_lead_custom_field(lead_id, AMO_FIELD_CHECKBOX_STATUS, text)
     except AmoApiError as e:
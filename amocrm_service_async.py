@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from amocrm_client_async import (
+    api_get,
+    get_contact,
+    get_lead,
+    iter_catalog_elements,
+    iter_lead_links,
+    update_lead_custom_field,
+)
+from amocrm_common import AmoApiError, embedded
+from amocrm_leads import (
+    CATALOG_CHUNK_SIZE,
+    build_lead_data,
+    chunk_ids,
+    contact_ids_by_lead,
+    contacts_params,
+    emails_from_contacts,
+    extract_email_from_contact,
+    leads_params,
+    mark_missing,
+    purchase_ids_by_lead,
+    purchases_from_items,
+    split_cached,
+    store_elements,
+)
+from config import (
+    AMO_BATCH_SIZE,
+    AMO_FIELD_CHECKBOX_STATUS,
+    AMO_PURCHASES_CATALOG_ID,
+    AMO_STATUS_WRITE_BEHIND,
+)
+from models import LeadData, PurchaseItem
+from status_writer import enqueue as enqueue_status
+
+logger = logging.getLogger("amocrm_service")
+
+
+async def _extract_email_from_lead(lead: Dict[str, Any]) -> Optional[str]:
+    contacts = (lead.get("_embedded") or {}).get("contacts") or []
+    if not contacts or not contacts[0].get("id"):
+        return None
+    contact_id = contacts[0]["id"]
+    try:
+        contact = await get_contact(contact_id)
+    except AmoApiError as e:
+        logger.error(f"amo.contact.error contact_id={contact_id} error={e}")
+        return None
+    return extract_email_from_contact(contact)
+
+
+async def _fetch_catalog_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return [element async for element in iter_catalog_elements(AMO_PURCHASES_CATALOG_ID, chunk)]
+
+
+async def _fetch_catalog_elements(ids: List[int]) -> List[Dict[str, Any]]:
+    if not ids:
+        return []
+    chunks = await asyncio.gather(*(_fetch_catalog_chunk(chunk) for chunk in chunk_ids(ids, CATALOG_CHUNK_SIZE)))
+    elements = [el for chunk in chunks for el in chunk]
+    logger.info("amo.purchases.elements.total count=%s", len(elements))
+    return elements
+
+
+async def _load_items_by_element_id(ids: List[int]) -> Dict[int, List[PurchaseItem]]:
+    items_by_id, missing = split_cached(ids)
+    store_elements(await _fetch_catalog_elements(missing), items_by_id)
+    return items_by_id
+
+
+async def _fetch_purchases_for_lead(lead_id: int) -> List[PurchaseItem]:
+    purchases = (await _load_purchases_for_leads([lead_id]))[lead_id]
+    logger.info("amo.purchases.total_parsed lead_id=%s items=%s", lead_id, len(purchases))
+    return purchases
+
+
+async def load_lead_with_details(lead_id: int, keep_raw: bool = False) -> LeadData:
+    lead = await get_lead(lead_id)
+    email, purchases = await asyncio.gather(
+        _extract_email_from_lead(lead), _fetch_purchases_for_lead(lead_id), return_exceptions=True
+    )
+    if isinstance(purchases, Exception):
+        raise purchases
+    if isinstance(email, Exception):
+        logger.error(f"amo.contact.error lead_id={lead_id} error={email}")
+        email = None
+    return build_lead_data(lead_id, lead, email, purchases, keep_raw)
+
+
+async def _fetch_links_chunk(chunk: List[int]) -> List[Dict[str, Any]]:
+    return [link async for link in iter_lead_links(chunk)]
+
+
+async def _load_purchases_for_leads(lead_ids: List[int]) -> Dict[int, List[PurchaseItem]]:
+    pages = await asyncio.gather(*(_fetch_links_chunk(chunk) for chunk in chunk_ids(lead_ids, AMO_BATCH_SIZE)))
+    ids_by_lead = purchase_ids_by_lead([link for links in pages for link in links])
+    all_ids = [element_id for ids in ids_by_lead.values() for element_id in ids]
+    items_by_id = await _load_items_by_element_id(all_ids)
+    return {lead_id: purchases_from_items(ids_by_lead.get(lead_id) or [], items_by_id) for lead_id in lead_ids}
+
+
+async def _load_emails(contact_by_lead: Dict[int, int]) -> Dict[int, Optional[str]]:
+    contact_ids = list(dict.fromkeys(contact_by_lead.values()))
+    pages = await asyncio.gather(
+        *(
+            api_get("/api/v4/contacts", params=contacts_params(chunk))
+            for chunk in chunk_ids(contact_ids, AMO_BATCH_SIZE)
+        )
+    )
+    return emails_from_contacts(contact_by_lead, [c for data in pages for c in embedded(data, "contacts")])
+
+
+async def load_leads_with_details(lead_ids: List[int], keep_raw: bool = False) -> Dict[int, Any]:
+    lead_ids = list(dict.fromkeys(lead_ids))
+    logger.info(f"amocrm.load_leads start count={len(lead_ids)}")
+    results: Dict[int, Any] = {}
+    leads: Dict[int, Dict[str, Any]] = {}
+    chunks = chunk_ids(lead_ids, AMO_BATCH_SIZE)
+    pages = await asyncio.gather(
+        *(api_get("/api/v4/leads", params=leads_params(chunk)) for chunk in chunks), return_exceptions=True
+    )
+    for chunk, data in zip(chunks, pages):
+        if isinstance(data, Exception):
+            logger.error(f"amocrm.load_leads.chunk_error ids={chunk} error={data}")
+            for lead_id in chunk:
+                results[lead_id] = data
+            continue
+        for lead in embedded(data, "leads"):
+            leads[int(lead["id"])] = lead
+    mark_missing(lead_ids, leads, results)
+    if not leads:
+        return results
+    contact_by_lead = contact_ids_by_lead(leads)
+    purchases_by_lead, emails = await asyncio.gather(
+        _load_purchases_for_leads(list(leads.keys())), _load_emails(contact_by_lead), return_exceptions=True
+    )
+    if isinstance(purchases_by_lead, Exception):
+        # A lead without its purchases must not reach Checkbox; callers reload these one by one.
+        logger.error(f"amo.purchases.batch_error leads={len(leads)} error={purchases_by_lead}")
+        for lead_id in leads:
+            results[lead_id] = purchases_by_lead
+        return results
+    if isinstance(emails, Exception):
+        logger.error(f"amo.contact.batch_error leads={len(leads)} error={emails}")
+        emails = {}
+    for lead_id, lead in leads.items():
+        results[lead_id] = build_lead_data(
+            lead_id, lead, emails.get(lead_id), purchases_by_lead[lead_id], keep_raw
+        )
+    logger.info(f"amocrm.load_leads done loaded={len(leads)} failed={len(results) - len(leads)}")
+    return results
+
+
+async def set_checkbox_status(lead_id: int, text: str) -> None:
+    if not AMO_FIELD_CHECKBOX_STATUS:
+        return
+    logger.info(f"amocrm.checkbox_status.set lead_id={lead_id} text={text}")
+    if AMO_STATUS_WRITE_BEHIND:
+        await asyncio.to_thread(enqueue_status, lead_id, text)
+        return
+    try:
+        await update_lead_custom_field(lead_id, AMO_FIELD_CHECKBOX_STATUS, text)
+    except AmoApiError as e:
+        logger.error(f"amocrm.checkbox_status.error lead_id={lead_id} error={e} text={text}")
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+from async_http import aclose_all
+from config import AMO_STATUS_WRITE_BEHIND, CHECKBOX_PREWARM_LEAD, JOB_WORKERS, WEBHOOK_ASYNC
+from deferred_queue import enabled as deferral_enabled, start_drainer
+from job_queue import enqueue_lead, start_workers
+from log_setup import configure_logging
+from metrics import in_flight, render as render_metrics
+from pipeline import process_lead as process_lead_sync
+from pipeline_async import process_lead, process_leads
+from receipt_reconciler import enabled as reconcile_enabled, start_reconciler
+from shift_maintenance import start_prewarm_scheduler
+from status_writer import start_flusher as start_status_flusher
+from telegram_notify import flush as flush_telegram
+from telegram_notify_async import send_telegram
+from webhook_common import health_status, lead_ids_from_form, lead_ids_from_json
+
+configure_logging()
+
+logger = logging.getLogger("app")
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_ROUTES = {"/health": "GET", "/metrics": "GET", "/amocrm/webhook": "POST"}
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _content_type(scope: Dict[str, Any]) -> str:
+    for name, value in scope.get("headers") or []:
+        if name.lower() == b"content-type":
+            return value.decode("latin-1").split(";", 1)[0].strip().lower()
+    return ""
+
+
+async def _respond(send: Send, status: int, body: bytes, content_type: str) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _respond_json(send: Send, status: int, payload: Any) -> None:
+    await _respond(send, status, json.dumps(payload, default=str).encode("utf-8"), "application/json")
+
+
+def _lead_ids_from_body(content_type: str, raw: bytes) -> List[int]:
+    lead_ids: List[int] = []
+    if content_type == "application/json" or content_type.endswith("+json"):
+        try:
+            body = json.loads(raw or b"null")
+        except ValueError:
+            body = None
+        lead_ids = lead_ids_from_json(body if isinstance(body, dict) else {})
+    if not lead_ids and content_type == "application/x-www-form-urlencoded":
+        form: Dict[str, str] = {}
+        for key, value in parse_qsl(raw.decode("utf-8", "replace"), keep_blank_values=True):
+            form.setdefault(key, value)
+        if form:
+            lead_ids = lead_ids_from_form(form)
+    return lead_ids
+
+
+async def _handle_webhook(scope: Dict[str, Any], receive: Receive) -> Tuple[int, Any]:
+    lead_ids = _lead_ids_from_body(_content_type(scope), await _read_body(receive))
+    if not lead_ids:
+        logger.error("webhook.lead_id_not_found")
+        await send_telegram("❌ Вебхук AmoCRM: не удалось получить ID сделки")
+        return 400, {"error": "lead_id not found"}
+    logger.info(f"webhook.received lead_ids={lead_ids}")
+    if WEBHOOK_ASYNC:
+        jobs = [
+            {"lead_id": lead_id, "job_id": await asyncio.to_thread(enqueue_lead, lead_id)} for lead_id in lead_ids
+        ]
+        start_workers(JOB_WORKERS)
+        if len(jobs) == 1:
+            return 202, {"status": "queued", **jobs[0]}
+        return 202, {"status": "queued", "jobs": jobs}
+    if len(lead_ids) == 1:
+        result, status_code = await process_lead(lead_ids[0])
+        return status_code, result
+    results = [
+        {"lead_id": lead_id, "status_code": status_code, **result}
+        for lead_id, result, status_code in await process_leads(lead_ids)
+    ]
+    return 500 if any(r["status_code"] >= 500 for r in results) else 200, {"results": results}
+
+
+async def _lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if WEBHOOK_ASYNC:
+                start_workers(JOB_WORKERS)
+            if AMO_STATUS_WRITE_BEHIND:
+                start_status_flusher()
+            if CHECKBOX_PREWARM_LEAD > 0:
+                start_prewarm_scheduler()
+            if deferral_enabled():
+                start_drainer(process_lead_sync)
+            if reconcile_enabled():
+                start_reconciler()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aclose_all()
+            await asyncio.to_thread(flush_telegram)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    path = scope["path"]
+    if path not in _ROUTES:
+        await _respond_json(send, 404, {"error": "not found"})
+        return
+    if scope["method"] != _ROUTES[path]:
+        await _respond_json(send, 405, {"error": "method not allowed"})
+        return
+    if path == "/health":
+        await _respond_json(send, 200, await asyncio.to_thread(health_status))
+    elif path == "/metrics":
+        body = (await asyncio.to_thread(render_metrics)).encode("utf-8")
+        await _respond(send, 200, body, "text/plain; version=0.0.4")
+    else:
+        with in_flight("webhooks_in_flight"):
+            status, payload = await _handle_webhook(scope, receive)
+        await _respond_json(send, status, payload)
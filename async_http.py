@@ -0,0 +1,60 @@
+import logging
+import time
+from typing import Any, Dict
+
+import httpx
+
+from circuit_breaker import get_breaker
+from config import CIRCUIT_BREAKER, HTTP_ASYNC_MAX_CONNECTIONS, HTTP_POOL_MAXSIZE
+from http_pool import get_timeout
+from metrics import inc, observe
+
+logger = logging.getLogger("async_http")
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=get_timeout(upstream),
+            limits=httpx.Limits(
+                max_connections=HTTP_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+        )
+        _clients[upstream] = client
+        logger.debug("async_http.client.created", extra={"upstream": upstream})
+    return client
+
+
+async def http_request(upstream: str, method: str, url: str, breaker_key: str = "", **kwargs: Any) -> httpx.Response:
+    breaker = get_breaker(upstream, breaker_key) if CIRCUIT_BREAKER else None
+    if breaker is not None:
+        breaker.before_call()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        resp = await get_client(upstream).request(method, url, **kwargs)
+        status = str(resp.status_code)
+        if breaker is not None:
+            breaker.record(resp.status_code < 500)
+        return resp
+    except Exception:
+        if breaker is not None:
+            breaker.record(False)
+        raise
+    finally:
+        observe("upstream_request_seconds", time.perf_counter() - started, upstream=upstream)
+        inc("upstream_responses_total", upstream=upstream, status=status)
+
+
+async def aclose_all() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
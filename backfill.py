@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from amocrm_leads import lead_summary
+from amocrm_service import fetch_leads_page, is_already_processed, is_target_status, load_leads_with_details
+from config import BACKFILL_CHECKPOINT_PATH, LEAD_BATCH_PARALLELISM
+from local_store import resolve_path
+from log_setup import configure_logging
+from models import LeadData
+from pipeline import process_lead
+from time_window import TZ
+
+logger = logging.getLogger("backfill")
+
+
+class Checkpoint:
+    def __init__(self, path: str, filters_key: str) -> None:
+        self.path = path
+        self.filters_key = filters_key
+        self.cursor = 0
+        self.page = 1
+        self.boundary_ids: List[int] = []
+        self.counts: Dict[str, int] = {}
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if data.get("filters") != self.filters_key:
+            logger.warning(f"backfill.checkpoint_mismatch path={self.path}")
+            return False
+        self.cursor = int(data.get("cursor") or 0)
+        self.page = int(data.get("page") or 1)
+        self.boundary_ids = [int(x) for x in data.get("boundary_ids") or []]
+        self.counts = {k: int(v) for k, v in (data.get("counts") or {}).items()}
+        return True
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(
+                {
+                    "filters": self.filters_key,
+                    "cursor": self.cursor,
+                    "page": self.page,
+                    "boundary_ids": self.boundary_ids,
+                    "counts": self.counts,
+                    "saved_at": time.time(),
+                },
+                fh,
+            )
+        os.replace(tmp_path, self.path)
+
+    def advance(self, leads: List[Dict[str, Any]], has_next: bool) -> None:
+        # Keyset over created_at: restart from the newest timestamp seen and skip the ids already taken at it.
+        newest = max(int(lead.get("created_at") or 0) for lead in leads)
+        at_newest = [int(lead["id"]) for lead in leads if int(lead.get("created_at") or 0) == newest]
+        if newest > self.cursor:
+            self.cursor = newest
+            self.page = 1
+            self.boundary_ids = at_newest
+        else:
+            self.page += 1
+            self.boundary_ids = list(dict.fromkeys(self.boundary_ids + at_newest))
+        if not has_next:
+            # A later run starts over at the cursor; everything seen there is in boundary_ids.
+            self.page = 1
+
+    def add(self, key: str, amount: int = 1) -> None:
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+
+def _timestamp(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=TZ)
+    return int(parsed.timestamp())
+
+
+def _filters(args: argparse.Namespace, cursor: int) -> List[Any]:
+    filters: List[Any] = [("order[created_at]", "asc")]
+    for idx, status_id in enumerate(args.status_id or []):
+        filters.append((f"filter[statuses][{idx}][pipeline_id]", str(args.pipeline_id)))
+        filters.append((f"filter[statuses][{idx}][status_id]", str(status_id)))
+    if args.pipeline_id and not args.status_id:
+        filters.append(("filter[pipeline_id]", str(args.pipeline_id)))
+    created_from = max(cursor, _timestamp(args.created_from) if args.created_from else 0)
+    if created_from:
+        filters.append(("filter[created_at][from]", str(created_from)))
+    if args.created_to:
+        filters.append(("filter[created_at][to]", str(_timestamp(args.created_to))))
+    return filters
+
+
+def _filters_key(args: argparse.Namespace) -> str:
+    return json.dumps(
+        {
+            "pipeline_id": args.pipeline_id,
+            "status_id": args.status_id,
+            "created_from": args.created_from,
+            "created_to": args.created_to,
+        },
+        sort_keys=True,
+    )
+
+
+def iter_pages(args: argparse.Namespace, checkpoint: Checkpoint) -> Iterator[List[Dict[str, Any]]]:
+    while True:
+        leads, has_next = fetch_leads_page(_filters(args, checkpoint.cursor), checkpoint.page)
+        if not leads:
+            return
+        skip = set(checkpoint.boundary_ids)
+        fresh = [lead for lead in leads if int(lead["id"]) not in skip]
+        checkpoint.advance(leads, has_next)
+        yield fresh
+        if not has_next:
+            return
+
+
+def select(leads: List[Dict[str, Any]]) -> List[LeadData]:
+    selected: List[LeadData] = []
+    for lead in leads:
+        summary = lead_summary(lead)
+        if is_target_status(summary) and not is_already_processed(summary):
+            selected.append(summary)
+    return selected
+
+
+def _run_lead(lead_id: int, preloaded: Dict[int, Any]) -> Tuple[int, Dict[str, Any], int]:
+    lead_data = preloaded.get(lead_id)
+    body, status_code = process_lead(lead_id, lead_data if isinstance(lead_data, LeadData) else None)
+    return lead_id, body, status_code
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    checkpoint = Checkpoint(resolve_path(args.checkpoint), _filters_key(args))
+    if args.restart or not checkpoint.load():
+        checkpoint.counts = {}
+    started = time.monotonic()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="backfill") as pool:
+        for leads in iter_pages(args, checkpoint):
+            checkpoint.add("scanned", len(leads))
+            selected = select(leads)
+            checkpoint.add("selected", len(selected))
+            lead_ids = [lead.id for lead in selected]
+            if lead_ids and args.dry_run:
+                print(json.dumps({"lead_ids": lead_ids}))
+            elif lead_ids:
+                try:
+                    preloaded = load_leads_with_details(lead_ids)
+                except Exception as e:
+                    logger.error(f"backfill.preload_error count={len(lead_ids)} error={e}")
+                    preloaded = {}
+                for lead_id, body, status_code in pool.map(lambda lid: _run_lead(lid, preloaded), lead_ids):
+                    checkpoint.add("ok" if status_code < 400 else "failed")
+                    if status_code >= 400:
+                        logger.warning(f"backfill.lead_failed lead_id={lead_id} status_code={status_code}")
+            processed += len(lead_ids)
+            if not args.dry_run:
+                checkpoint.save()
+            logger.info(
+                f"backfill.page_done cursor={checkpoint.cursor} page={checkpoint.page} "
+                f"scanned={len(leads)} selected={len(lead_ids)}"
+            )
+            if args.limit and processed >= args.limit:
+                break
+    elapsed = time.monotonic() - started
+    return {
+        **checkpoint.counts,
+        "processed_this_run": processed,
+        "seconds": round(elapsed, 3),
+        "leads_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0,
+        "checkpoint": checkpoint.path,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Backfill receipts for leads in the target status.")
+    parser.add_argument("--pipeline-id", type=int, default=0)
+    parser.add_argument("--status-id", type=int, action="append", help="requires --pipeline-id; repeatable")
+    parser.add_argument("--created-from", help="unix time or ISO date, Europe/Kiev when naive")
+    parser.add_argument("--created-to", help="unix time or ISO date, Europe/Kiev when naive")
+    parser.add_argument("--concurrency", type=int, default=LEAD_BATCH_PARALLELISM)
+    parser.add_argument("--limit", type=int, default=0, help="stop after the page that reaches this many leads")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="print selected lead ids without processing")
+    args = parser.parse_args(argv)
+    if args.status_id and not args.pipeline_id:
+        parser.error("--status-id requires --pipeline-id")
+    configure_logging()
+    print(json.dumps(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+UPSTREAMS = ("amocrm", "checkbox", "novaposhta", "telegram")
+
+BENCH_ITEMS_FIELD_ID = 1001
+BENCH_CHECKBOX_STATUS_FIELD_ID = 1002
+BENCH_SENDER_NAME = "Bench Sender"
+
+
+class FakeSettings:
+    def __init__(self, latency_ms: Dict[str, float], error_rate: Dict[str, float], purchases: int, items: int) -> None:
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.purchases = purchases
+        self.items = items
+
+
+def _lead(lead_id: int) -> Dict[str, Any]:
+    from config import AMO_FIELD_STATUS, AMO_FIELD_TTN, AMO_STATUS_TARGET
+
+    return {
+        "id": lead_id,
+        "updated_at": 1,
+        "custom_fields_values": [
+            {"field_id": AMO_FIELD_STATUS, "values": [{"value": AMO_STATUS_TARGET}]},
+            {"field_id": AMO_FIELD_TTN, "values": [{"value": f"2045{lead_id:010d}"}]},
+        ],
+        "_embedded": {"contacts": [{"id": lead_id}]},
+    }
+
+
+def _contact(contact_id: int) -> Dict[str, Any]:
+    return {
+        "id": contact_id,
+        "custom_fields_values": [{"field_code": "EMAIL", "values": [{"value": f"client{contact_id}@example.com"}]}],
+    }
+
+
+def _element_ids(lead_id: int, settings: FakeSettings) -> List[int]:
+    return [lead_id * 1000 + k for k in range(settings.purchases)]
+
+
+def _links(lead_id: int, settings: FakeSettings) -> List[Dict[str, Any]]:
+    from config import AMO_PURCHASES_CATALOG_ID
+
+    return [
+        {
+            "entity_id": lead_id,
+            "entity_type": "leads",
+            "to_entity_id": element_id,
+            "to_entity_type": "catalog_elements",
+            "metadata": {"catalog_id": AMO_PURCHASES_CATALOG_ID, "quantity": 1},
+        }
+        for element_id in _element_ids(lead_id, settings)
+    ]
+
+
+def catalog_element(element_id: int, items: int) -> Dict[str, Any]:
+    return {
+        "id": element_id,
+        "updated_at": 1,
+        "custom_fields_values": [
+            {
+                "field_id": BENCH_ITEMS_FIELD_ID,
+                "values": [
+                    {
+                        "value": {
+                            "description": f"Товар {idx + 1}",
+                            "unit_price": f"{100 + idx % 50}.50",
+                            "quantity": 1 + idx % 3,
+                        }
+                    }
+                    for idx in range(items)
+                ],
+            }
+        ],
+    }
+
+
+def _query_ids(query: Dict[str, List[str]], key: str) -> List[int]:
+    return [int(x) for x in query.get(key, []) if x.isdigit()]
+
+
+def _paged(key: str, items: List[Dict[str, Any]], path: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+    limit = int((query.get("limit") or ["250"])[0])
+    page = int((query.get("page") or ["1"])[0])
+    payload: Dict[str, Any] = {"_embedded": {key: items[(page - 1) * limit : page * limit]}}
+    if page * limit < len(items):
+        next_query = urlencode({**query, "page": [str(page + 1)]}, doseq=True)
+        payload["_links"] = {"next": {"href": f"/amocrm{path}?{next_query}"}}
+    return payload
+
+
+def _amocrm(method: str, path: str, query: Dict[str, List[str]], settings: FakeSettings) -> Tuple[int, Any]:
+    parts = [p for p in path.split("/") if p]
+    if method == "PATCH":
+        return 200, {}
+    if len(parts) < 3 or parts[:2] != ["api", "v4"]:
+        return 404, {"title": "not found"}
+    resource = parts[2]
+    rest = parts[3:]
+    if resource == "leads" and not rest:
+        return 200, {"_embedded": {"leads": [_lead(x) for x in _query_ids(query, "filter[id][]")]}}
+    if resource == "leads" and rest == ["links"]:
+        links = [link for x in _query_ids(query, "filter[entity_id][]") for link in _links(x, settings)]
+        return 200, _paged("links", links, path, query)
+    if resource == "leads" and len(rest) == 1:
+        return 200, _lead(int(rest[0]))
+    if resource == "leads" and len(rest) == 2 and rest[1] == "links":
+        return 200, _paged("links", _links(int(rest[0]), settings), path, query)
+    if resource == "contacts" and not rest:
+        return 200, {"_embedded": {"contacts": [_contact(x) for x in _query_ids(query, "filter[id][]")]}}
+    if resource == "contacts" and len(rest) == 1:
+        return 200, _contact(int(rest[0]))
+    if resource == "catalogs" and len(rest) == 2 and rest[1] == "elements":
+        elements = [catalog_element(x, settings.items) for x in _query_ids(query, "filter[id][]")]
+        return 200, _paged("elements", elements, path, query)
+    if resource == "catalogs" and len(rest) == 3 and rest[1] == "elements":
+        return 200, catalog_element(int(rest[2]), settings.items)
+    return 404, {"title": "not found"}
+
+
+def _checkbox(method: str, path: str) -> Tuple[int, Any]:
+    if path == "/cashier/signin":
+        return 200, {"access_token": f"bench-{uuid.uuid4().hex}"}
+    if path in ("/shifts", "/cashier/shift"):
+        return 200, {"id": "bench-shift", "status": "OPENED"}
+    if path == "/shifts/close":
+        return 200, {"id": "bench-shift", "status": "CLOSING"}
+    if path == "/receipts/sell" and method == "POST":
+        return 201, {"id": str(uuid.uuid4()), "fiscal_code": f"BENCH{random.randint(0, 10**9)}"}
+    if path.startswith("/receipts/") and method == "GET":
+        return 200, {"id": path.rsplit("/", 1)[-1], "status": "DONE", "fiscal_code": f"BENCH{random.randint(0, 10**9)}"}
+    return 404, {"message": "not found"}
+
+
+def _novaposhta(body: Dict[str, Any]) -> Tuple[int, Any]:
+    documents = (body.get("methodProperties") or {}).get("Documents") or []
+    docs = [
+        {"Number": doc.get("DocumentNumber"), "CounterpartySenderDescription": BENCH_SENDER_NAME}
+        for doc in documents
+    ]
+    return 200, {"success": True, "data": docs, "errors": []}
+
+
+class _FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    settings: FakeSettings
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _respond(self, status: int, payload: Any) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        split = urlsplit(self.path)
+        upstream, _, path = split.path.lstrip("/").partition("/")
+        path = "/" + path
+        if upstream not in UPSTREAMS:
+            self._respond(404, {"error": "unknown upstream"})
+            return
+        latency = self.settings.latency_ms.get(upstream, 0.0)
+        if latency > 0:
+            time.sleep(random.uniform(0.5, 1.5) * latency / 1000.0)
+        if random.random() < self.settings.error_rate.get(upstream, 0.0):
+            self._respond(503, {"error": "injected"})
+            return
+        body: Dict[str, Any] = {}
+        if raw:
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = {}
+        if upstream == "amocrm":
+            status, payload = _amocrm(self.command, path, parse_qs(split.query), self.settings)
+        elif upstream == "checkbox":
+            status, payload = _checkbox(self.command, path)
+        elif upstream == "novaposhta":
+            status, payload = _novaposhta(body)
+        else:
+            status, payload = 200, {"ok": True, "result": {}}
+        self._respond(status, payload)
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PATCH = _handle
+
+
+def start_fake_upstreams(settings: FakeSettings) -> Callable[[], None]:
+    handler = type("FakeHandler", (_FakeHandler,), {"settings": settings})
+    server = _FakeServer(("127.0.0.1", 0), handler)
+    configure_env(f"http://127.0.0.1:{server.server_address[1]}")
+    # A separate process keeps the fake upstreams from competing with the app for the GIL.
+    process = multiprocessing.get_context("fork").Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.socket.close()
+    return process.terminate
+
+
+def configure_env(base: str) -> None:
+    # Must run before any project module imports config.
+    os.environ.update(
+        {
+            "AMO_BASE_URL": f"{base}/amocrm",
+            "CHECKBOX_API_BASE": f"{base}/checkbox",
+            "NP_API_URL": f"{base}/novaposhta/",
+            "TELEGRAM_API_BASE": f"{base}/telegram",
+        }
+    )
+    env = {
+        "AMO_ACCESS_TOKEN": "bench",
+        "AMO_PURCHASES_CATALOG_ID": "1",
+        "AMO_PURCHASE_ITEMS_FIELD_ID": str(BENCH_ITEMS_FIELD_ID),
+        "AMO_FIELD_CHECKBOX_STATUS": str(BENCH_CHECKBOX_STATUS_FIELD_ID),
+        "AMO_RATE_LIMIT": "0",
+        "CHECKBOX1_CASHIER_LOGIN": "bench",
+        "CHECKBOX1_CASHIER_PASSWORD": "bench",
+        "CHECKBOX1_LICENSE_KEY": "bench",
+        "NP_API_KEY_1": "bench",
+        "NP_SENDER_NAME_1": BENCH_SENDER_NAME,
+        "TELEGRAM_BOT_TOKEN": "bench",
+        "TELEGRAM_CHAT_ID": "1",
+        "TELEGRAM_RATE_PER_MINUTE": "100000",
+        "LOG_LEVEL": "WARNING",
+        "DATA_DIR": tempfile.mkdtemp(prefix="amocheckbox-bench-"),
+    }
+    for key, value in env.items():
+        os.environ.setdefault(key, value)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+class _Recorder:
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        if name == "stage_seconds":
+            key = f"stage:{labels.get('stage')}"
+        elif name == "upstream_request_seconds":
+            key = f"upstream:{labels.get('upstream')}"
+        else:
+            return
+        self.add(key, value)
+
+    def add(self, key: str, value: float) -> None:
+        with self._lock:
+            self.samples.setdefault(key, []).append(value)
+
+
+def _webhook_body(lead_ids: List[int]) -> Dict[str, Any]:
+    if len(lead_ids) == 1:
+        return {"lead_id": lead_ids[0]}
+    return {"leads": {"status": [{"id": lead_id} for lead_id in lead_ids]}}
+
+
+def _start_wsgi_app() -> Tuple[int, Callable[[], None]]:
+    from werkzeug.serving import make_server
+
+    from main import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server.server_port, server.shutdown
+
+
+def _start_asgi_app() -> Tuple[int, Callable[[], None]]:
+    import uvicorn
+
+    from asgi import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", backlog=1024))
+    thread = threading.Thread(target=server.run, name="bench-app", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop() -> None:
+        server.should_exit = True
+        thread.join(10)
+
+    return server.servers[0].sockets[0].getsockname()[1], stop
+
+
+def run_webhook_bench(args: argparse.Namespace) -> Dict[str, Any]:
+    settings = FakeSettings(args.latency, args.error_rate, args.purchases, args.items)
+    stop_upstreams = start_fake_upstreams(settings)
+
+    import requests
+
+    from metrics import add_observer
+    from telegram_notify import flush as flush_telegram
+
+    recorder = _Recorder()
+    add_observer(recorder.observe)
+    port, stop_app = _start_asgi_app() if args.engine == "asgi" else _start_wsgi_app()
+    url = f"http://127.0.0.1:{port}/amocrm/webhook"
+
+    next_id = iter(range(args.first_lead_id, args.first_lead_id + args.requests * args.leads_per_webhook))
+    id_lock = threading.Lock()
+    status_counts: Dict[str, int] = {}
+    local = threading.local()
+
+    def fire(_: int) -> None:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        with id_lock:
+            lead_ids = [next(next_id) for _ in range(args.leads_per_webhook)]
+        started = time.perf_counter()
+        try:
+            status = str(session.post(url, json=_webhook_body(lead_ids), timeout=120).status_code)
+        except requests.RequestException:
+            status = "error"
+        recorder.add("webhook", time.perf_counter() - started)
+        with id_lock:
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(fire, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    flush_telegram()
+    stop_app()
+    stop_upstreams()
+    return {
+        "engine": args.engine,
+        "requests": args.requests,
+        "leads_per_webhook": args.leads_per_webhook,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "webhooks_per_s": round(args.requests / elapsed, 2),
+        "leads_per_s": round(args.requests * args.leads_per_webhook / elapsed, 2),
+        "status_codes": status_counts,
+        "latency": {key: percentiles(values) for key, values in sorted(recorder.samples.items())},
+    }
+
+
+def _time_call(fn: Any, repeat: int) -> Dict[str, float]:
+    runs: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {"best_ms": round(min(runs) * 1000, 2), "mean_ms": round(sum(runs) / len(runs) * 1000, 2)}
+
+
+def _rate(items: int, timing: Dict[str, float]) -> int:
+    return round(items / max(timing["best_ms"] / 1000, 1e-9))
+
+
+def run_micro_bench(args: argparse.Namespace) -> Dict[str, Any]:
+    configure_env("http://127.0.0.1:9")
+
+    from amocrm_leads import extract_items_from_catalog_element
+    from checkbox_service import build_goods_and_sum
+    from log_setup import configure_logging
+    from models import PurchaseItem, to_milli, to_minor
+
+    configure_logging()
+    purchases = [
+        PurchaseItem(
+            name=f"Товар {idx + 1}",
+            quantity_milli=to_milli(Decimal(1 + idx % 3)),
+            price_minor=to_minor(Decimal(f"{100 + idx % 50}.50")),
+        )
+        for idx in range(args.items)
+    ]
+    element = catalog_element(1, args.items)
+    goods_timing = _time_call(lambda: build_goods_and_sum(purchases), args.repeat)
+    extract_timing = _time_call(lambda: extract_items_from_catalog_element(element), args.repeat)
+    return {
+        "items": args.items,
+        "repeat": args.repeat,
+        "build_goods_and_sum": {**goods_timing, "items_per_s": _rate(args.items, goods_timing)},
+        "extract_items_from_catalog_element": {**extract_timing, "items_per_s": _rate(args.items, extract_timing)},
+    }
+
+
+def _upstream_value(item: str) -> Tuple[str, float]:
+    name, _, value = item.partition("=")
+    if name not in UPSTREAMS:
+        raise argparse.ArgumentTypeError(f"unknown upstream {name!r}, expected one of {', '.join(UPSTREAMS)}")
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid value {value!r} for {name}") from None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks against local fake upstreams")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    webhook = sub.add_parser("webhook", help="drive /amocrm/webhook through the full pipeline")
+    webhook.add_argument("--engine", choices=("wsgi", "asgi"), default="wsgi")
+    webhook.add_argument("--requests", type=int, default=200)
+    webhook.add_argument("--concurrency", type=int, default=8)
+    webhook.add_argument("--leads-per-webhook", type=int, default=1)
+    webhook.add_argument("--purchases", type=int, default=3, help="catalog elements linked to each lead")
+    webhook.add_argument("--items", type=int, default=2, help="items inside each catalog element")
+    webhook.add_argument(
+        "--latency", action="append", type=_upstream_value, metavar="UPSTREAM=MS", help="mean upstream latency"
+    )
+    webhook.add_argument(
+        "--error-rate", action="append", type=_upstream_value, metavar="UPSTREAM=RATE", help="share of 503 responses"
+    )
+    webhook.add_argument("--first-lead-id", type=int, default=int(time.time()) % 1000000 * 100)
+    micro = sub.add_parser("micro", help="microbenchmarks for receipt building and catalog parsing")
+    micro.add_argument("--items", type=int, default=100000)
+    micro.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.mode == "webhook":
+        args.latency = dict(args.latency or [])
+        args.error_rate = dict(args.error_rate or [])
+        report = run_webhook_bench(args)
+    else:
+        report = run_micro_bench(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from config import AMO_CATALOG_CACHE_MAX, AMO_CATALOG_CACHE_TTL
+from models import PurchaseItem
+
+
+class _Entry(NamedTuple):
+    updated_at: int
+    stored_at: float
+    items: List[PurchaseItem]
+
+
+_entries: "OrderedDict[int, _Entry]" = OrderedDict()
+_lock = threading.Lock()
+_counters: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_items(element_id: int) -> Optional[List[PurchaseItem]]:
+    now = time.time()
+    with _lock:
+        entry = _entries.get(element_id)
+        if entry is None or now - entry.stored_at > AMO_CATALOG_CACHE_TTL:
+            if entry is not None:
+                del _entries[element_id]
+            _counters["misses"] += 1
+            return None
+        _entries.move_to_end(element_id)
+        _counters["hits"] += 1
+        return list(entry.items)
+
+
+def put_items(element_id: int, updated_at: Any, items: List[PurchaseItem]) -> None:
+    try:
+        updated = int(updated_at or 0)
+    except (TypeError, ValueError):
+        updated = 0
+    with _lock:
+        current = _entries.get(element_id)
+        if current is not None and current.updated_at > updated:
+            return
+        _entries[element_id] = _Entry(updated, time.time(), list(items))
+        _entries.move_to_end(element_id)
+        while len(_entries) > AMO_CATALOG_CACHE_MAX:
+            _entries.popitem(last=False)
+            _counters["evictions"] += 1
+
+
+def invalidate(element_id: int) -> None:
+    with _lock:
+        _entries.pop(element_id, None)
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        result = dict(_counters)
+        result["size"] = len(_entries)
+    return result
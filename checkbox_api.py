@@ -1,33 +1,49 @@
 import logging
+import threading
+import time
 from typing import Any, Dict, Optional
 
-import requests
-
-from config import (
-    CHECKBOX_API_BASE,
-    CHECKBOX_CLIENT_NAME,
-    CHECKBOX_CLIENT_VERSION,
-    CHECKBOX_SEND_EMAIL,
-    CHECKBOX_PROFILES,
-    CheckboxProfile,
+from checkbox_common import (
+    CheckboxApiError,
+    adopt_shared_token,
+    is_already_open,
+    is_fresh,
+    needs_shift,
+    parse_response,
+    record_shift_state,
+    request_headers,
+    sell_body,
+    store_token,
+    token_cache,
+    token_from_signin,
 )
+from config import CHECKBOX_API_BASE, CHECKBOX_PROFILES, CheckboxProfile
+from http_pool import http_request
+from token_store import discard as discard_shared_token
 
 logger = logging.getLogger("checkbox_api")
 
 
-class CheckboxApiError(Exception):
-    def __init__(self, status_code: int, message: str, payload: Any = None) -> None:
-        super().__init__(message)
-        self.status_code = status_code
-        self.payload = payload
+_token_locks: Dict[str, threading.Lock] = {}
+_token_locks_guard = threading.Lock()
 
 
-def _base_headers() -> Dict[str, str]:
-    return {
-        "Accept": "application/json",
-        "X-Client-Name": CHECKBOX_CLIENT_NAME,
-        "X-Client-Version": CHECKBOX_CLIENT_VERSION,
-    }
+def _send(
+    method: str,
+    url: str,
+    token: Optional[str],
+    json: Optional[Any],
+    license_key: Optional[str],
+    profile_id: Optional[str],
+) -> Any:
+    return http_request(
+        "checkbox",
+        method,
+        url,
+        breaker_key=profile_id or "",
+        headers=request_headers(token, json, license_key),
+        json=json,
+    )
 
 
 def _http(
@@ -36,38 +52,16 @@ def _http(
     token: Optional[str] = None,
     json: Optional[Any] = None,
     license_key: Optional[str] = None,
+    profile_id: Optional[str] = None,
 ) -> Any:
     url = f"{CHECKBOX_API_BASE}{path}"
-    headers = _base_headers()
-    if json is not None:
-        headers["Content-Type"] = "application/json"
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    if license_key:
-        headers["X-License-Key"] = license_key
     logger.debug("checkbox.http", extra={"method": method, "url": url})
-    resp = requests.request(method, url, headers=headers, json=json, timeout=5)
-    try:
-        data = resp.json()
-    except Exception:
-        data = resp.text
-    if resp.status_code >= 400:
-        msg_text = ""
-        if isinstance(data, dict):
-            msg_text = str(data.get("message") or data)
-        else:
-            msg_text = str(data)
-        logger.error(
-            "checkbox.error",
-            extra={
-                "status_code": resp.status_code,
-                "api_message": msg_text,
-                "api_preview": str(data)[:500],
-                "url": url,
-            },
-        )
-        raise CheckboxApiError(resp.status_code, msg_text, data)
-    return data
+    resp = _send(method, url, token, json, license_key, profile_id)
+    if resp.status_code == 401 and token and profile_id:
+        logger.info("checkbox.http.token_rejected", extra={"profile_id": profile_id, "url": url})
+        invalidate_cashier_token(profile_id, token)
+        resp = _send(method, url, get_cashier_token(profile_id), json, license_key, profile_id)
+    return parse_response(resp, url)
 
 
 def get_profile(profile_id: str) -> CheckboxProfile:
@@ -81,43 +75,98 @@ def sign_in_for_profile(profile_id: str) -> str:
     profile = get_profile(profile_id)
     body = {"login": profile.login, "password": profile.password}
     logger.debug("checkbox.signin.start", extra={"profile_id": profile_id})
-    data = _http("POST", "/cashier/signin", json=body)
-    token = ""
-    if isinstance(data, dict):
-        token = str(data.get("access_token") or data.get("token") or "")
-    if not token:
-        raise CheckboxApiError(500, "checkbox signin: no token in response", data)
+    token = token_from_signin(_http("POST", "/cashier/signin", json=body, profile_id=profile_id))
     logger.debug("checkbox.signin.ok", extra={"profile_id": profile_id})
     return token
 
 
+def _token_lock(profile_id: str) -> threading.Lock:
+    with _token_locks_guard:
+        lock = _token_locks.get(profile_id)
+        if lock is None:
+            lock = threading.Lock()
+            _token_locks[profile_id] = lock
+        return lock
+
+
+def get_cashier_token(profile_id: str) -> str:
+    now = time.time()
+    cached = token_cache.get(profile_id)
+    if is_fresh(cached, now):
+        return cached.token
+    lock = _token_lock(profile_id)
+    if cached is not None and cached.expires_at > now:
+        # Still valid but close to expiry: one thread refreshes, the rest keep using it.
+        if not lock.acquire(blocking=False):
+            return cached.token
+    else:
+        lock.acquire()
+    try:
+        cached = token_cache.get(profile_id)
+        if is_fresh(cached, time.time()):
+            return cached.token
+        shared = adopt_shared_token(profile_id)
+        if shared:
+            return shared
+        token = sign_in_for_profile(profile_id)
+        store_token(profile_id, token)
+        return token
+    finally:
+        lock.release()
+
+
+def invalidate_cashier_token(profile_id: str, token: Optional[str] = None) -> None:
+    with _token_lock(profile_id):
+        cached = token_cache.get(profile_id)
+        if cached is not None and (token is None or cached.token == token):
+            del token_cache[profile_id]
+    discard_shared_token(profile_id, token)
+
+
 def open_shift_for_profile(token: str, profile_id: str) -> Any:
     profile = get_profile(profile_id)
-    data = _http("POST", "/shifts", token=token, json={}, license_key=profile.license_key)
+    data = _http(
+        "POST", "/shifts", token=token, json={}, license_key=profile.license_key, profile_id=profile_id
+    )
     return data
 
 
 def close_shift_for_profile(token: str, profile_id: str) -> Any:
     profile = get_profile(profile_id)
-    data = _http("POST", "/shifts/close", token=token, json={}, license_key=profile.license_key)
+    data = _http(
+        "POST", "/shifts/close", token=token, json={}, license_key=profile.license_key, profile_id=profile_id
+    )
     return data
 
 
+def get_current_shift_for_profile(token: str, profile_id: str) -> Any:
+    profile = get_profile(profile_id)
+    return _http("GET", "/cashier/shift", token=token, license_key=profile.license_key, profile_id=profile_id)
+
+
+def get_receipt_for_profile(token: str, profile_id: str, receipt_id: str) -> Any:
+    profile = get_profile(profile_id)
+    return _http(
+        "GET", f"/receipts/{receipt_id}", token=token, license_key=profile.license_key, profile_id=profile_id
+    )
+
+
 def ensure_shift_for_profile(token: str, profile_id: str) -> None:
-    try:
-        open_shift_for_profile(token, profile_id)
+    if not needs_shift(profile_id):
         return
+    try:
+        data = open_shift_for_profile(token, profile_id)
     except CheckboxApiError as e:
-        msg_lower = str(e).lower()
-        if (
-            "вже працює" in msg_lower
-            or "already" in msg_lower
-            or "відкрито зміну" in msg_lower
-            or "зайнята іншим касиром" in msg_lower
-        ):
-            logger.debug("checkbox.ensure_shift.already_open", extra={"profile_id": profile_id})
-            return
-        raise
+        if not is_already_open(e):
+            raise
+        logger.debug("checkbox.ensure_shift.already_open", extra={"profile_id": profile_id})
+        try:
+            data = get_current_shift_for_profile(token, profile_id)
+        except CheckboxApiError:
+            data = None
+        record_shift_state(profile_id, data, "OPENED")
+        return
+    record_shift_state(profile_id, data, "OPENED")
 
 
 def create_sell_receipt_for_profile(
@@ -128,31 +177,16 @@ def create_sell_receipt_for_profile(
     discount_minor: int = 0,
     email: Optional[str] = None,
     payment_type: str = "CASHLESS",
+    receipt_id: Optional[str] = None,
 ) -> Any:
     profile = get_profile(profile_id)
-
-    payments_value = max(0, int(total_minor) - max(0, int(discount_minor)))
-    payments = [
-        {
-            "type": payment_type,
-            "value": payments_value,
-            "label": "Оплата",
-        }
-    ]
-    body: Dict[str, Any] = {
-        "goods": goods,
-        "payments": payments,
-    }
-    if discount_minor > 0:
-        body["discounts"] = [
-            {
-                "type": "DISCOUNT",
-                "mode": "VALUE",
-                "value": int(discount_minor),
-                "name": "Знижка",
-            }
-        ]
-    if CHECKBOX_SEND_EMAIL and email:
-        body["delivery"] = {"emails": [email]}
-    data = _http("POST", "/receipts/sell", token=token, json=body, license_key=profile.license_key)
+    body = sell_body(goods, total_minor, discount_minor, email, payment_type, receipt_id)
+    data = _http(
+        "POST",
+        "/receipts/sell",
+        token=token,
+        json=body,
+        license_key=profile.license_key,
+        profile_id=profile_id,
+    )
     return data
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from async_http import http_request
+from checkbox_api import get_profile, invalidate_cashier_token
+from checkbox_common import (
+    CheckboxApiError,
+    adopt_shared_token,
+    is_already_open,
+    is_fresh,
+    needs_shift,
+    parse_response,
+    record_shift_state,
+    request_headers,
+    sell_body,
+    store_token,
+    token_cache,
+    token_from_signin,
+)
+from config import CHECKBOX_API_BASE
+
+logger = logging.getLogger("checkbox_api")
+
+_token_locks: Dict[str, asyncio.Lock] = {}
+_shift_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def _send(
+    method: str,
+    url: str,
+    token: Optional[str],
+    json: Optional[Any],
+    license_key: Optional[str],
+    profile_id: Optional[str],
+) -> Any:
+    return await http_request(
+        "checkbox",
+        method,
+        url,
+        breaker_key=profile_id or "",
+        headers=request_headers(token, json, license_key),
+        json=json,
+    )
+
+
+async def _http(
+    method: str,
+    path: str,
+    token: Optional[str] = None,
+    json: Optional[Any] = None,
+    license_key: Optional[str] = None,
+    profile_id: Optional[str] = None,
+) -> Any:
+    url = f"{CHECKBOX_API_BASE}{path}"
+    logger.debug("checkbox.http", extra={"method": method, "url": url})
+    resp = await _send(method, url, token, json, license_key, profile_id)
+    if resp.status_code == 401 and token and profile_id:
+        logger.info("checkbox.http.token_rejected", extra={"profile_id": profile_id, "url": url})
+        await asyncio.to_thread(invalidate_cashier_token, profile_id, token)
+        resp = await _send(method, url, await get_cashier_token(profile_id), json, license_key, profile_id)
+    return parse_response(resp, url)
+
+
+async def sign_in_for_profile(profile_id: str) -> str:
+    profile = get_profile(profile_id)
+    body = {"login": profile.login, "password": profile.password}
+    logger.debug("checkbox.signin.start", extra={"profile_id": profile_id})
+    token = token_from_signin(await _http("POST", "/cashier/signin", json=body, profile_id=profile_id))
+    logger.debug("checkbox.signin.ok", extra={"profile_id": profile_id})
+    return token
+
+
+async def get_cashier_token(profile_id: str) -> str:
+    cached = token_cache.get(profile_id)
+    if is_fresh(cached, time.time()):
+        return cached.token
+    lock = _token_locks.setdefault(profile_id, asyncio.Lock())
+    if cached is not None and cached.expires_at > time.time() and lock.locked():
+        # Still valid but close to expiry and another task is already refreshing it.
+        return cached.token
+    async with lock:
+        cached = token_cache.get(profile_id)
+        if is_fresh(cached, time.time()):
+            return cached.token
+        shared = await asyncio.to_thread(adopt_shared_token, profile_id)
+        if shared:
+            return shared
+        token = await sign_in_for_profile(profile_id)
+        await asyncio.to_thread(store_token, profile_id, token)
+        return token
+
+
+async def open_shift_for_profile(token: str, profile_id: str) -> Any:
+    profile = get_profile(profile_id)
+    return await _http(
+        "POST", "/shifts", token=token, json={}, license_key=profile.license_key, profile_id=profile_id
+    )
+
+
+async def get_current_shift_for_profile(token: str, profile_id: str) -> Any:
+    profile = get_profile(profile_id)
+    return await _http(
+        "GET", "/cashier/shift", token=token, license_key=profile.license_key, profile_id=profile_id
+    )
+
+
+async def ensure_shift_for_profile(token: str, profile_id: str) -> None:
+    if not needs_shift(profile_id):
+        return
+    async with _shift_locks.setdefault(profile_id, asyncio.Lock()):
+        if not needs_shift(profile_id):
+            return
+        try:
+            data = await open_shift_for_profile(token, profile_id)
+        except CheckboxApiError as e:
+            if not is_already_open(e):
+                raise
+            logger.debug("checkbox.ensure_shift.already_open", extra={"profile_id": profile_id})
+            try:
+                data = await get_current_shift_for_profile(token, profile_id)
+            except CheckboxApiError:
+                data = None
+        record_shift_state(profile_id, data, "OPENED")
+
+
+async def create_sell_receipt_for_profile(
+    token: str,
+    profile_id: str,
+    goods: Any,
+    total_minor: int,
+    discount_minor: int = 0,
+    email: Optional[str] = None,
+    payment_type: str = "CASHLESS",
+    receipt_id: Optional[str] = None,
+) -> Any:
+    profile = get_profile(profile_id)
+    body = sell_body(goods, total_minor, discount_minor, email, payment_type, receipt_id)
+    return await _http(
+        "POST",
+        "/receipts/sell",
+        token=token,
+        json=body,
+        license_key=profile.license_key,
+        profile_id=profile_id,
+    )
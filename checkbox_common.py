@@ -0,0 +1,223 @@
+import base64
+import json as jsonlib
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from config import (
+    CHECKBOX_CLIENT_NAME,
+    CHECKBOX_CLIENT_VERSION,
+    CHECKBOX_SEND_EMAIL,
+    CHECKBOX_TOKEN_REFRESH_MARGIN,
+    CHECKBOX_TOKEN_TTL,
+)
+from time_window import TZ, last_close_boundary
+from token_store import load as load_shared_token, save as save_shared_token
+
+logger = logging.getLogger("checkbox_api")
+
+
+class CheckboxApiError(Exception):
+    def __init__(self, status_code: int, message: str, payload: Any = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload
+
+
+def _base_headers() -> Dict[str, str]:
+    return {
+        "Accept": "application/json",
+        "X-Client-Name": CHECKBOX_CLIENT_NAME,
+        "X-Client-Version": CHECKBOX_CLIENT_VERSION,
+    }
+
+
+class CachedToken(NamedTuple):
+    token: str
+    expires_at: float
+
+
+class ShiftState(NamedTuple):
+    shift_id: str
+    status: str
+    checked_at: datetime
+
+
+token_cache: Dict[str, CachedToken] = {}
+
+_shift_states: Dict[str, ShiftState] = {}
+_shift_lock = threading.Lock()
+
+_SHIFT_ALREADY_OPEN_MARKERS = ("вже працює", "already", "відкрито зміну", "зайнята іншим касиром")
+_SHIFT_ERROR_MARKERS = ("змін", "shift")
+
+
+def request_headers(token: Optional[str], json: Optional[Any], license_key: Optional[str]) -> Dict[str, str]:
+    headers = _base_headers()
+    if json is not None:
+        headers["Content-Type"] = "application/json"
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if license_key:
+        headers["X-License-Key"] = license_key
+    return headers
+
+
+def parse_response(resp: Any, url: str) -> Any:
+    try:
+        data = resp.json()
+    except Exception:
+        data = resp.text
+    if resp.status_code >= 400:
+        msg_text = ""
+        if isinstance(data, dict):
+            msg_text = str(data.get("message") or data)
+        else:
+            msg_text = str(data)
+        logger.error(
+            "checkbox.error",
+            extra={
+                "status_code": resp.status_code,
+                "api_message": msg_text,
+                "api_preview": str(data)[:500],
+                "url": url,
+            },
+        )
+        raise CheckboxApiError(resp.status_code, msg_text, data)
+    return data
+
+
+def token_from_signin(data: Any) -> str:
+    token = ""
+    if isinstance(data, dict):
+        token = str(data.get("access_token") or data.get("token") or "")
+    if not token:
+        raise CheckboxApiError(500, "checkbox signin: no token in response", data)
+    return token
+
+
+def _token_expires_at(token: str, now: float) -> float:
+    parts = token.split(".")
+    if len(parts) == 3:
+        try:
+            payload = parts[1] + "=" * (-len(parts[1]) % 4)
+            claims = jsonlib.loads(base64.urlsafe_b64decode(payload))
+            exp = float(claims.get("exp") or 0)
+            if exp > now:
+                return exp
+        except Exception:
+            pass
+    return now + CHECKBOX_TOKEN_TTL
+
+
+def is_fresh(cached: Optional[CachedToken], now: float) -> bool:
+    return cached is not None and cached.expires_at - CHECKBOX_TOKEN_REFRESH_MARGIN > now
+
+
+def store_token(profile_id: str, token: str) -> None:
+    cached = CachedToken(token, _token_expires_at(token, time.time()))
+    token_cache[profile_id] = cached
+    save_shared_token(profile_id, cached.token, cached.expires_at)
+    logger.info("checkbox.token.refreshed", extra={"profile_id": profile_id})
+
+
+def adopt_shared_token(profile_id: str) -> Optional[str]:
+    shared = load_shared_token(profile_id)
+    if shared is None:
+        return None
+    cached = CachedToken(*shared)
+    if not is_fresh(cached, time.time()):
+        return None
+    token_cache[profile_id] = cached
+    logger.debug("checkbox.token.shared", extra={"profile_id": profile_id})
+    return cached.token
+
+
+def record_shift_state(profile_id: str, data: Any, default_status: str) -> ShiftState:
+    shift_id = ""
+    status = default_status
+    if isinstance(data, dict):
+        shift_id = str(data.get("id") or "")
+        status = str(data.get("status") or default_status).upper()
+    state = ShiftState(shift_id=shift_id, status=status, checked_at=datetime.now(TZ))
+    with _shift_lock:
+        _shift_states[profile_id] = state
+    logger.debug(
+        "checkbox.shift_state.recorded",
+        extra={"profile_id": profile_id, "shift_id": shift_id, "status": status},
+    )
+    return state
+
+
+def get_shift_state(profile_id: str) -> Optional[ShiftState]:
+    state = _shift_states.get(profile_id)
+    if state is None:
+        return None
+    if state.checked_at <= last_close_boundary():
+        invalidate_shift_state(profile_id)
+        return None
+    return state
+
+
+def invalidate_shift_state(profile_id: str) -> None:
+    with _shift_lock:
+        _shift_states.pop(profile_id, None)
+
+
+def mark_shift_closed(profile_id: str) -> None:
+    record_shift_state(profile_id, None, "CLOSED")
+
+
+def is_shift_error(error: CheckboxApiError) -> bool:
+    if error.status_code not in (400, 409, 422):
+        return False
+    msg_lower = str(error).lower()
+    return any(marker in msg_lower for marker in _SHIFT_ERROR_MARKERS)
+
+
+def needs_shift(profile_id: str) -> bool:
+    state = get_shift_state(profile_id)
+    return state is None or state.status in ("CLOSING", "CLOSED")
+
+
+def is_already_open(error: CheckboxApiError) -> bool:
+    msg_lower = str(error).lower()
+    return any(marker in msg_lower for marker in _SHIFT_ALREADY_OPEN_MARKERS)
+
+
+def sell_body(
+    goods: Any,
+    total_minor: int,
+    discount_minor: int,
+    email: Optional[str],
+    payment_type: str,
+    receipt_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    payments_value = max(0, int(total_minor) - max(0, int(discount_minor)))
+    payments = [
+        {
+            "type": payment_type,
+            "value": payments_value,
+            "label": "Оплата",
+        }
+    ]
+    body: Dict[str, Any] = {
+        "goods": goods,
+        "payments": payments,
+    }
+    if receipt_id:
+        body["id"] = receipt_id
+    if discount_minor > 0:
+        body["discounts"] = [
+            {
+                "type": "DISCOUNT",
+                "mode": "VALUE",
+                "value": int(discount_minor),
+                "name": "Знижка",
+            }
+        ]
+    if CHECKBOX_SEND_EMAIL and email:
+        body["delivery"] = {"emails": [email]}
+    return body
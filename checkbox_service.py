@@ -1,105 +1,119 @@
 import logging
-from decimal import Decimal
-from typing import Any, Dict, List, Tuple
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-from config import MONEY_QUANT
 from checkbox_api import (
-    sign_in_for_profile,
+    get_cashier_token,
     ensure_shift_for_profile,
     create_sell_receipt_for_profile,
 )
+from checkbox_common import CheckboxApiError, invalidate_shift_state, is_shift_error
+from circuit_breaker import CircuitOpenError
+from metrics import stage
+from models import LeadData, PurchaseItem, ReceiptLine
 from time_window import is_receipt_allowed_now
 
+MAINTENANCE_WINDOW = "maintenance_window"
+
 logger = logging.getLogger("checkbox_service")
 
 
-def to_minor(amount: Decimal) -> int:
-    if amount is None:
-        return 0
-    try:
-        value = Decimal(amount).quantize(MONEY_QUANT)
-    except Exception:
-        value = Decimal("0")
-    return max(0, int(value * 100))
+class SellOutcomeUnknown(Exception):
+    def __init__(self, receipt_id: str, error: Exception) -> None:
+        super().__init__(f"sell outcome unknown (id: {receipt_id}): {error}")
+        self.receipt_id = receipt_id
+        self.error = error
 
 
-def line_total_minor(price_minor: int, quantity: Decimal) -> int:
-    try:
-        q = Decimal(quantity)
-    except Exception:
-        q = Decimal("0")
-    if q <= 0:
+def is_ambiguous_sell_error(error: Exception) -> bool:
+    # Without a 4xx answer the receipt may already be fiscalized; only the reconciler can tell.
+    if isinstance(error, CircuitOpenError):
+        return False
+    return not isinstance(error, CheckboxApiError) or error.status_code >= 500
+
+
+def line_total_minor(price_minor: int, quantity_milli: int) -> int:
+    if quantity_milli <= 0:
         return 0
-    q1000 = int((q * 1000).to_integral_value())
-    return max(0, price_minor * q1000 // 1000)
+    return max(0, price_minor * quantity_milli // 1000)
 
 
-def build_goods_and_sum(purchases: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
-    goods: List[Dict[str, Any]] = []
+def build_receipt_lines(purchases: Sequence[PurchaseItem]) -> Tuple[List[ReceiptLine], int]:
+    lines: List[ReceiptLine] = []
     total_minor = 0
-    logger.info(f"checkbox.build_goods.start purchases_count={len(purchases)}")
+    debug = logger.isEnabledFor(logging.DEBUG)
     for idx, p in enumerate(purchases):
-        name = p.get("name") or f"Товар {idx + 1}"
-        quantity = p.get("quantity") or 1
-        price = p.get("price") or Decimal("0")
-        price_minor = to_minor(price)
-        logger.info(
-            f"checkbox.build_goods.item idx={idx} name={name} quantity={quantity} "
-            f"price={price} price_minor={price_minor}"
-        )
-        if price_minor <= 0 or quantity <= 0:
+        name = p.name or f"Товар {idx + 1}"
+        if debug:
+            logger.debug(
+                "checkbox.build_goods.item idx=%s name=%s quantity_milli=%s price_minor=%s",
+                idx,
+                name,
+                p.quantity_milli,
+                p.price_minor,
+            )
+        if p.price_minor <= 0 or p.quantity_milli <= 0:
             continue
-        sum_minor = line_total_minor(price_minor, Decimal(str(quantity)))
+        sum_minor = line_total_minor(p.price_minor, p.quantity_milli)
         total_minor += sum_minor
-        goods.append(
-            {
-                "good": {
-                    "code": str(idx + 1),
-                    "name": name,
-                    "price": price_minor,
-                    "tax": [8],
-                },
-                "quantity": int((Decimal(str(quantity)) * 1000).to_integral_value()),
-                "is_return": False,
-            }
+        lines.append(
+            ReceiptLine(
+                code=str(idx + 1),
+                name=name,
+                price_minor=p.price_minor,
+                quantity_milli=p.quantity_milli,
+                sum_minor=sum_minor,
+            )
         )
-    logger.info(f"checkbox.build_goods.done goods_count={len(goods)} total_minor={total_minor}")
-    return goods, total_minor
+    logger.info(
+        "checkbox.build_goods.done purchases_count=%s goods_count=%s total_minor=%s",
+        len(purchases),
+        len(lines),
+        total_minor,
+    )
+    return lines, total_minor
+
 
+def build_goods_and_sum(purchases: Sequence[PurchaseItem]) -> Tuple[List[Dict[str, Any]], int]:
+    lines, total_minor = build_receipt_lines(purchases)
+    return [line.to_good() for line in lines], total_minor
 
-def create_receipt_for_lead_data(lead_data: Dict[str, Any], profile_id: str) -> Dict[str, Any]:
+
+def prepare_receipt(
+    lead_data: LeadData, profile_id: str
+) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]], int, int]:
     if not is_receipt_allowed_now():
         logger.info("checkbox.create_receipt.blocked_by_time_window")
-        return {"receipt_id": "", "receipt_number": "", "error": "maintenance_window"}
-    purchases = lead_data.get("purchases") or []
-    email = lead_data.get("email")
-    discount = lead_data.get("discount") or Decimal("0")
+        return {"receipt_id": "", "receipt_number": "", "error": MAINTENANCE_WINDOW}, [], 0, 0
+    purchases = lead_data.purchases
+    email = lead_data.email
     logger.info(
-        f"checkbox.create_receipt.start lead_id={lead_data.get('id')} profile_id={profile_id} "
-        f"purchases_count={len(purchases)} discount={discount} email={email}"
+        f"checkbox.create_receipt.start lead_id={lead_data.id} profile_id={profile_id} "
+        f"purchases_count={len(purchases)} discount_minor={lead_data.discount_minor} email={email}"
     )
     goods, total_minor = build_goods_and_sum(purchases)
     if not goods or total_minor <= 0:
         logger.error(
-            f"checkbox.create_receipt.no_goods lead_id={lead_data.get('id')} "
+            f"checkbox.create_receipt.no_goods lead_id={lead_data.id} "
             f"purchases_count={len(purchases)} goods_count={len(goods)} total_minor={total_minor}"
         )
-        return {"receipt_id": "", "receipt_number": "", "error": "no_goods_or_zero_total"}
-    discount_minor = to_minor(discount)
+        return {"receipt_id": "", "receipt_number": "", "error": "no_goods_or_zero_total"}, [], 0, 0
+    discount_minor = lead_data.discount_minor
     if discount_minor > total_minor:
         discount_minor = total_minor
-    token = sign_in_for_profile(profile_id)
-    ensure_shift_for_profile(token, profile_id)
     logger.debug(
         "checkbox.create_receipt.request",
         extra={
-            "lead_id": lead_data.get("id"),
+            "lead_id": lead_data.id,
             "profile_id": profile_id,
             "total_minor": total_minor,
             "discount_minor": discount_minor,
         },
     )
-    data = create_sell_receipt_for_profile(token, profile_id, goods, total_minor, discount_minor, email=email)
+    return None, goods, total_minor, discount_minor
+
+
+def receipt_result(lead_data: LeadData, profile_id: str, data: Any) -> Dict[str, Any]:
     if isinstance(data, dict):
         receipt_id = str(data.get("id") or data.get("receipt_id") or "")
         number = str(data.get("fiscal_code") or data.get("number") or "")
@@ -107,7 +121,54 @@ def create_receipt_for_lead_data(lead_data: Dict[str, Any], profile_id: str) ->
         receipt_id = ""
         number = ""
     logger.info(
-        f"checkbox.create_receipt.done lead_id={lead_data.get('id')} profile_id={profile_id} "
+        f"checkbox.create_receipt.done lead_id={lead_data.id} profile_id={profile_id} "
         f"receipt_id={receipt_id} receipt_number={number}"
     )
     return {"receipt_id": receipt_id, "receipt_number": number, "raw": data}
+
+
+def _sell(
+    token: str,
+    profile_id: str,
+    goods: List[Dict[str, Any]],
+    total_minor: int,
+    discount_minor: int,
+    email: Optional[str],
+    receipt_id: str,
+) -> Any:
+    try:
+        with stage("sell"):
+            return create_sell_receipt_for_profile(
+                token, profile_id, goods, total_minor, discount_minor, email=email, receipt_id=receipt_id
+            )
+    except Exception as e:
+        if is_ambiguous_sell_error(e):
+            raise SellOutcomeUnknown(receipt_id, e) from e
+        raise
+
+
+def create_receipt_for_lead_data(lead_data: LeadData, profile_id: str) -> Dict[str, Any]:
+    error, goods, total_minor, discount_minor = prepare_receipt(lead_data, profile_id)
+    if error:
+        return error
+    email = lead_data.email
+    receipt_id = str(uuid.uuid4())
+    with stage("signin"):
+        token = get_cashier_token(profile_id)
+    with stage("shift"):
+        ensure_shift_for_profile(token, profile_id)
+    try:
+        data = _sell(token, profile_id, goods, total_minor, discount_minor, email, receipt_id)
+    except CheckboxApiError as e:
+        if not is_shift_error(e):
+            raise
+        logger.info(
+            f"checkbox.create_receipt.shift_recheck lead_id={lead_data.id} profile_id={profile_id} error={e}"
+        )
+        invalidate_shift_state(profile_id)
+        with stage("signin"):
+            token = get_cashier_token(profile_id)
+        with stage("shift"):
+            ensure_shift_for_profile(token, profile_id)
+        data = _sell(token, profile_id, goods, total_minor, discount_minor, email, receipt_id)
+    return receipt_result(lead_data, profile_id, data)
@@ -0,0 +1,58 @@
+import logging
+import uuid
+from typing import Any, Dict, List, Optional
+
+from checkbox_common import CheckboxApiError, invalidate_shift_state, is_shift_error
+from checkbox_api_async import create_sell_receipt_for_profile, ensure_shift_for_profile, get_cashier_token
+from checkbox_service import SellOutcomeUnknown, is_ambiguous_sell_error, prepare_receipt, receipt_result
+from metrics import stage
+from models import LeadData
+
+logger = logging.getLogger("checkbox_service")
+
+
+async def _sell(
+    token: str,
+    profile_id: str,
+    goods: List[Dict[str, Any]],
+    total_minor: int,
+    discount_minor: int,
+    email: Optional[str],
+    receipt_id: str,
+) -> Any:
+    try:
+        with stage("sell"):
+            return await create_sell_receipt_for_profile(
+                token, profile_id, goods, total_minor, discount_minor, email=email, receipt_id=receipt_id
+            )
+    except Exception as e:
+        if is_ambiguous_sell_error(e):
+            raise SellOutcomeUnknown(receipt_id, e) from e
+        raise
+
+
+async def create_receipt_for_lead_data(lead_data: LeadData, profile_id: str) -> Dict[str, Any]:
+    error, goods, total_minor, discount_minor = prepare_receipt(lead_data, profile_id)
+    if error:
+        return error
+    email = lead_data.email
+    receipt_id = str(uuid.uuid4())
+    with stage("signin"):
+        token = await get_cashier_token(profile_id)
+    with stage("shift"):
+        await ensure_shift_for_profile(token, profile_id)
+    try:
+        data = await _sell(token, profile_id, goods, total_minor, discount_minor, email, receipt_id)
+    except CheckboxApiError as e:
+        if not is_shift_error(e):
+            raise
+        logger.info(
+            f"checkbox.create_receipt.shift_recheck lead_id={lead_data.id} profile_id={profile_id} error={e}"
+        )
+        invalidate_shift_state(profile_id)
+        with stage("signin"):
+            token = await get_cashier_token(profile_id)
+        with stage("shift"):
+            await ensure_shift_for_profile(token, profile_id)
+        data = await _sell(token, profile_id, goods, total_minor, discount_minor, email, receipt_id)
+    return receipt_result(lead_data, profile_id, data)
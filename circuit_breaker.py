@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from config import (
+    BREAKER_FAILURE_RATE,
+    BREAKER_HALF_OPEN_CALLS,
+    BREAKER_MIN_CALLS,
+    BREAKER_OPEN_SECONDS,
+    BREAKER_WINDOW,
+)
+from metrics import inc
+
+logger = logging.getLogger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"circuit {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > BREAKER_WINDOW:
+            _, ok = self._calls.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def _transition(self, state: str, now: float) -> None:
+        logger.warning(
+            f"circuit_breaker.{state} name={self.name} failures={self._failures} calls={len(self._calls)}"
+        )
+        inc("circuit_breaker_transitions_total", breaker=self.name, state=state)
+        self.state = state
+        self._trials = 0
+        self._opened_at = now
+        if state != OPEN:
+            self._calls.clear()
+            self._failures = 0
+
+    def before_call(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                retry_after = self._opened_at + BREAKER_OPEN_SECONDS - now
+                if retry_after > 0:
+                    inc("circuit_breaker_rejections_total", breaker=self.name)
+                    raise CircuitOpenError(self.name, retry_after)
+                self._transition(HALF_OPEN, now)
+            if self.state == HALF_OPEN:
+                if self._trials >= BREAKER_HALF_OPEN_CALLS:
+                    if now - self._opened_at < BREAKER_OPEN_SECONDS:
+                        inc("circuit_breaker_rejections_total", breaker=self.name)
+                        raise CircuitOpenError(self.name, 1.0)
+                    # The trial calls never reported back (cancelled or hung); let new ones through.
+                    self._trials = 0
+                    self._opened_at = now
+                self._trials += 1
+
+    def record(self, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED if ok else OPEN, now)
+                return
+            self._calls.append((now, ok))
+            if not ok:
+                self._failures += 1
+            self._trim(now)
+            if (
+                self.state == CLOSED
+                and len(self._calls) >= BREAKER_MIN_CALLS
+                and self._failures / len(self._calls) >= BREAKER_FAILURE_RATE
+            ):
+                self._transition(OPEN, now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            calls = len(self._calls)
+            result: Dict[str, Any] = {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(self._failures / calls, 3) if calls else 0.0,
+            }
+            if self.state == OPEN:
+                result["retry_after"] = round(max(0.0, self._opened_at + BREAKER_OPEN_SECONDS - now), 3)
+        return result
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_breaker(upstream: str, key: str = "") -> CircuitBreaker:
+    name = f"{upstream}:{key}" if key else upstream
+    breaker = _breakers.get(name)
+    if breaker is not None:
+        return breaker
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+    return breaker
+
+
+def stats() -> Dict[str, Any]:
+    return {name: breaker.snapshot() for name, breaker in sorted(_breakers.items())}
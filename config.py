@@ -1,6 +1,6 @@
 import os
 from decimal import Decimal
-from typing import Dict, NamedTuple
+from typing import Dict, NamedTuple, Optional
 
 
 def getenv_required(name: str) -> str:
@@ -16,6 +16,14 @@ class CheckboxProfile(NamedTuple):
     license_key: str
 
 
+class Profile(NamedTuple):
+    id: str
+    np_api_key: str
+    np_sender_name: str
+    checkbox: Optional[CheckboxProfile]
+    label: str
+
+
 AMO_BASE_URL = getenv_required("AMO_BASE_URL").rstrip("/")
 AMO_ACCESS_TOKEN = getenv_required("AMO_ACCESS_TOKEN")
 
@@ -31,10 +39,35 @@ AMO_PURCHASE_TOTAL_FIELD_ID = int(os.getenv("AMO_PURCHASE_TOTAL_FIELD_ID", "0"))
 
 AMO_FIELD_TTN = int(os.getenv("AMO_FIELD_TTN", "603103"))
 
+AMO_RATE_LIMIT = float(os.getenv("AMO_RATE_LIMIT", "6"))
+AMO_RATE_BURST = float(os.getenv("AMO_RATE_BURST", "6"))
+AMO_RATE_LIMIT_PATH = os.getenv("AMO_RATE_LIMIT_PATH", "amo_rate_limit.sqlite3")
+AMO_MAX_RETRIES = int(os.getenv("AMO_MAX_RETRIES", "3"))
+AMO_RETRY_BASE_DELAY = float(os.getenv("AMO_RETRY_BASE_DELAY", "0.5"))
+
+AMO_FANOUT_WORKERS = int(os.getenv("AMO_FANOUT_WORKERS", "8"))
+AMO_BATCH_SIZE = int(os.getenv("AMO_BATCH_SIZE", "50"))
+LEAD_BATCH_PARALLELISM = int(os.getenv("LEAD_BATCH_PARALLELISM", "4"))
+
+AMO_STATUS_WRITE_BEHIND = os.getenv("AMO_STATUS_WRITE_BEHIND", "false").lower() == "true"
+AMO_STATUS_QUEUE_PATH = os.getenv("AMO_STATUS_QUEUE_PATH", "status_writes.sqlite3")
+AMO_STATUS_FLUSH_SIZE = int(os.getenv("AMO_STATUS_FLUSH_SIZE", "50"))
+AMO_STATUS_FLUSH_INTERVAL = float(os.getenv("AMO_STATUS_FLUSH_INTERVAL", "2"))
+AMO_STATUS_LEASE = int(os.getenv("AMO_STATUS_LEASE", "60"))
+AMO_STATUS_MAX_ATTEMPTS = int(os.getenv("AMO_STATUS_MAX_ATTEMPTS", "8"))
+AMO_CATALOG_CACHE_TTL = int(os.getenv("AMO_CATALOG_CACHE_TTL", "3600"))
+AMO_CATALOG_CACHE_MAX = int(os.getenv("AMO_CATALOG_CACHE_MAX", "5000"))
+
 CHECKBOX_API_BASE = os.getenv("CHECKBOX_API_BASE", "https://api.checkbox.in.ua/api/v1").rstrip("/")
 CHECKBOX_CLIENT_NAME = os.getenv("CHECKBOX_CLIENT_NAME", "amo-checkbox-python")
 CHECKBOX_CLIENT_VERSION = os.getenv("CHECKBOX_CLIENT_VERSION", "1.0.0")
 CHECKBOX_SEND_EMAIL = os.getenv("CHECKBOX_SEND_EMAIL", "true").lower() == "true"
+CHECKBOX_TOKEN_TTL = int(os.getenv("CHECKBOX_TOKEN_TTL", "28800"))
+CHECKBOX_TOKEN_REFRESH_MARGIN = int(os.getenv("CHECKBOX_TOKEN_REFRESH_MARGIN", "600"))
+# Holds live cashier bearer tokens in plaintext; kept in its own file, created with 0600 permissions.
+CHECKBOX_TOKEN_STORE_PATH = os.getenv("CHECKBOX_TOKEN_STORE_PATH", "checkbox_tokens.sqlite3")
+CHECKBOX_PREWARM_LEAD = int(os.getenv("CHECKBOX_PREWARM_LEAD", "0"))
+SHIFT_MAINTENANCE_DEADLINE = float(os.getenv("SHIFT_MAINTENANCE_DEADLINE", "60"))
 
 
 def _load_profile(prefix: str) -> CheckboxProfile | None:
@@ -46,24 +79,98 @@ def _load_profile(prefix: str) -> CheckboxProfile | None:
     return CheckboxProfile(login=login, password=password, license_key=license_key)
 
 
-CHECKBOX_PROFILES: Dict[str, CheckboxProfile] = {}
+def _load_sender_profile(profile_id: str) -> Profile:
+    sender_name = (os.getenv(f"NP_SENDER_NAME_{profile_id}") or "").strip()
+    return Profile(
+        id=profile_id,
+        np_api_key=os.getenv(f"NP_API_KEY_{profile_id}", ""),
+        np_sender_name=sender_name,
+        checkbox=_load_profile(f"CHECKBOX{profile_id}"),
+        label=(os.getenv(f"TELEGRAM_LABEL_{profile_id}") or "").strip() or sender_name,
+    )
 
-for idx in ("1", "2"):
-    profile = _load_profile(f"CHECKBOX{idx}")
-    if profile:
-        CHECKBOX_PROFILES[idx] = profile
+
+PROFILE_IDS = [p.strip() for p in os.getenv("PROFILE_IDS", "1,2").split(",") if p.strip()]
+PROFILES: Dict[str, Profile] = {profile_id: _load_sender_profile(profile_id) for profile_id in PROFILE_IDS}
+
+CHECKBOX_PROFILES: Dict[str, CheckboxProfile] = {
+    profile.id: profile.checkbox for profile in PROFILES.values() if profile.checkbox
+}
 
 default_profile = _load_profile("CHECKBOX")
 if default_profile and "default" not in CHECKBOX_PROFILES:
     CHECKBOX_PROFILES["default"] = default_profile
 
-NP_API_KEY_1 = os.getenv("NP_API_KEY_1", "")
-NP_API_KEY_2 = os.getenv("NP_API_KEY_2", "")
-
-NP_SENDER_NAME_1 = (os.getenv("NP_SENDER_NAME_1") or "").strip()
-NP_SENDER_NAME_2 = (os.getenv("NP_SENDER_NAME_2") or "").strip()
+NP_API_URL = os.getenv("NP_API_URL", "https://api.novaposhta.ua/v2.0/json/")
+
+NP_BATCH_SIZE = int(os.getenv("NP_BATCH_SIZE", "100"))
+NP_BATCH_WINDOW_MS = int(os.getenv("NP_BATCH_WINDOW_MS", "0"))
+NP_FANOUT_CONCURRENCY = int(os.getenv("NP_FANOUT_CONCURRENCY", "0"))
+NP_FANOUT_WORKERS = int(os.getenv("NP_FANOUT_WORKERS", "8"))
+
+NP_TTN_CACHE_PATH = os.getenv("NP_TTN_CACHE_PATH", "ttn_cache.sqlite3")
+NP_TTN_CACHE_MAX = int(os.getenv("NP_TTN_CACHE_MAX", "100000"))
+NP_TTN_NEGATIVE_TTL = int(os.getenv("NP_TTN_NEGATIVE_TTL", "300"))
+
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TELEGRAM_OUTBOX = os.getenv("TELEGRAM_OUTBOX", "true").lower() == "true"
+TELEGRAM_OUTBOX_SIZE = int(os.getenv("TELEGRAM_OUTBOX_SIZE", "1000"))
+TELEGRAM_RATE_PER_MINUTE = int(os.getenv("TELEGRAM_RATE_PER_MINUTE", "20"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "5"))
+TELEGRAM_FLUSH_TIMEOUT = float(os.getenv("TELEGRAM_FLUSH_TIMEOUT", "10"))
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", "100"))
+
+HTTP_TIMEOUTS: Dict[str, float] = {
+    "amocrm": float(os.getenv("AMO_HTTP_TIMEOUT", "15")),
+    "checkbox": float(os.getenv("CHECKBOX_HTTP_TIMEOUT", "5")),
+    "novaposhta": float(os.getenv("NP_HTTP_TIMEOUT", "10")),
+    "telegram": float(os.getenv("TELEGRAM_HTTP_TIMEOUT", "5")),
+}
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() == "true"
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", "30"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+DEFERRED_QUEUE_PATH = os.getenv("DEFERRED_QUEUE_PATH", "deferred.sqlite3")
+DEFERRED_DRAIN_PER_MINUTE = float(os.getenv("DEFERRED_DRAIN_PER_MINUTE", "20"))
+
+RECEIPT_RECONCILE_PATH = os.getenv("RECEIPT_RECONCILE_PATH", "receipts.sqlite3")
+RECEIPT_RECONCILE_INTERVAL = float(os.getenv("RECEIPT_RECONCILE_INTERVAL", "5"))
+RECEIPT_RECONCILE_BATCH = int(os.getenv("RECEIPT_RECONCILE_BATCH", "20"))
+RECEIPT_RECONCILE_PARALLELISM = int(os.getenv("RECEIPT_RECONCILE_PARALLELISM", "4"))
+RECEIPT_RECONCILE_MAX_BACKOFF = int(os.getenv("RECEIPT_RECONCILE_MAX_BACKOFF", "300"))
+RECEIPT_RECONCILE_MAX_AGE = int(os.getenv("RECEIPT_RECONCILE_MAX_AGE", "86400"))
+
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", "backfill_checkpoint.json")
+
+LEAD_DEDUP_PATH = os.getenv("LEAD_DEDUP_PATH", "lead_flights.sqlite3")
+LEAD_DEDUP_WINDOW = int(os.getenv("LEAD_DEDUP_WINDOW", "60"))
+LEAD_FLIGHT_TIMEOUT = int(os.getenv("LEAD_FLIGHT_TIMEOUT", "300"))
+
+CIRCUIT_BREAKER = os.getenv("CIRCUIT_BREAKER", "true").lower() == "true"
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_EVENT_LEVELS = os.getenv("LOG_EVENT_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
 PORT = int(os.getenv("PORT", "8080"))
 
 MONEY_QUANT = Decimal("0.01")
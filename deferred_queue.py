@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from checkbox_api import ensure_shift_for_profile, get_cashier_token
+from config import (
+    DEFERRED_DRAIN_PER_MINUTE,
+    DEFERRED_QUEUE_PATH,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETRY_DELAY,
+    JOB_VISIBILITY_TIMEOUT,
+    LEAD_DEDUP_WINDOW,
+)
+from local_store import connect, transaction
+from log_setup import configure_logging
+from metrics import inc
+from time_window import TZ, is_receipt_allowed_now, next_open_boundary
+
+logger = logging.getLogger("deferred_queue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deferred_leads (
+    lead_id INTEGER PRIMARY KEY,
+    profile_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    deferred_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS deferred_leads_ready ON deferred_leads (visible_at, deferred_at);
+CREATE TABLE IF NOT EXISTS deferred_profiles (
+    profile_id TEXT PRIMARY KEY,
+    next_drain_at REAL NOT NULL DEFAULT 0,
+    drained INTEGER NOT NULL DEFAULT 0,
+    last_drained_at REAL
+);
+"""
+
+_SHIFT_RETRY_DELAY = 60
+
+Handler = Callable[[int], Tuple[Dict[str, Any], int]]
+
+
+class DeferredLead(NamedTuple):
+    lead_id: int
+    profile_id: str
+    attempts: int
+
+
+_drainer_pid: Optional[int] = None
+_drainer_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(DEFERRED_QUEUE_PATH, _SCHEMA)
+
+
+def enabled() -> bool:
+    return DEFERRED_DRAIN_PER_MINUTE > 0
+
+
+def _drain_interval() -> float:
+    return 60.0 / DEFERRED_DRAIN_PER_MINUTE
+
+
+def defer_lead(lead_id: int, profile_id: str, delay: float = 0) -> None:
+    now = time.time()
+    _conn().execute(
+        "INSERT INTO deferred_leads (lead_id, profile_id, deferred_at, visible_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(lead_id) DO UPDATE SET profile_id = excluded.profile_id, visible_at = excluded.visible_at",
+        (int(lead_id), str(profile_id), now, now + delay),
+    )
+    inc("deferred_leads_total", profile=profile_id)
+    logger.info(f"deferred_queue.deferred lead_id={lead_id} profile_id={profile_id} delay={delay:.1f}")
+
+
+def claim() -> Optional[DeferredLead]:
+    now = time.time()
+    conn = _conn()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT d.lead_id, d.profile_id, d.attempts FROM deferred_leads d "
+            "LEFT JOIN deferred_profiles p ON p.profile_id = d.profile_id "
+            "WHERE d.visible_at <= ? AND COALESCE(p.next_drain_at, 0) <= ? "
+            "ORDER BY d.deferred_at, d.lead_id LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE deferred_leads SET attempts = attempts + 1, visible_at = ? WHERE lead_id = ?",
+            (now + JOB_VISIBILITY_TIMEOUT, row["lead_id"]),
+        )
+        _hold_profile(conn, row["profile_id"], now + _drain_interval())
+    return DeferredLead(lead_id=row["lead_id"], profile_id=row["profile_id"], attempts=row["attempts"] + 1)
+
+
+def _hold_profile(conn: sqlite3.Connection, profile_id: str, until: float) -> None:
+    conn.execute(
+        "INSERT INTO deferred_profiles (profile_id, next_drain_at) VALUES (?, ?) "
+        "ON CONFLICT(profile_id) DO UPDATE SET next_drain_at = MAX(next_drain_at, excluded.next_drain_at)",
+        (profile_id, until),
+    )
+
+
+def _release(lead: DeferredLead, delay: float, error: str, attempts: Optional[int] = None) -> None:
+    _conn().execute(
+        "UPDATE deferred_leads SET visible_at = ?, attempts = ?, last_error = ? WHERE lead_id = ?",
+        (time.time() + delay, lead.attempts if attempts is None else attempts, error[:1000], lead.lead_id),
+    )
+
+
+def _done(lead: DeferredLead) -> None:
+    conn = _conn()
+    with transaction(conn):
+        conn.execute("DELETE FROM deferred_leads WHERE lead_id = ?", (lead.lead_id,))
+        conn.execute(
+            "UPDATE deferred_profiles SET drained = drained + 1, last_drained_at = ? WHERE profile_id = ?",
+            (time.time(), lead.profile_id),
+        )
+
+
+def _shift_ready(lead: DeferredLead) -> bool:
+    if not lead.profile_id:
+        return True
+    try:
+        ensure_shift_for_profile(get_cashier_token(lead.profile_id), lead.profile_id)
+    except Exception as e:
+        logger.warning(f"deferred_queue.shift_not_ready profile_id={lead.profile_id} error={e}")
+        _release(lead, _SHIFT_RETRY_DELAY, f"shift not ready: {e}", attempts=lead.attempts - 1)
+        conn = _conn()
+        with transaction(conn):
+            _hold_profile(conn, lead.profile_id, time.time() + _SHIFT_RETRY_DELAY)
+        return False
+    return True
+
+
+def drain_one(handler: Handler) -> bool:
+    if not is_receipt_allowed_now():
+        return False
+    lead = claim()
+    if lead is None:
+        return False
+    if not _shift_ready(lead):
+        return True
+    try:
+        body, status_code = handler(lead.lead_id)
+    except Exception as e:
+        logger.exception(f"deferred_queue.drain_error lead_id={lead.lead_id} profile_id={lead.profile_id}")
+        body, status_code = {"error": str(e)}, 500
+    if body.get("status") == "deferred":
+        # Either the window closed again or the dedup cache answered; try after it expires.
+        _release(lead, LEAD_DEDUP_WINDOW, "deferred", attempts=lead.attempts - 1)
+        inc("deferred_drained_total", profile=lead.profile_id, result="deferred")
+        return True
+    if status_code >= 500 and lead.attempts < JOB_MAX_ATTEMPTS:
+        delay = JOB_RETRY_DELAY * (2 ** (lead.attempts - 1))
+        _release(lead, delay, str(body.get("error") or status_code))
+        inc("deferred_drained_total", profile=lead.profile_id, result="retry")
+        logger.warning(
+            f"deferred_queue.retry lead_id={lead.lead_id} profile_id={lead.profile_id} "
+            f"attempts={lead.attempts} delay={delay}"
+        )
+        return True
+    _done(lead)
+    result = "ok" if status_code < 400 else "failed"
+    inc("deferred_drained_total", profile=lead.profile_id, result=result)
+    logger.info(
+        f"deferred_queue.drained lead_id={lead.lead_id} profile_id={lead.profile_id} status_code={status_code}"
+    )
+    return True
+
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    conn = _conn()
+    profiles: Dict[str, Dict[str, Any]] = {}
+    for row in conn.execute(
+        "SELECT profile_id, COUNT(*) AS pending, MIN(deferred_at) AS oldest FROM deferred_leads GROUP BY profile_id"
+    ):
+        profiles[row["profile_id"]] = {
+            "pending": row["pending"],
+            "oldest_age": round(now - row["oldest"], 3),
+            "drained": 0,
+        }
+    for row in conn.execute("SELECT profile_id, next_drain_at, drained, last_drained_at FROM deferred_profiles"):
+        entry = profiles.setdefault(row["profile_id"], {"pending": 0, "oldest_age": 0})
+        entry["drained"] = row["drained"]
+        entry["last_drained_at"] = row["last_drained_at"]
+    return {
+        "pending": sum(p["pending"] for p in profiles.values()),
+        "draining": is_receipt_allowed_now(),
+        "per_minute": DEFERRED_DRAIN_PER_MINUTE,
+        "profiles": profiles,
+    }
+
+
+def _idle_wait() -> float:
+    if is_receipt_allowed_now():
+        return JOB_POLL_INTERVAL
+    until_open = (next_open_boundary() - datetime.now(TZ)).total_seconds()
+    return max(JOB_POLL_INTERVAL, min(until_open, 300.0))
+
+
+def _drainer_loop(handler: Handler) -> None:
+    while not _stop.is_set():
+        try:
+            drained = drain_one(handler)
+        except Exception:
+            logger.exception("deferred_queue.loop_error")
+            drained = False
+        if not drained:
+            _stop.wait(_idle_wait())
+
+
+def start_drainer(handler: Handler) -> None:
+    global _drainer_pid
+    if not enabled():
+        return
+    pid = os.getpid()
+    if _drainer_pid == pid:
+        return
+    with _drainer_lock:
+        if _drainer_pid == pid:
+            return
+        threading.Thread(target=_drainer_loop, args=(handler,), name="deferred-drainer", daemon=True).start()
+        _drainer_pid = pid
+    logger.info(f"deferred_queue.drainer_started per_minute={DEFERRED_DRAIN_PER_MINUTE} pid={pid}")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    mode = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if mode == "stats":
+        print(json.dumps(stats()))
+    else:
+        logger.error("deferred_queue.invalid_mode", extra={"mode": mode})
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import get_breaker
+from config import CIRCUIT_BREAKER, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_TIMEOUTS
+from metrics import inc, observe
+
+logger = logging.getLogger("http_pool")
+
+DEFAULT_TIMEOUT = 10.0
+
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+_deadline = threading.local()
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(upstream: str) -> requests.Session:
+    session = _sessions.get(upstream)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = _new_session()
+            _sessions[upstream] = session
+            logger.debug("http_pool.session.created", extra={"upstream": upstream})
+    return session
+
+
+def get_timeout(upstream: str) -> float:
+    return HTTP_TIMEOUTS.get(upstream, DEFAULT_TIMEOUT)
+
+
+@contextmanager
+def request_deadline(at: float) -> Iterator[None]:
+    # Caps every request made by this thread until time.monotonic() reaches `at`.
+    previous: Optional[float] = getattr(_deadline, "at", None)
+    _deadline.at = at if previous is None else min(at, previous)
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+def _bounded_timeout(upstream: str, timeout: float) -> float:
+    at: Optional[float] = getattr(_deadline, "at", None)
+    if at is None:
+        return timeout
+    remaining = at - time.monotonic()
+    if remaining <= 0:
+        raise requests.Timeout(f"{upstream} request deadline exceeded")
+    return min(timeout, remaining)
+
+
+def http_request(upstream: str, method: str, url: str, breaker_key: str = "", **kwargs: Any) -> requests.Response:
+    kwargs["timeout"] = _bounded_timeout(upstream, kwargs.get("timeout") or get_timeout(upstream))
+    breaker = get_breaker(upstream, breaker_key) if CIRCUIT_BREAKER else None
+    if breaker is not None:
+        breaker.before_call()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        resp = get_session(upstream).request(method, url, **kwargs)
+        status = str(resp.status_code)
+        if breaker is not None:
+            breaker.record(resp.status_code < 500)
+        return resp
+    except Exception:
+        if breaker is not None:
+            breaker.record(False)
+        raise
+    finally:
+        observe("upstream_request_seconds", time.perf_counter() - started, upstream=upstream)
+        inc("upstream_responses_total", upstream=upstream, status=status)
+
+
+def close_all() -> None:
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        try:
+            session.close()
+        except Exception:
+            pass
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from config import (
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_QUEUE_PATH,
+    JOB_RETRY_DELAY,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_WORKERS,
+)
+from deferred_queue import start_drainer
+from local_store import connect, transaction
+from log_setup import configure_logging
+from pipeline import process_lead
+
+logger = logging.getLogger("job_queue")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lead_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, visible_at);
+"""
+
+
+class Job(NamedTuple):
+    id: int
+    lead_id: int
+    attempts: int
+
+
+_workers: List[threading.Thread] = []
+_workers_pid: Optional[int] = None
+_workers_lock = threading.Lock()
+_stop = threading.Event()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(JOB_QUEUE_PATH, _SCHEMA)
+
+
+def enqueue_lead(lead_id: int, delay: float = 0) -> int:
+    now = time.time()
+    cur = _conn().execute(
+        "INSERT INTO jobs (lead_id, visible_at, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (int(lead_id), now + delay, now, now),
+    )
+    job_id = int(cur.lastrowid)
+    logger.info(f"job_queue.enqueued job_id={job_id} lead_id={lead_id} delay={delay}")
+    return job_id
+
+
+def claim(visibility_timeout: int = JOB_VISIBILITY_TIMEOUT) -> Optional[Job]:
+    now = time.time()
+    conn = _conn()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT id, lead_id, attempts FROM jobs WHERE status IN ('pending', 'leased') AND visible_at <= ? "
+            "ORDER BY visible_at, id LIMIT 1",
+            (now,),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'leased', attempts = attempts + 1, visible_at = ?, updated_at = ? WHERE id = ?",
+            (now + visibility_timeout, now, row["id"]),
+        )
+    return Job(id=row["id"], lead_id=row["lead_id"], attempts=row["attempts"] + 1)
+
+
+def ack(job: Job) -> None:
+    _conn().execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+
+def nack(job: Job, error: str) -> None:
+    now = time.time()
+    if job.attempts >= JOB_MAX_ATTEMPTS:
+        _conn().execute(
+            "UPDATE jobs SET status = 'dead', updated_at = ?, last_error = ? WHERE id = ?",
+            (now, error[:1000], job.id),
+        )
+        logger.error(f"job_queue.dead job_id={job.id} lead_id={job.lead_id} error={error}")
+        return
+    delay = JOB_RETRY_DELAY * (2 ** (job.attempts - 1))
+    _conn().execute(
+        "UPDATE jobs SET status = 'pending', visible_at = ?, updated_at = ?, last_error = ? WHERE id = ?",
+        (now + delay, now, error[:1000], job.id),
+    )
+    logger.warning(
+        f"job_queue.retry job_id={job.id} lead_id={job.lead_id} attempts={job.attempts} "
+        f"delay={delay} error={error}"
+    )
+
+
+def requeue_dead() -> int:
+    now = time.time()
+    cur = _conn().execute(
+        "UPDATE jobs SET status = 'pending', attempts = 0, visible_at = ?, updated_at = ? WHERE status = 'dead'",
+        (now, now),
+    )
+    return cur.rowcount
+
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    conn = _conn()
+    ready = conn.execute(
+        "SELECT COUNT(*), MIN(created_at) FROM jobs WHERE status IN ('pending', 'leased') AND visible_at <= ?",
+        (now,),
+    ).fetchone()
+    leased = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND visible_at > ?", (now,)
+    ).fetchone()[0]
+    retry_wait = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND visible_at > ? AND attempts > 0", (now,)
+    ).fetchone()[0]
+    delayed = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND visible_at > ? AND attempts = 0", (now,)
+    ).fetchone()[0]
+    dead = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'dead'").fetchone()[0]
+    oldest = ready[1]
+    return {
+        "ready": ready[0],
+        "leased": leased,
+        "retry_wait": retry_wait,
+        "delayed": delayed,
+        "dead": dead,
+        "oldest_ready_age": round(now - oldest, 3) if oldest else 0,
+    }
+
+
+def run_job(job: Job) -> None:
+    try:
+        result, status_code = process_lead(job.lead_id)
+    except Exception as e:
+        logger.exception(f"job_queue.job_error job_id={job.id} lead_id={job.lead_id}")
+        nack(job, str(e))
+        return
+    if status_code >= 500:
+        nack(job, str(result.get("error") or status_code))
+        return
+    ack(job)
+    logger.info(f"job_queue.done job_id={job.id} lead_id={job.lead_id} status_code={status_code}")
+
+
+def _worker_loop() -> None:
+    while not _stop.is_set():
+        try:
+            job = claim()
+        except Exception:
+            logger.exception("job_queue.claim_error")
+            job = None
+        if job is None:
+            _stop.wait(JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def start_workers(count: int = JOB_WORKERS) -> None:
+    global _workers_pid
+    pid = os.getpid()
+    if _workers_pid == pid:
+        return
+    with _workers_lock:
+        if _workers_pid == pid:
+            return
+        _workers.clear()
+        for idx in range(max(0, count)):
+            thread = threading.Thread(target=_worker_loop, name=f"job-worker-{idx}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+        _workers_pid = pid
+    logger.info(f"job_queue.workers_started count={count} pid={pid}")
+
+
+def stop_workers(timeout: float = 10.0) -> None:
+    _stop.set()
+    for thread in list(_workers):
+        thread.join(timeout)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    mode = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if mode == "stats":
+        print(json.dumps(stats()))
+    elif mode == "requeue-dead":
+        print(json.dumps({"requeued": requeue_dead()}))
+    elif mode == "work":
+        start_workers(int(sys.argv[2]) if len(sys.argv) > 2 else JOB_WORKERS)
+        start_drainer(process_lead)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop_workers()
+    else:
+        logger.error("job_queue.invalid_mode", extra={"mode": mode})
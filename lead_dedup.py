@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import LEAD_DEDUP_PATH, LEAD_DEDUP_WINDOW, LEAD_FLIGHT_TIMEOUT
+from local_store import connect, transaction
+
+logger = logging.getLogger("lead_dedup")
+
+Result = Tuple[Dict[str, Any], int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lead_flights (
+    lead_id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status_code INTEGER,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS lead_flights_finished_at ON lead_flights (finished_at);
+"""
+
+_POLL_INTERVAL = 0.2
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Optional[Result] = None
+
+
+_flights: Dict[int, _Flight] = {}
+_lock = threading.Lock()
+
+_async_flights: Dict[int, "asyncio.Future[Optional[Result]]"] = {}
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(LEAD_DEDUP_PATH, _SCHEMA)
+
+
+def _in_progress(lead_id: int) -> Result:
+    return {"status": "in_progress", "lead_id": lead_id}, 202
+
+
+def _claim(lead_id: int, owner: str) -> Tuple[str, Optional[Result]]:
+    now = time.time()
+    conn = _conn()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT started_at, finished_at, status_code, result FROM lead_flights WHERE lead_id = ?",
+            (lead_id,),
+        ).fetchone()
+        if row is not None:
+            finished_at = row["finished_at"]
+            if finished_at is None and now - row["started_at"] <= LEAD_FLIGHT_TIMEOUT:
+                return "wait", None
+            if (
+                finished_at is not None
+                and now - finished_at <= LEAD_DEDUP_WINDOW
+                and row["status_code"] < 500
+            ):
+                return "done", (json.loads(row["result"]), row["status_code"])
+        conn.execute(
+            "INSERT OR REPLACE INTO lead_flights (lead_id, owner, started_at) VALUES (?, ?, ?)",
+            (lead_id, owner, now),
+        )
+    return "owner", None
+
+
+def _finish(lead_id: int, owner: str, result: Result) -> None:
+    now = time.time()
+    body, status_code = result
+    conn = _conn()
+    conn.execute(
+        "UPDATE lead_flights SET finished_at = ?, status_code = ?, result = ? WHERE lead_id = ? AND owner = ?",
+        (now, status_code, json.dumps(body, default=str), lead_id, owner),
+    )
+    conn.execute(
+        "DELETE FROM lead_flights WHERE finished_at < ?",
+        (now - max(LEAD_DEDUP_WINDOW, 60) * 10,),
+    )
+
+
+def _release(lead_id: int, owner: str) -> None:
+    _conn().execute("DELETE FROM lead_flights WHERE lead_id = ? AND owner = ?", (lead_id, owner))
+
+
+def _poll_other(lead_id: int) -> Tuple[bool, Optional[Result]]:
+    row = _conn().execute(
+        "SELECT finished_at, status_code, result FROM lead_flights WHERE lead_id = ?",
+        (lead_id,),
+    ).fetchone()
+    if row is None:
+        return True, None
+    if row["finished_at"] is not None:
+        return True, (json.loads(row["result"]), row["status_code"])
+    return False, None
+
+
+def _wait_for_other(lead_id: int) -> Optional[Result]:
+    deadline = time.time() + LEAD_FLIGHT_TIMEOUT
+    while time.time() < deadline:
+        finished, result = _poll_other(lead_id)
+        if finished:
+            return result
+        time.sleep(_POLL_INTERVAL)
+    return _in_progress(lead_id)
+
+
+def _run_exclusive(lead_id: int, fn: Callable[[int], Result]) -> Result:
+    owner = f"{os.getpid()}:{threading.get_ident()}"
+    while True:
+        state, result = _claim(lead_id, owner)
+        if state == "done":
+            logger.info(f"lead_dedup.recent lead_id={lead_id}")
+            return result
+        if state == "owner":
+            break
+        logger.info(f"lead_dedup.wait_other_process lead_id={lead_id}")
+        result = _wait_for_other(lead_id)
+        if result is not None:
+            return result
+    try:
+        result = fn(lead_id)
+    except BaseException:
+        _release(lead_id, owner)
+        raise
+    _finish(lead_id, owner, result)
+    return result
+
+
+def run_once(lead_id: int, fn: Callable[[int], Result]) -> Result:
+    with _lock:
+        flight = _flights.get(lead_id)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _flights[lead_id] = flight
+    if not leader:
+        logger.info(f"lead_dedup.coalesced lead_id={lead_id}")
+        if flight.event.wait(LEAD_FLIGHT_TIMEOUT) and flight.result is not None:
+            return flight.result
+        return _in_progress(lead_id)
+    try:
+        flight.result = _run_exclusive(lead_id, fn)
+        return flight.result
+    finally:
+        flight.event.set()
+        with _lock:
+            _flights.pop(lead_id, None)
+
+
+async def _wait_for_other_async(lead_id: int) -> Optional[Result]:
+    deadline = time.time() + LEAD_FLIGHT_TIMEOUT
+    while time.time() < deadline:
+        finished, result = await asyncio.to_thread(_poll_other, lead_id)
+        if finished:
+            return result
+        await asyncio.sleep(_POLL_INTERVAL)
+    return _in_progress(lead_id)
+
+
+async def _run_exclusive_async(lead_id: int, fn: Callable[[int], Awaitable[Result]]) -> Result:
+    owner = f"{os.getpid()}:task-{id(asyncio.current_task())}"
+    while True:
+        state, result = await asyncio.to_thread(_claim, lead_id, owner)
+        if state == "done":
+            logger.info(f"lead_dedup.recent lead_id={lead_id}")
+            return result
+        if state == "owner":
+            break
+        logger.info(f"lead_dedup.wait_other_process lead_id={lead_id}")
+        result = await _wait_for_other_async(lead_id)
+        if result is not None:
+            return result
+    try:
+        result = await fn(lead_id)
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(_release, lead_id, owner))
+        raise
+    await asyncio.to_thread(_finish, lead_id, owner, result)
+    return result
+
+
+async def run_once_async(lead_id: int, fn: Callable[[int], Awaitable[Result]]) -> Result:
+    flight = _async_flights.get(lead_id)
+    if flight is not None:
+        logger.info(f"lead_dedup.coalesced lead_id={lead_id}")
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight), LEAD_FLIGHT_TIMEOUT)
+        except asyncio.TimeoutError:
+            result = None
+        return result if result is not None else _in_progress(lead_id)
+    flight = asyncio.get_running_loop().create_future()
+    _async_flights[lead_id] = flight
+    result: Optional[Result] = None
+    try:
+        result = await _run_exclusive_async(lead_id, fn)
+        return result
+    finally:
+        flight.set_result(result)
+        _async_flights.pop(lead_id, None)
@@ -0,0 +1,172 @@
+import logging
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from checkbox_service import MAINTENANCE_WINDOW, SellOutcomeUnknown
+from circuit_breaker import CircuitOpenError
+from deferred_queue import enabled as deferral_enabled
+from metrics import inc
+from models import LeadData
+from receipt_reconciler import enabled as reconcile_enabled
+from telegram_common import resolve_sender_name
+
+logger = logging.getLogger("pipeline")
+
+Outcome = Tuple[Dict[str, Any], int]
+
+
+class Decision(NamedTuple):
+    result: Outcome
+    status_text: Optional[str] = None
+    telegram_text: Optional[str] = None
+    profile_id: Optional[str] = None
+    track_receipt: Optional[str] = None
+    defer_delay: Optional[float] = None
+
+
+def outcome(kind: str, body: Dict[str, Any], status_code: int) -> Outcome:
+    inc("lead_outcomes_total", outcome=kind)
+    return body, status_code
+
+
+def load_error(lead_id: int, error: Exception) -> Decision:
+    msg = str(error)
+    logger.exception(f"lead.load.error lead_id={lead_id} error={msg}")
+    return Decision(
+        outcome("load_error", {"error": msg}, 500),
+        telegram_text=f"❌ Сделка <b>{lead_id}</b>: ошибка загрузки сделки\n<code>{msg}</code>",
+    )
+
+
+def already_processed(lead_id: int) -> Decision:
+    logger.info(f"lead.already_processed lead_id={lead_id}")
+    return Decision(outcome("already_processed", {"status": "already_processed"}, 200))
+
+
+def skipped_by_status(lead_data: LeadData) -> Decision:
+    logger.info(f"lead.status.skip lead_id={lead_data.id} status_value={lead_data.status_value}")
+    return Decision(outcome("skipped_by_status", {"status": "skipped_by_status"}, 200))
+
+
+def no_ttn(lead_id: int) -> Decision:
+    msg = "no TTN in deal"
+    logger.warning(f"lead.no_ttn lead_id={lead_id}")
+    return Decision(
+        outcome("no_ttn", {"error": msg}, 400),
+        status_text=f"ERROR: {msg}",
+        telegram_text=f"❌ Сделка <b>{lead_id}</b>: нет ТТН в сделке",
+    )
+
+
+def ttn_profile_not_found(lead_id: int, ttn: str) -> Decision:
+    msg = "TTN does not belong to known Nova Poshta accounts"
+    logger.warning(f"lead.ttn_profile_not_found lead_id={lead_id} ttn={ttn}")
+    return Decision(
+        outcome("ttn_profile_not_found", {"error": msg}, 400),
+        status_text=f"ERROR: {msg}",
+        telegram_text=f"❌ Сделка <b>{lead_id}</b>: ТТН <code>{ttn}</code> не относится ни к одному аккаунту НП",
+    )
+
+
+def upstream_unavailable(lead_id: int, profile_id: str, error: CircuitOpenError) -> Decision:
+    parked = deferral_enabled()
+    logger.warning(
+        f"lead.upstream_unavailable lead_id={lead_id} breaker={error.name} "
+        f"retry_after={error.retry_after:.1f} parked={parked}"
+    )
+    if parked:
+        body = {"status": "deferred", "lead_id": lead_id, "reason": str(error)}
+        return Decision(
+            outcome("upstream_unavailable", body, 202), profile_id=profile_id, defer_delay=error.retry_after
+        )
+    # Nothing drains parked leads with deferral off; a 5xx makes amoCRM or the job queue retry instead.
+    body = {"status": "unavailable", "lead_id": lead_id, "reason": str(error), "retry_after": error.retry_after}
+    return Decision(outcome("upstream_unavailable", body, 503))
+
+
+def sell_outcome_unknown(lead_id: int, profile_id: str, error: SellOutcomeUnknown) -> Decision:
+    # Never retried automatically: a resend could fiscalize the same sale twice.
+    logger.error(
+        f"checkbox.create.outcome_unknown lead_id={lead_id} profile_id={profile_id} "
+        f"receipt_id={error.receipt_id} error={error.error}"
+    )
+    body = {
+        "status": "pending",
+        "lead_id": lead_id,
+        "profile_id": profile_id,
+        "receipt_id": error.receipt_id,
+        "error": str(error.error),
+    }
+    return Decision(
+        outcome("receipt_unknown", body, 202),
+        status_text=f"PENDING: outcome unknown (id: {error.receipt_id})",
+        telegram_text=(
+            f"⚠️ Сделка <b>{lead_id}</b>: нет ответа Checkbox на создание чека ({resolve_sender_name(profile_id)})\n"
+            f"ID: <code>{error.receipt_id}</code>"
+        ),
+        profile_id=profile_id,
+        track_receipt=error.receipt_id if reconcile_enabled() else None,
+    )
+
+
+def receipt_exception(lead_id: int, profile_id: str, error: Exception) -> Decision:
+    msg = str(error)
+    logger.exception(f"checkbox.create.error lead_id={lead_id} profile_id={profile_id} error={msg}")
+    return Decision(
+        outcome("receipt_exception", {"error": msg}, 500),
+        status_text=f"ERROR: {msg}",
+        telegram_text=(
+            f"❌ Сделка <b>{lead_id}</b>: ошибка при создании чека ({resolve_sender_name(profile_id)})\n"
+            f"<code>{msg}</code>"
+        ),
+        profile_id=profile_id,
+    )
+
+
+def receipt_result(lead_id: int, profile_id: str, result: Dict[str, Any]) -> Decision:
+    receipt_id = result.get("receipt_id") or ""
+    receipt_number = result.get("receipt_number") or ""
+    error = result.get("error")
+    if error == MAINTENANCE_WINDOW and deferral_enabled():
+        logger.info(f"lead.deferred lead_id={lead_id} profile_id={profile_id}")
+        return Decision(
+            outcome("deferred", {"status": "deferred", "lead_id": lead_id, "profile_id": profile_id}, 202),
+            status_text=f"DEFERRED: {error}",
+            profile_id=profile_id,
+            defer_delay=0,
+        )
+    sender_name = resolve_sender_name(profile_id)
+    if error:
+        logger.error(f"checkbox.create.result_error lead_id={lead_id} profile_id={profile_id} error={error}")
+        body = {
+            "error": error,
+            "receipt_id": receipt_id,
+            "receipt_number": receipt_number,
+            "profile_id": profile_id,
+        }
+        return Decision(
+            outcome("receipt_error", body, 500),
+            status_text=f"ERROR: {error}",
+            telegram_text=f"❌ Сделка <b>{lead_id}</b>: ошибка создания чека ({sender_name})\n<code>{error}</code>",
+            profile_id=profile_id,
+        )
+    logger.info(
+        f"checkbox.create.ok lead_id={lead_id} profile_id={profile_id} "
+        f"receipt_id={receipt_id} receipt_number={receipt_number}"
+    )
+    body = {
+        "status": "ok",
+        "lead_id": lead_id,
+        "profile_id": profile_id,
+        "receipt_id": receipt_id,
+        "receipt_number": receipt_number,
+    }
+    return Decision(
+        outcome("ok", body, 200),
+        status_text=f"OK: {receipt_number or '—'} (id: {receipt_id or '—'})",
+        telegram_text=(
+            f"✅ Сделка <b>{lead_id}</b>: чек выдан успешно ({sender_name})\n"
+            f"ID: <code>{receipt_id or '—'}</code>"
+        ),
+        profile_id=profile_id,
+        track_receipt=receipt_id if receipt_id and not receipt_number and reconcile_enabled() else None,
+    )
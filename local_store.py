@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+from config import DATA_DIR
+
+_local = threading.local()
+
+
+def resolve_path(filename: str) -> str:
+    if os.path.isabs(filename):
+        return filename
+    return os.path.join(DATA_DIR, filename)
+
+
+def connect(filename: str, schema: str) -> sqlite3.Connection:
+    conns: Dict[Tuple[int, str], sqlite3.Connection] = getattr(_local, "conns", None)
+    if conns is None:
+        conns = {}
+        _local.conns = conns
+    key = (os.getpid(), filename)
+    conn = conns.get(key)
+    if conn is None:
+        path = resolve_path(filename)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(schema)
+        conns[key] = conn
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from config import LOG_EVENT_LEVELS, LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLING
+from metrics import inc
+
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+_configured_lock = threading.Lock()
+_configured = False
+
+_FULL_QUEUE_WAIT = 0.1
+
+
+def _event_name(record: logging.LogRecord) -> str:
+    msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+    return msg.split(" ", 1)[0]
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    result: Dict[str, str] = {}
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        if key.strip():
+            result[key.strip()] = value.strip()
+    return result
+
+
+def _extras(record: logging.LogRecord) -> Dict[str, Any]:
+    return {k: v for k, v in record.__dict__.items() if k not in _RESERVED and not k.startswith("_")}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": _event_name(record),
+            "message": record.getMessage(),
+        }
+        payload.update(_extras(record))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = _extras(record)
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+class EventFilter(logging.Filter):
+    def __init__(self, levels: Dict[str, int], sampling: Dict[str, float]) -> None:
+        super().__init__()
+        self._levels = levels
+        self._sampling = sampling
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self._levels and not self._sampling:
+            return True
+        event = _event_name(record)
+        threshold = self._levels.get(event)
+        if threshold is not None and record.levelno < threshold:
+            return False
+        rate = self._sampling.get(event)
+        if rate is not None and random.random() >= rate:
+            return False
+        return True
+
+
+class _ProcessQueueHandler(QueueHandler):
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]", target: logging.Handler) -> None:
+        super().__init__(log_queue)
+        self._target = target
+        self._listener: Optional[QueueListener] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._listener = QueueListener(self.queue, self._target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = pid
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The queue never leaves the process, so formatting is left to the listener thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno < logging.WARNING:
+            inc("log_records_dropped_total", level=record.levelname)
+            return
+        try:
+            self.queue.put(record, timeout=_FULL_QUEUE_WAIT)
+        except queue.Full:
+            # The listener is falling behind; write warnings and errors through rather than lose them.
+            inc("log_records_written_through_total", level=record.levelname)
+            self._target.handle(record)
+
+    def stop(self) -> None:
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+def configure_logging() -> None:
+    global _configured
+    with _configured_lock:
+        if _configured:
+            return
+        target = logging.StreamHandler(sys.stdout)
+        target.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        handler = _ProcessQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), target)
+        levels = {
+            event: getattr(logging, level.upper(), logging.INFO)
+            for event, level in _parse_mapping(LOG_EVENT_LEVELS).items()
+        }
+        sampling: Dict[str, float] = {}
+        for event, rate in _parse_mapping(LOG_SAMPLING).items():
+            try:
+                sampling[event] = float(rate)
+            except ValueError:
+                continue
+        handler.addFilter(EventFilter(levels, sampling))
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        for noisy in ("urllib3", "httpx", "httpcore"):
+            logging.getLogger(noisy).setLevel(max(root.level, logging.WARNING))
+        atexit.register(handler.stop)
+        _configured = True
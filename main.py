@@ -1,172 +1,91 @@
 import logging
-from typing import Any, Dict, Optional
-
-from flask import Flask, jsonify, request
-
-from config import LOG_LEVEL, PORT
-from amocrm_service import (
-    load_lead_with_details,
-    is_target_status,
-    is_already_processed,
-    set_checkbox_status,
-)
-from checkbox_service import create_receipt_for_lead_data
-from nova_poshta_service import detect_profile_for_ttn
-from telegram_notify import send_telegram, resolve_sender_name
-
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
-)
+from typing import Any, Dict, List
+
+from flask import Flask, Response, jsonify, request
+
+from config import AMO_STATUS_WRITE_BEHIND, CHECKBOX_PREWARM_LEAD, JOB_WORKERS, PORT, WEBHOOK_ASYNC
+from deferred_queue import enabled as deferral_enabled, start_drainer
+from job_queue import enqueue_lead, start_workers
+from log_setup import configure_logging
+from metrics import in_flight, render as render_metrics
+from pipeline import process_lead, process_leads
+from receipt_reconciler import enabled as reconcile_enabled, start_reconciler
+from shift_maintenance import start_prewarm_scheduler
+from status_writer import start_flusher as start_status_flusher
+from telegram_notify import send_telegram
+from webhook_common import health_status, lead_ids_from_form, lead_ids_from_json
+
+configure_logging()
 
 logger = logging.getLogger("app")
 
 app = Flask(__name__)
 
+if WEBHOOK_ASYNC:
+    start_workers(JOB_WORKERS)
 
-def _extract_lead_id_from_json(body: Dict[str, Any]) -> Optional[int]:
-    leads = body.get("leads") or {}
-    status_items = leads.get("status") or leads.get("status_leads") or []
-    if isinstance(status_items, list) and status_items:
-        first = status_items[0]
-        lead_id = first.get("id")
-        if lead_id:
-            try:
-                return int(lead_id)
-            except Exception:
-                return None
-    if "lead_id" in body:
-        try:
-            return int(body["lead_id"])
-        except Exception:
-            return None
-    return None
-
-
-def _extract_lead_id_from_form(form: Dict[str, Any]) -> Optional[int]:
-    for key, value in form.items():
-        if key.endswith("[id]") and "leads[status]" in key:
-            try:
-                return int(value)
-            except Exception:
-                return None
-    if "lead_id" in form:
-        try:
-            return int(form["lead_id"])
-        except Exception:
-            return None
-    return None
+if AMO_STATUS_WRITE_BEHIND:
+    start_status_flusher()
+
+if CHECKBOX_PREWARM_LEAD > 0:
+    start_prewarm_scheduler()
+
+if deferral_enabled():
+    start_drainer(process_lead)
+
+if reconcile_enabled():
+    start_reconciler()
 
 
 @app.route("/health", methods=["GET"])
 def health() -> Any:
-    return jsonify({"status": "ok"}), 200
+    return jsonify(health_status()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics() -> Any:
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/amocrm/webhook", methods=["POST"])
 def amocrm_webhook() -> Any:
-    lead_id: Optional[int] = None
+    with in_flight("webhooks_in_flight"):
+        return _handle_webhook()
+
+
+def _handle_webhook() -> Any:
+    lead_ids: List[int] = []
     body: Dict[str, Any] = {}
     if request.is_json:
         try:
             body = request.get_json(force=True, silent=True) or {}
         except Exception:
             body = {}
-        lead_id = _extract_lead_id_from_json(body)
-    if lead_id is None:
+        lead_ids = lead_ids_from_json(body)
+    if not lead_ids:
         form = request.form or {}
         if form:
-            lead_id = _extract_lead_id_from_form(form)
-    if lead_id is None:
+            lead_ids = lead_ids_from_form(form)
+    if not lead_ids:
         logger.error("webhook.lead_id_not_found")
         send_telegram("❌ Вебхук AmoCRM: не удалось получить ID сделки")
         return jsonify({"error": "lead_id not found"}), 400
-    logger.info(f"webhook.received lead_id={lead_id}")
-    try:
-        lead_data = load_lead_with_details(lead_id)
-    except Exception as e:
-        msg = str(e)
-        logger.exception(f"lead.load.error lead_id={lead_id} error={msg}")
-        send_telegram(f"❌ Сделка <b>{lead_id}</b>: ошибка загрузки сделки\n<code>{msg}</code>")
-        return jsonify({"error": msg}), 500
-    if is_already_processed(lead_data):
-        logger.info(f"lead.already_processed lead_id={lead_id}")
-        return jsonify({"status": "already_processed"}), 200
-    if not is_target_status(lead_data):
-        logger.info(
-            f"lead.status.skip lead_id={lead_id} status_value={lead_data.get('status_value')}"
-        )
-        return jsonify({"status": "skipped_by_status"}), 200
-    ttn = lead_data.get("ttn") or ""
-    if not ttn:
-        msg = "no TTN in deal"
-        logger.warning(f"lead.no_ttn lead_id={lead_id}")
-        set_checkbox_status(lead_id, f"ERROR: {msg}")
-        send_telegram(f"❌ Сделка <b>{lead_id}</b>: нет ТТН в сделке")
-        return jsonify({"error": msg}), 400
-    profile_id = detect_profile_for_ttn(str(ttn))
-    if not profile_id:
-        msg = "TTN does not belong to known Nova Poshta accounts"
-        logger.warning(f"lead.ttn_profile_not_found lead_id={lead_id} ttn={ttn}")
-        set_checkbox_status(lead_id, f"ERROR: {msg}")
-        send_telegram(
-            f"❌ Сделка <b>{lead_id}</b>: ТТН <code>{ttn}</code> не относится ни к одному аккаунту НП"
-        )
-        return jsonify({"error": msg}), 400
-    try:
-        result = create_receipt_for_lead_data(lead_data, profile_id)
-    except Exception as e:
-        msg = str(e)
-        logger.exception(f"checkbox.create.error lead_id={lead_id} profile_id={profile_id} error={msg}")
-        set_checkbox_status(lead_id, f"ERROR: {msg}")
-        sender_name = resolve_sender_name(str(profile_id))
-        send_telegram(
-            f"❌ Сделка <b>{lead_id}</b>: ошибка при создании чека ({sender_name})\n<code>{msg}</code>",
-            str(profile_id),
-        )
-        return jsonify({"error": msg}), 500
-    receipt_id = result.get("receipt_id") or ""
-    receipt_number = result.get("receipt_number") or ""
-    error = result.get("error")
-    if error:
-        logger.error(
-            f"checkbox.create.result_error lead_id={lead_id} profile_id={profile_id} error={error}"
-        )
-        set_checkbox_status(lead_id, f"ERROR: {error}")
-        sender_name = resolve_sender_name(str(profile_id))
-        send_telegram(
-            f"❌ Сделка <b>{lead_id}</b>: ошибка создания чека ({sender_name})\n<code>{error}</code>",
-            str(profile_id),
-        )
-        return jsonify(
-            {
-                "error": error,
-                "receipt_id": receipt_id,
-                "receipt_number": receipt_number,
-                "profile_id": profile_id,
-            }
-        ), 500
-    text = f"OK: {receipt_number or '—'} (id: {receipt_id or '—'})"
-    set_checkbox_status(lead_id, text)
-    logger.info(
-        f"checkbox.create.ok lead_id={lead_id} profile_id={profile_id} "
-        f"receipt_id={receipt_id} receipt_number={receipt_number}"
-    )
-    sender_name = resolve_sender_name(str(profile_id))
-    send_telegram(
-        f"✅ Сделка <b>{lead_id}</b>: чек выдан успешно ({sender_name})\n"
-        f"ID: <code>{receipt_id or '—'}</code>",
-        str(profile_id),
-    )
-    return jsonify(
-        {
-            "status": "ok",
-            "lead_id": lead_id,
-            "profile_id": profile_id,
-            "receipt_id": receipt_id,
-            "receipt_number": receipt_number,
-        }
-    ), 200
+    logger.info(f"webhook.received lead_ids={lead_ids}")
+    if WEBHOOK_ASYNC:
+        jobs = [{"lead_id": lead_id, "job_id": enqueue_lead(lead_id)} for lead_id in lead_ids]
+        start_workers(JOB_WORKERS)
+        if len(jobs) == 1:
+            return jsonify({"status": "queued", **jobs[0]}), 202
+        return jsonify({"status": "queued", "jobs": jobs}), 202
+    if len(lead_ids) == 1:
+        result, status_code = process_lead(lead_ids[0])
+        return jsonify(result), status_code
+    results = [
+        {"lead_id": lead_id, "status_code": status_code, **result}
+        for lead_id, result, status_code in process_leads(lead_ids)
+    ]
+    status_code = 500 if any(r["status_code"] >= 500 for r in results) else 200
+    return jsonify({"results": results}), status_code
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from local_store import resolve_path
+
+logger = logging.getLogger("metrics")
+
+PREFIX = "amocheckbox_"
+STALE_SNAPSHOT_AGE = 86400
+RETIRED_SNAPSHOT = "retired.json"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, LabelKey]
+
+_counters: Dict[MetricKey, float] = {}
+_gauges: Dict[MetricKey, float] = {}
+_histograms: Dict[MetricKey, List[float]] = {}
+_observers: List[Callable[[str, float, Dict[str, str]], None]] = []
+_lock = threading.Lock()
+_flusher_pid: Optional[int] = None
+
+
+def _key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, amount: float = 1.0, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+    _ensure_flusher()
+
+
+def gauge_add(name: str, delta: float, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0.0) + delta
+    _ensure_flusher()
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = [0.0] * (len(BUCKETS) + 2)
+            _histograms[key] = series
+        for idx, bound in enumerate(BUCKETS):
+            if value <= bound:
+                series[idx] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+    for observer in _observers:
+        observer(name, value, dict(key[1]))
+    _ensure_flusher()
+
+
+def add_observer(fn: Callable[[str, float, Dict[str, str]], None]) -> None:
+    _observers.append(fn)
+
+
+@contextmanager
+def timed(name: str, **labels: Any) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+@contextmanager
+def in_flight(name: str, **labels: Any) -> Iterator[None]:
+    gauge_add(name, 1, **labels)
+    try:
+        yield
+    finally:
+        gauge_add(name, -1, **labels)
+
+
+def stage(name: str) -> Any:
+    return timed("stage_seconds", stage=name)
+
+
+def _metrics_dir() -> str:
+    return resolve_path(METRICS_DIR)
+
+
+def _snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in _gauges.items()],
+            "histograms": [[name, dict(labels), list(series)] for (name, labels), series in _histograms.items()],
+        }
+
+
+def _write_snapshot(path: str, snap: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(snap, fh)
+    os.replace(tmp_path, path)
+
+
+def flush() -> None:
+    directory = _metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    _write_snapshot(os.path.join(directory, f"{os.getpid()}.json"), _snapshot())
+
+
+def _flusher_loop() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"metrics.flush_error error={e}")
+
+
+def _ensure_flusher() -> None:
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _lock:
+        if _flusher_pid == pid:
+            return
+        threading.Thread(target=_flusher_loop, name="metrics-flusher", daemon=True).start()
+        _flusher_pid = pid
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _fold(retired: Dict[str, Any], snap: Dict[str, Any]) -> Dict[str, Any]:
+    counters: Dict[MetricKey, float] = {}
+    histograms: Dict[MetricKey, List[float]] = {}
+    for source in (retired, snap):
+        for name, labels, value in source.get("counters") or []:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, series in source.get("histograms") or []:
+            merged = histograms.setdefault(_key(name, labels), [0.0] * len(series))
+            for idx, value in enumerate(series):
+                merged[idx] += value
+    return {
+        "pid": 0,
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "gauges": [],
+        "histograms": [[name, dict(labels), series] for (name, labels), series in histograms.items()],
+    }
+
+
+def _retire_stale(directory: str, now: float) -> None:
+    # Counters of exited processes move into one retired snapshot so merged totals never go backwards.
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        if os.path.basename(path) == RETIRED_SNAPSHOT:
+            continue
+        try:
+            if now - os.path.getmtime(path) <= STALE_SNAPSHOT_AGE:
+                continue
+        except OSError:
+            continue
+        snap = _read_snapshot(path)
+        if snap is None or _pid_alive(int(snap.get("pid") or 0)):
+            continue
+        with open(os.path.join(directory, f"{RETIRED_SNAPSHOT}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                continue
+            retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+            _write_snapshot(retired_path, _fold(_read_snapshot(retired_path) or {}, snap))
+            os.remove(path)
+
+
+def _load_all() -> List[Dict[str, Any]]:
+    directory = _metrics_dir()
+    try:
+        _retire_stale(directory, time.time())
+    except OSError as e:
+        logger.warning(f"metrics.retire_error error={e}")
+    snapshots: List[Dict[str, Any]] = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        snap = _read_snapshot(path)
+        if snap is not None:
+            snapshots.append(snap)
+    return snapshots
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = sorted(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def render() -> str:
+    flush()
+    counters: Dict[MetricKey, float] = {}
+    gauges: Dict[MetricKey, float] = {}
+    histograms: Dict[MetricKey, List[float]] = {}
+    for snap in _load_all():
+        for name, labels, value in snap.get("counters") or []:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0.0) + value
+        pid = int(snap.get("pid") or 0)
+        if pid and _pid_alive(pid):
+            for name, labels, value in snap.get("gauges") or []:
+                key = _key(name, labels)
+                gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, series in snap.get("histograms") or []:
+            key = _key(name, labels)
+            merged = histograms.setdefault(key, [0.0] * len(series))
+            for idx, value in enumerate(series):
+                merged[idx] += value
+    lines: List[str] = []
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        seen = set()
+        for (name, labels), value in sorted(series.items()):
+            metric = PREFIX + name
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} {kind}")
+                seen.add(metric)
+            lines.append(f"{metric}{_labels_text(dict(labels))} {value:g}")
+    seen = set()
+    for (name, labels), values in sorted(histograms.items()):
+        metric = PREFIX + name
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} histogram")
+            seen.add(metric)
+        label_map = dict(labels)
+        cumulative = 0.0
+        for idx, bound in enumerate(BUCKETS):
+            cumulative += values[idx]
+            lines.append(f"{metric}_bucket{_labels_text(label_map, ('le', f'{bound:g}'))} {cumulative:g}")
+        lines.append(f"{metric}_bucket{_labels_text(label_map, ('le', '+Inf'))} {values[-1]:g}")
+        lines.append(f"{metric}_sum{_labels_text(label_map)} {values[-2]:g}")
+        lines.append(f"{metric}_count{_labels_text(label_map)} {values[-1]:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+from config import MONEY_QUANT
+
+
+def to_minor(amount: Decimal) -> int:
+    if amount is None:
+        return 0
+    try:
+        value = Decimal(amount).quantize(MONEY_QUANT)
+    except Exception:
+        value = Decimal("0")
+    return max(0, int(value * 100))
+
+
+def to_milli(quantity: Decimal) -> int:
+    try:
+        q = Decimal(quantity)
+    except Exception:
+        return 0
+    if q <= 0:
+        return 0
+    return int((q * 1000).to_integral_value())
+
+
+@dataclass(frozen=True, slots=True)
+class PurchaseItem:
+    name: str
+    quantity_milli: int
+    price_minor: int
+
+
+@dataclass(frozen=True, slots=True)
+class ReceiptLine:
+    code: str
+    name: str
+    price_minor: int
+    quantity_milli: int
+    sum_minor: int
+
+    def to_good(self) -> Dict[str, Any]:
+        return {
+            "good": {
+                "code": self.code,
+                "name": self.name,
+                "price": self.price_minor,
+                "tax": [8],
+            },
+            "quantity": self.quantity_milli,
+            "is_return": False,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class LeadData:
+    id: int
+    status_value: Optional[str]
+    discount_minor: int
+    checkbox_status: Optional[str]
+    email: Optional[str]
+    ttn: Optional[str]
+    purchases: Tuple[PurchaseItem, ...]
+    raw: Optional[Dict[str, Any]] = None
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import httpx
+
+from async_http import http_request
+from circuit_breaker import CircuitOpenError
+from config import BREAKER_OPEN_SECONDS, NP_API_URL, NP_BATCH_SIZE, NP_BATCH_WINDOW_MS
+from nova_poshta_common import (
+    Detected,
+    Detection,
+    TtnLookupIncomplete,
+    batch_timeout,
+    can_check,
+    key_label,
+    matched_from_response,
+    ordered_profiles,
+    status_documents_body,
+    waves,
+)
+from ttn_cache import lookup as cache_lookup
+
+logger = logging.getLogger("nova_poshta_service")
+
+
+async def _check_chunk_with_key(api_key: str, ttns: List[str], expected_sender_name: str) -> Optional[Set[str]]:
+    logger.debug("np.check_ttn.request", extra={"ttns": len(ttns), "api_key": api_key[:4]})
+    try:
+        resp = await http_request(
+            "novaposhta",
+            "POST",
+            NP_API_URL,
+            breaker_key=key_label(api_key),
+            json=status_documents_body(api_key, ttns),
+        )
+    except httpx.HTTPError as e:
+        logger.error("np.check_ttn.http_error", extra={"ttns": len(ttns), "error": str(e)})
+        return None
+    return matched_from_response(resp, ttns, expected_sender_name)
+
+
+async def _check_ttns_with_key(
+    api_key: str, ttns: List[str], expected_sender_name: str
+) -> Tuple[Set[str], Set[str]]:
+    if not can_check(api_key, ttns, expected_sender_name):
+        return set(), set()
+    chunks = [ttns[i : i + NP_BATCH_SIZE] for i in range(0, len(ttns), NP_BATCH_SIZE)]
+    results = await asyncio.gather(*(_check_chunk_with_key(api_key, chunk, expected_sender_name) for chunk in chunks))
+    matched: Set[str] = set()
+    failed: Set[str] = set()
+    for chunk, chunk_matched in zip(chunks, results):
+        if chunk_matched is None:
+            failed.update(chunk)
+        else:
+            matched.update(chunk_matched)
+    return matched, failed
+
+
+async def _detect_uncached(pending: List[str]) -> Detected:
+    detection = Detection(pending)
+    for wave in waves(ordered_profiles()):
+        if not detection.remaining:
+            break
+        ttns = list(detection.remaining)
+        tasks: Dict["asyncio.Task[Tuple[Set[str], Set[str]]]", str] = {
+            asyncio.ensure_future(_check_ttns_with_key(profile.np_api_key, ttns, profile.np_sender_name)): profile.id
+            for profile in wave
+        }
+        waiting = set(tasks)
+        try:
+            while waiting and detection.remaining:
+                done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        matched, failed = task.result()
+                    except CircuitOpenError as e:
+                        detection.reject(e)
+                        continue
+                    detection.add(tasks[task], matched, failed)
+        finally:
+            for task in waiting:
+                task.cancel()
+    await asyncio.to_thread(detection.store)
+    return detection.finish()
+
+
+async def detect_profiles_for_ttns(ttns: Iterable[str]) -> Dict[str, Optional[str]]:
+    result: Dict[str, Optional[str]] = {}
+    pending: List[str] = []
+    for raw in ttns:
+        ttn = (raw or "").strip()
+        if not ttn or ttn in result:
+            continue
+        cached, profile_id = await asyncio.to_thread(cache_lookup, ttn)
+        result[ttn] = profile_id
+        if not cached:
+            pending.append(ttn)
+    if pending:
+        resolved, errors = await _detect_uncached(pending)
+        result.update(resolved)
+        for ttn in errors:
+            result.pop(ttn, None)
+    return result
+
+
+class _MicroBatcher:
+    def __init__(self, window_seconds: float) -> None:
+        self._window = window_seconds
+        self._pending: Dict[str, List["asyncio.Future[Optional[str]]"]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def submit(self, ttn: str) -> "asyncio.Future[Optional[str]]":
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[Optional[str]]" = loop.create_future()
+        self._pending.setdefault(ttn, []).append(future)
+        if len(self._pending) >= NP_BATCH_SIZE:
+            loop.create_task(self._run(self._take()))
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, lambda: loop.create_task(self._run(self._take())))
+        return future
+
+    def _take(self) -> Dict[str, List["asyncio.Future[Optional[str]]"]]:
+        batch = self._pending
+        self._pending = {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    async def _run(self, batch: Dict[str, List["asyncio.Future[Optional[str]]"]]) -> None:
+        if not batch:
+            return
+        try:
+            result, errors = await _detect_uncached(list(batch.keys()))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for ttn, futures in batch.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if ttn in errors:
+                    future.set_exception(errors[ttn])
+                else:
+                    future.set_result(result.get(ttn))
+
+
+_batcher = _MicroBatcher(NP_BATCH_WINDOW_MS / 1000.0) if NP_BATCH_WINDOW_MS > 0 else None
+
+
+async def detect_profile_for_ttn(ttn: str) -> Optional[str]:
+    ttn = (ttn or "").strip()
+    if not ttn:
+        return None
+    cached, profile_id = await asyncio.to_thread(cache_lookup, ttn)
+    if cached:
+        return profile_id
+    if _batcher is not None:
+        try:
+            return await asyncio.wait_for(_batcher.submit(ttn), batch_timeout())
+        except asyncio.TimeoutError:
+            logger.error("np.detect_profile.timeout", extra={"ttn": ttn})
+            raise TtnLookupIncomplete(1, BREAKER_OPEN_SECONDS)
+    result, errors = await _detect_uncached([ttn])
+    if ttn in errors:
+        raise errors[ttn]
+    return result.get(ttn)
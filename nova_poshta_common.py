@@ -0,0 +1,185 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from circuit_breaker import CircuitOpenError
+from config import BREAKER_OPEN_SECONDS, NP_BATCH_WINDOW_MS, NP_FANOUT_CONCURRENCY, PROFILES, Profile
+from http_pool import get_timeout
+from ttn_cache import store as cache_store
+
+logger = logging.getLogger("nova_poshta_service")
+
+HIT_DECAY = 0.9
+
+Detected = Tuple[Dict[str, Optional[str]], Dict[str, CircuitOpenError]]
+
+_hit_scores: Dict[str, float] = {}
+_scores_lock = threading.Lock()
+
+
+class TtnLookupIncomplete(CircuitOpenError):
+    def __init__(self, ttns: int, retry_after: float) -> None:
+        super().__init__("novaposhta", retry_after)
+        self.args = (f"{ttns} TTN(s) could not be checked with every account, retry in {retry_after:.1f}s",)
+
+
+def _normalize_name(value: str) -> str:
+    return value.strip().lower() if value else ""
+
+
+def can_check(api_key: str, ttns: List[str], expected_sender_name: str) -> bool:
+    if not api_key or not ttns:
+        return False
+    if not expected_sender_name:
+        logger.warning("np.check_ttn.no_expected_sender_name", extra={"ttns": len(ttns), "api_key": api_key[:4]})
+        return False
+    return True
+
+
+def key_label(api_key: str) -> str:
+    return api_key[:4]
+
+
+def status_documents_body(api_key: str, ttns: List[str]) -> Dict[str, Any]:
+    return {
+        "apiKey": api_key,
+        "modelName": "TrackingDocument",
+        "calledMethod": "getStatusDocuments",
+        "methodProperties": {
+            "Documents": [{"DocumentNumber": ttn, "Phone": ""} for ttn in ttns],
+        },
+    }
+
+
+def matched_from_response(resp: Any, ttns: List[str], expected_sender_name: str) -> Optional[Set[str]]:
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "np.raw_response",
+            extra={
+                "ttns": len(ttns),
+                "status_code": resp.status_code,
+                "raw": resp.text[:2000],
+            },
+        )
+    try:
+        data = resp.json()
+    except Exception:
+        logger.error("np.check_ttn.bad_json", extra={"ttns": len(ttns), "status": resp.status_code})
+        return None
+    success = bool(data.get("success"))
+    docs = data.get("data") or []
+    errors = data.get("errors") or []
+    if not success or errors:
+        # A bad key, rate limit or NP-side failure says nothing about ownership.
+        logger.error("np.check_ttn.api_error", extra={"ttns": len(ttns), "success": success, "errors": errors})
+        return None
+    if not docs:
+        logger.info("np.check_ttn.no_match", extra={"ttns": len(ttns), "docs_len": 0})
+        return set()
+    requested = set(ttns)
+    expected = _normalize_name(expected_sender_name)
+    matched: Set[str] = set()
+    for idx, doc in enumerate(docs):
+        number = str(doc.get("Number") or "").strip()
+        if not number and len(ttns) == 1 and idx == 0:
+            number = ttns[0]
+        if number not in requested:
+            continue
+        sender_name = str(doc.get("CounterpartySenderDescription") or "")
+        if _normalize_name(sender_name) != expected:
+            logger.debug(
+                "np.check_ttn.sender_mismatch",
+                extra={
+                    "ttn": number,
+                    "sender_name": sender_name,
+                    "expected_sender_name": expected_sender_name,
+                },
+            )
+            continue
+        logger.debug(
+            "np.check_ttn.match",
+            extra={"ttn": number, "sender_name": sender_name},
+        )
+        matched.add(number)
+    return matched
+
+
+def _np_profiles() -> List[Profile]:
+    return [profile for profile in PROFILES.values() if profile.np_api_key]
+
+
+def ordered_profiles() -> List[Profile]:
+    with _scores_lock:
+        scores = dict(_hit_scores)
+    return sorted(_np_profiles(), key=lambda profile: -scores.get(profile.id, 0.0))
+
+
+def waves(profiles: List[Profile]) -> List[List[Profile]]:
+    size = NP_FANOUT_CONCURRENCY if NP_FANOUT_CONCURRENCY > 0 else max(1, len(profiles))
+    return [profiles[i : i + size] for i in range(0, len(profiles), size)]
+
+
+def _record_hits(owners: List[str]) -> None:
+    with _scores_lock:
+        for owner in owners:
+            for profile_id in list(_hit_scores):
+                _hit_scores[profile_id] *= HIT_DECAY
+            _hit_scores[owner] = _hit_scores.get(owner, 0.0) + (1 - HIT_DECAY)
+
+
+def hit_scores() -> Dict[str, float]:
+    with _scores_lock:
+        return {profile_id: round(score, 3) for profile_id, score in _hit_scores.items()}
+
+
+class Detection:
+    def __init__(self, pending: List[str]) -> None:
+        self.result: Dict[str, Optional[str]] = {ttn: None for ttn in pending}
+        self.remaining = list(pending)
+        self.incomplete: Set[str] = set()
+        self.rejected: Optional[CircuitOpenError] = None
+
+    def add(self, profile_id: str, matched: Set[str], failed: Set[str]) -> None:
+        # The first account to claim a TTN owns it; a late answer from another account cannot override it.
+        for ttn in self.remaining:
+            if ttn in matched:
+                self.result[ttn] = profile_id
+        self.remaining = [ttn for ttn in self.remaining if ttn not in matched]
+        self.incomplete.update(failed)
+
+    def reject(self, error: CircuitOpenError) -> None:
+        self.rejected = error
+        self.incomplete.update(self.remaining)
+
+    def store(self) -> None:
+        owners: List[str] = []
+        for ttn, profile_id in self.result.items():
+            if profile_id:
+                cache_store(ttn, profile_id)
+                owners.append(profile_id)
+            elif ttn not in self.incomplete:
+                cache_store(ttn, None)
+        _record_hits(owners)
+
+    def finish(self) -> Detected:
+        unresolved = [ttn for ttn in self.remaining if ttn in self.incomplete]
+        logger.info(
+            "np.detect_profiles.done",
+            extra={
+                "ttns": len(self.result),
+                "unmatched": len(self.remaining),
+                "incomplete": len(unresolved),
+            },
+        )
+        errors: Dict[str, CircuitOpenError] = {}
+        if unresolved:
+            # An account could not be asked, so "no match" would be a guess; only these TTNs retry later.
+            error = self.rejected or TtnLookupIncomplete(len(unresolved), BREAKER_OPEN_SECONDS)
+            errors = dict.fromkeys(unresolved, error)
+        return {ttn: profile_id for ttn, profile_id in self.result.items() if ttn not in errors}, errors
+
+
+def batch_timeout() -> float:
+    # Waves run one after another and each is a single request per account; the window comes first.
+    wave_count = max(1, len(waves(_np_profiles())))
+    return NP_BATCH_WINDOW_MS / 1000.0 + get_timeout("novaposhta") * wave_count + 1.0
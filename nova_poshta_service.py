@@ -1,95 +1,180 @@
 import logging
-from typing import Optional
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import requests
 
-from config import NP_API_KEY_1, NP_API_KEY_2, NP_SENDER_NAME_1, NP_SENDER_NAME_2
+from circuit_breaker import CircuitOpenError
+from config import BREAKER_OPEN_SECONDS, NP_API_URL, NP_BATCH_SIZE, NP_BATCH_WINDOW_MS, NP_FANOUT_WORKERS, Profile
+from http_pool import http_request
+from nova_poshta_common import (
+    Detected,
+    Detection,
+    TtnLookupIncomplete,
+    batch_timeout,
+    can_check,
+    key_label,
+    matched_from_response,
+    ordered_profiles,
+    status_documents_body,
+    waves,
+)
+from ttn_cache import lookup as cache_lookup
 
 logger = logging.getLogger("nova_poshta_service")
 
-NP_API_URL = "https://api.novaposhta.ua/v2.0/json/"
-
-
-def _normalize_name(value: str) -> str:
-    return value.strip().lower() if value else ""
-
-
-def _check_ttn_with_key(api_key: str, ttn: str, expected_sender_name: str) -> bool:
-    if not api_key:
-        return False
-    if not expected_sender_name:
-        logger.warning("np.check_ttn.no_expected_sender_name", extra={"ttn": ttn, "api_key": api_key[:4]})
-        return False
-    body = {
-        "apiKey": api_key,
-        "modelName": "TrackingDocument",
-        "calledMethod": "getStatusDocuments",
-        "methodProperties": {
-            "Documents": [
-                {
-                    "DocumentNumber": ttn,
-                    "Phone": "",
-                }
-            ]
-        },
-    }
-    logger.debug("np.check_ttn.request", extra={"ttn": ttn, "api_key": api_key[:4]})
-    try:
-        resp = requests.post(NP_API_URL, json=body, timeout=10)
-    except requests.RequestException as e:
-        logger.error("np.check_ttn.http_error", extra={"ttn": ttn, "error": str(e)})
-        return False
-    logger.info(
-        "np.raw_response",
-        extra={
-            "ttn": ttn,
-            "status_code": resp.status_code,
-            "raw": resp.text[:2000],
-        },
-    )
+_executor = ThreadPoolExecutor(max_workers=max(1, NP_FANOUT_WORKERS), thread_name_prefix="np-fanout")
+# Full micro-batches get their own pool: a batch waits on fan-out calls, so sharing _executor could deadlock.
+_batch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="np-batch")
+
+
+def _check_ttns_with_key(
+    api_key: str, ttns: List[str], expected_sender_name: str
+) -> Tuple[Set[str], Set[str]]:
+    if not can_check(api_key, ttns, expected_sender_name):
+        return set(), set()
+    matched: Set[str] = set()
+    failed: Set[str] = set()
+    for i in range(0, len(ttns), NP_BATCH_SIZE):
+        chunk = ttns[i : i + NP_BATCH_SIZE]
+        chunk_matched = _check_chunk_with_key(api_key, chunk, expected_sender_name)
+        if chunk_matched is None:
+            failed.update(chunk)
+        else:
+            matched.update(chunk_matched)
+    return matched, failed
+
+
+def _check_chunk_with_key(api_key: str, ttns: List[str], expected_sender_name: str) -> Optional[Set[str]]:
+    logger.debug("np.check_ttn.request", extra={"ttns": len(ttns), "api_key": api_key[:4]})
     try:
-        data = resp.json()
-    except Exception:
-        logger.error("np.check_ttn.bad_json", extra={"ttn": ttn, "status": resp.status_code})
-        return False
-    success = bool(data.get("success"))
-    docs = data.get("data") or []
-    errors = data.get("errors") or []
-    if not success or errors or not docs:
-        logger.info(
-            "np.check_ttn.no_match",
-            extra={"ttn": ttn, "success": success, "errors": errors, "docs_len": len(docs)},
+        resp = http_request(
+            "novaposhta",
+            "POST",
+            NP_API_URL,
+            breaker_key=key_label(api_key),
+            json=status_documents_body(api_key, ttns),
         )
-        return False
-    doc = docs[0]
-    sender_name = str(doc.get("CounterpartySenderDescription") or "")
-    logger.info(
-        "np.check_ttn.sender_name",
-        extra={"ttn": ttn, "sender_name": sender_name},
-    )
-    if _normalize_name(sender_name) != _normalize_name(expected_sender_name):
-        logger.info(
-            "np.check_ttn.sender_mismatch",
-            extra={
-                "ttn": ttn,
-                "sender_name": sender_name,
-                "expected_sender_name": expected_sender_name,
-            },
-        )
-        return False
-    logger.info(
-        "np.check_ttn.match",
-        extra={"ttn": ttn, "sender_name": sender_name},
-    )
-    return True
+    except requests.RequestException as e:
+        logger.error("np.check_ttn.http_error", extra={"ttns": len(ttns), "error": str(e)})
+        return None
+    return matched_from_response(resp, ttns, expected_sender_name)
+
+
+def detect_profiles_for_ttns(ttns: Iterable[str]) -> Dict[str, Optional[str]]:
+    # TTNs that could not be checked with every account are left out of the result.
+    result: Dict[str, Optional[str]] = {}
+    pending: List[str] = []
+    for raw in ttns:
+        ttn = (raw or "").strip()
+        if not ttn or ttn in result:
+            continue
+        cached, profile_id = cache_lookup(ttn)
+        result[ttn] = profile_id
+        if not cached:
+            pending.append(ttn)
+    if pending:
+        resolved, errors = _detect_uncached(pending)
+        result.update(resolved)
+        for ttn in errors:
+            result.pop(ttn, None)
+    return result
+
+
+def _detect_uncached(pending: List[str]) -> Detected:
+    detection = Detection(pending)
+    for wave in waves(ordered_profiles()):
+        if not detection.remaining:
+            break
+        ttns = list(detection.remaining)
+        futures: Dict[Future, Profile] = {
+            _executor.submit(_check_ttns_with_key, profile.np_api_key, ttns, profile.np_sender_name): profile
+            for profile in wave
+        }
+        waiting = set(futures)
+        while waiting and detection.remaining:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    matched, failed = future.result()
+                except CircuitOpenError as e:
+                    detection.reject(e)
+                    continue
+                detection.add(futures[future].id, matched, failed)
+    detection.store()
+    return detection.finish()
+
+
+class _MicroBatcher:
+    def __init__(self, window_seconds: float) -> None:
+        self._window = window_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[Future]] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def submit(self, ttn: str) -> "Future[Optional[str]]":
+        future: Future = Future()
+        batch = None
+        with self._lock:
+            self._pending.setdefault(ttn, []).append(future)
+            if len(self._pending) >= NP_BATCH_SIZE:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            _batch_executor.submit(self._run, batch)
+        return future
+
+    def _take(self) -> Dict[str, List[Future]]:
+        batch = self._pending
+        self._pending = {}
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self) -> None:
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch: Dict[str, List[Future]]) -> None:
+        try:
+            result, errors = _detect_uncached(list(batch.keys()))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+        for ttn, futures in batch.items():
+            for future in futures:
+                if ttn in errors:
+                    future.set_exception(errors[ttn])
+                else:
+                    future.set_result(result.get(ttn))
+
+
+_batcher = _MicroBatcher(NP_BATCH_WINDOW_MS / 1000.0) if NP_BATCH_WINDOW_MS > 0 else None
 
 
 def detect_profile_for_ttn(ttn: str) -> Optional[str]:
     ttn = (ttn or "").strip()
     if not ttn:
         return None
-    if _check_ttn_with_key(NP_API_KEY_1, ttn, NP_SENDER_NAME_1):
-        return "1"
-    if _check_ttn_with_key(NP_API_KEY_2, ttn, NP_SENDER_NAME_2):
-        return "2"
-    return None
+    cached, profile_id = cache_lookup(ttn)
+    if cached:
+        return profile_id
+    if _batcher is not None:
+        try:
+            return _batcher.submit(ttn).result(timeout=batch_timeout())
+        except FutureTimeoutError:
+            logger.error("np.detect_profile.timeout", extra={"ttn": ttn})
+            raise TtnLookupIncomplete(1, BREAKER_OPEN_SECONDS)
+    result, errors = _detect_uncached([ttn])
+    if ttn in errors:
+        raise errors[ttn]
+    return result.get(ttn)
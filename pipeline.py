@@ -0,0 +1,108 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from amocrm_service import (
+    load_lead_with_details,
+    load_leads_with_details,
+    is_target_status,
+    is_already_processed,
+    set_checkbox_status,
+)
+from checkbox_service import SellOutcomeUnknown, create_receipt_for_lead_data
+from circuit_breaker import CircuitOpenError
+from config import LEAD_BATCH_PARALLELISM
+from deferred_queue import defer_lead
+from lead_dedup import run_once
+from lead_outcomes import (
+    Decision,
+    already_processed,
+    load_error,
+    no_ttn,
+    receipt_exception,
+    receipt_result,
+    sell_outcome_unknown,
+    skipped_by_status,
+    ttn_profile_not_found,
+    upstream_unavailable,
+)
+from metrics import stage
+from models import LeadData
+from nova_poshta_service import detect_profile_for_ttn
+from receipt_reconciler import track as track_receipt
+from telegram_notify import send_telegram
+
+logger = logging.getLogger("pipeline")
+
+
+def process_lead(lead_id: int, lead_data: Optional[LeadData] = None) -> Tuple[Dict[str, Any], int]:
+    return run_once(lead_id, lambda lid: _process_lead(lid, lead_data))
+
+
+def process_leads(lead_ids: List[int]) -> List[Tuple[int, Dict[str, Any], int]]:
+    try:
+        with stage("lead_load_batch"):
+            preloaded = load_leads_with_details(lead_ids)
+    except Exception as e:
+        logger.exception(f"lead.batch_load.error count={len(lead_ids)} error={e}")
+        preloaded = {}
+
+    def run(lead_id: int) -> Tuple[int, Dict[str, Any], int]:
+        lead_data = preloaded.get(lead_id)
+        body, status_code = process_lead(lead_id, lead_data if isinstance(lead_data, LeadData) else None)
+        return lead_id, body, status_code
+
+    with ThreadPoolExecutor(max_workers=max(1, LEAD_BATCH_PARALLELISM)) as pool:
+        return list(pool.map(run, lead_ids))
+
+
+def _set_status(lead_id: int, text: str) -> None:
+    with stage("status_write"):
+        set_checkbox_status(lead_id, text)
+
+
+def _apply(lead_id: int, decision: Decision) -> Tuple[Dict[str, Any], int]:
+    if decision.defer_delay is not None:
+        defer_lead(lead_id, decision.profile_id or "", decision.defer_delay)
+    if decision.status_text:
+        _set_status(lead_id, decision.status_text)
+    if decision.track_receipt:
+        track_receipt(decision.track_receipt, lead_id, decision.profile_id or "")
+    if decision.telegram_text:
+        send_telegram(decision.telegram_text, decision.profile_id)
+    return decision.result
+
+
+def _process_lead(lead_id: int, lead_data: Optional[LeadData] = None) -> Tuple[Dict[str, Any], int]:
+    if lead_data is None:
+        try:
+            with stage("lead_load"):
+                lead_data = load_lead_with_details(lead_id)
+        except CircuitOpenError as e:
+            return _apply(lead_id, upstream_unavailable(lead_id, "", e))
+        except Exception as e:
+            return _apply(lead_id, load_error(lead_id, e))
+    if is_already_processed(lead_data):
+        return _apply(lead_id, already_processed(lead_id))
+    if not is_target_status(lead_data):
+        return _apply(lead_id, skipped_by_status(lead_data))
+    ttn = lead_data.ttn or ""
+    if not ttn:
+        return _apply(lead_id, no_ttn(lead_id))
+    try:
+        with stage("ttn_detect"):
+            profile_id = detect_profile_for_ttn(str(ttn))
+    except CircuitOpenError as e:
+        return _apply(lead_id, upstream_unavailable(lead_id, "", e))
+    if not profile_id:
+        return _apply(lead_id, ttn_profile_not_found(lead_id, ttn))
+    profile_id = str(profile_id)
+    try:
+        result = create_receipt_for_lead_data(lead_data, profile_id)
+    except CircuitOpenError as e:
+        return _apply(lead_id, upstream_unavailable(lead_id, profile_id, e))
+    except SellOutcomeUnknown as e:
+        return _apply(lead_id, sell_outcome_unknown(lead_id, profile_id, e))
+    except Exception as e:
+        return _apply(lead_id, receipt_exception(lead_id, profile_id, e))
+    return _apply(lead_id, receipt_result(lead_id, profile_id, result))
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from amocrm_service import is_already_processed, is_target_status
+from amocrm_service_async import load_lead_with_details, load_leads_with_details, set_checkbox_status
+from checkbox_service import SellOutcomeUnknown
+from checkbox_service_async import create_receipt_for_lead_data
+from circuit_breaker import CircuitOpenError
+from config import LEAD_BATCH_PARALLELISM
+from deferred_queue import defer_lead
+from lead_dedup import run_once_async
+from lead_outcomes import (
+    Decision,
+    already_processed,
+    load_error,
+    no_ttn,
+    receipt_exception,
+    receipt_result,
+    sell_outcome_unknown,
+    skipped_by_status,
+    ttn_profile_not_found,
+    upstream_unavailable,
+)
+from metrics import stage
+from models import LeadData
+from nova_poshta_async import detect_profile_for_ttn
+from receipt_reconciler import track as track_receipt
+from telegram_notify_async import send_telegram
+
+logger = logging.getLogger("pipeline")
+
+
+async def process_lead(lead_id: int, lead_data: Optional[LeadData] = None) -> Tuple[Dict[str, Any], int]:
+    return await run_once_async(lead_id, lambda lid: _process_lead(lid, lead_data))
+
+
+async def process_leads(lead_ids: List[int]) -> List[Tuple[int, Dict[str, Any], int]]:
+    try:
+        with stage("lead_load_batch"):
+            preloaded = await load_leads_with_details(lead_ids)
+    except Exception as e:
+        logger.exception(f"lead.batch_load.error count={len(lead_ids)} error={e}")
+        preloaded = {}
+    semaphore = asyncio.Semaphore(max(1, LEAD_BATCH_PARALLELISM))
+
+    async def run(lead_id: int) -> Tuple[int, Dict[str, Any], int]:
+        lead_data = preloaded.get(lead_id)
+        async with semaphore:
+            body, status_code = await process_lead(lead_id, lead_data if isinstance(lead_data, LeadData) else None)
+        return lead_id, body, status_code
+
+    return list(await asyncio.gather(*(run(lead_id) for lead_id in lead_ids)))
+
+
+async def _set_status(lead_id: int, text: str) -> None:
+    with stage("status_write"):
+        await set_checkbox_status(lead_id, text)
+
+
+async def _apply(lead_id: int, decision: Decision) -> Tuple[Dict[str, Any], int]:
+    if decision.defer_delay is not None:
+        await asyncio.to_thread(defer_lead, lead_id, decision.profile_id or "", decision.defer_delay)
+    if decision.status_text:
+        await _set_status(lead_id, decision.status_text)
+    if decision.track_receipt:
+        await asyncio.to_thread(track_receipt, decision.track_receipt, lead_id, decision.profile_id or "")
+    if decision.telegram_text:
+        await send_telegram(decision.telegram_text, decision.profile_id)
+    return decision.result
+
+
+async def _process_lead(lead_id: int, lead_data: Optional[LeadData] = None) -> Tuple[Dict[str, Any], int]:
+    if lead_data is None:
+        try:
+            with stage("lead_load"):
+                lead_data = await load_lead_with_details(lead_id)
+        except CircuitOpenError as e:
+            return await _apply(lead_id, upstream_unavailable(lead_id, "", e))
+        except Exception as e:
+            return await _apply(lead_id, load_error(lead_id, e))
+    if await asyncio.to_thread(is_already_processed, lead_data):
+        return await _apply(lead_id, already_processed(lead_id))
+    if not is_target_status(lead_data):
+        return await _apply(lead_id, skipped_by_status(lead_data))
+    ttn = lead_data.ttn or ""
+    if not ttn:
+        return await _apply(lead_id, no_ttn(lead_id))
+    try:
+        with stage("ttn_detect"):
+            profile_id = await detect_profile_for_ttn(str(ttn))
+    except CircuitOpenError as e:
+        return await _apply(lead_id, upstream_unavailable(lead_id, "", e))
+    if not profile_id:
+        return await _apply(lead_id, ttn_profile_not_found(lead_id, ttn))
+    profile_id = str(profile_id)
+    try:
+        result = await create_receipt_for_lead_data(lead_data, profile_id)
+    except CircuitOpenError as e:
+        return await _apply(lead_id, upstream_unavailable(lead_id, profile_id, e))
+    except SellOutcomeUnknown as e:
+        return await _apply(lead_id, sell_outcome_unknown(lead_id, profile_id, e))
+    except Exception as e:
+        return await _apply(lead_id, receipt_exception(lead_id, profile_id, e))
+    return await _apply(lead_id, receipt_result(lead_id, profile_id, result))
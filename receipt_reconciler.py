@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from amocrm_service import set_checkbox_status
+from checkbox_api import get_cashier_token, get_receipt_for_profile
+from checkbox_common import CheckboxApiError
+from config import (
+    RECEIPT_RECONCILE_BATCH,
+    RECEIPT_RECONCILE_INTERVAL,
+    RECEIPT_RECONCILE_MAX_AGE,
+    RECEIPT_RECONCILE_MAX_BACKOFF,
+    RECEIPT_RECONCILE_PARALLELISM,
+    RECEIPT_RECONCILE_PATH,
+)
+from local_store import connect, transaction
+from log_setup import configure_logging
+from metrics import inc, stage
+from telegram_common import resolve_sender_name
+from telegram_notify import send_telegram
+
+logger = logging.getLogger("receipt_reconciler")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_receipts (
+    receipt_id TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL,
+    profile_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_check_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_receipts_due ON pending_receipts (next_check_at);
+"""
+
+_LEASE = 60
+
+_reconciler_pid: Optional[int] = None
+_reconciler_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(RECEIPT_RECONCILE_PATH, _SCHEMA)
+
+
+def enabled() -> bool:
+    return RECEIPT_RECONCILE_INTERVAL > 0
+
+
+def track(receipt_id: str, lead_id: int, profile_id: str) -> None:
+    now = time.time()
+    _conn().execute(
+        "INSERT OR IGNORE INTO pending_receipts (receipt_id, lead_id, profile_id, created_at, next_check_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (receipt_id, int(lead_id), str(profile_id), now, now + RECEIPT_RECONCILE_INTERVAL),
+    )
+    logger.info(f"receipt_reconciler.tracked receipt_id={receipt_id} lead_id={lead_id} profile_id={profile_id}")
+    start_reconciler()
+
+
+def _lease_batch(now: float) -> List[sqlite3.Row]:
+    conn = _conn()
+    with transaction(conn):
+        rows = conn.execute(
+            "SELECT receipt_id, lead_id, profile_id, attempts, created_at FROM pending_receipts "
+            "WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+            (now, RECEIPT_RECONCILE_BATCH),
+        ).fetchall()
+        for row in rows:
+            conn.execute(
+                "UPDATE pending_receipts SET next_check_at = ? WHERE receipt_id = ?",
+                (now + _LEASE, row["receipt_id"]),
+            )
+    return rows
+
+
+def _fetch(row: sqlite3.Row) -> Tuple[sqlite3.Row, Any, Optional[Exception]]:
+    try:
+        token = get_cashier_token(row["profile_id"])
+        return row, get_receipt_for_profile(token, row["profile_id"], row["receipt_id"]), None
+    except Exception as e:
+        return row, None, e
+
+
+def _finish(row: sqlite3.Row, result: str) -> None:
+    _conn().execute("DELETE FROM pending_receipts WHERE receipt_id = ?", (row["receipt_id"],))
+    inc("receipts_reconciled_total", result=result)
+
+
+def _postpone(row: sqlite3.Row, now: float) -> None:
+    delay = min(RECEIPT_RECONCILE_MAX_BACKOFF, RECEIPT_RECONCILE_INTERVAL * (2 ** row["attempts"]))
+    _conn().execute(
+        "UPDATE pending_receipts SET attempts = attempts + 1, next_check_at = ? WHERE receipt_id = ?",
+        (now + delay, row["receipt_id"]),
+    )
+
+
+def _alert(row: sqlite3.Row, reason: str) -> None:
+    sender_name = resolve_sender_name(row["profile_id"])
+    send_telegram(
+        f"❌ Сделка <b>{row['lead_id']}</b>: чек не фискализирован ({sender_name})\n"
+        f"ID: <code>{row['receipt_id']}</code>\n<code>{reason}</code>",
+        row["profile_id"],
+    )
+
+
+def _apply(row: sqlite3.Row, data: Any, error: Optional[Exception], now: float) -> None:
+    receipt_id = row["receipt_id"]
+    lead_id = row["lead_id"]
+    status = str(data.get("status") or "").upper() if isinstance(data, dict) else ""
+    fiscal_code = str(data.get("fiscal_code") or "") if isinstance(data, dict) else ""
+    if status == "DONE" and fiscal_code:
+        set_checkbox_status(lead_id, f"OK: {fiscal_code} (id: {receipt_id})")
+        _finish(row, "done")
+        logger.info(f"receipt_reconciler.done receipt_id={receipt_id} lead_id={lead_id} fiscal_code={fiscal_code}")
+        return
+    if status == "ERROR":
+        set_checkbox_status(lead_id, f"ERROR: fiscalization failed (id: {receipt_id})")
+        _finish(row, "error")
+        logger.error(f"receipt_reconciler.fiscal_error receipt_id={receipt_id} lead_id={lead_id}")
+        _alert(row, "Checkbox вернул статус ERROR")
+        return
+    if isinstance(error, CheckboxApiError) and error.status_code == 404 and row["attempts"] >= 1:
+        # The sell request never reached Checkbox, so the lead may be sold again.
+        set_checkbox_status(lead_id, f"ERROR: receipt was not created (id: {receipt_id})")
+        _finish(row, "missing")
+        logger.error(f"receipt_reconciler.missing receipt_id={receipt_id} lead_id={lead_id}")
+        _alert(row, "чек не найден в Checkbox")
+        return
+    if now - row["created_at"] > RECEIPT_RECONCILE_MAX_AGE:
+        _finish(row, "expired")
+        logger.error(f"receipt_reconciler.expired receipt_id={receipt_id} lead_id={lead_id} status={status}")
+        reason = status or error or "неизвестен"
+        _alert(row, f"статус {reason} после {RECEIPT_RECONCILE_MAX_AGE} с")
+        return
+    if error:
+        logger.warning(f"receipt_reconciler.fetch_error receipt_id={receipt_id} lead_id={lead_id} error={error}")
+    _postpone(row, now)
+
+
+def reconcile_once() -> int:
+    rows = _lease_batch(time.time())
+    if not rows:
+        return 0
+    with stage("receipt_reconcile"):
+        with ThreadPoolExecutor(max_workers=max(1, min(RECEIPT_RECONCILE_PARALLELISM, len(rows)))) as pool:
+            fetched = list(pool.map(_fetch, rows))
+    now = time.time()
+    for row, data, error in fetched:
+        try:
+            _apply(row, data, error, now)
+        except Exception as e:
+            logger.error(f"receipt_reconciler.apply_error receipt_id={row['receipt_id']} error={e}")
+            _postpone(row, now)
+    return len(rows)
+
+
+def stats() -> Dict[str, Any]:
+    now = time.time()
+    row = _conn().execute(
+        "SELECT COUNT(*), MIN(created_at), SUM(next_check_at <= ?) FROM pending_receipts", (now,)
+    ).fetchone()
+    return {
+        "pending": row[0],
+        "due": row[2] or 0,
+        "oldest_age": round(now - row[1], 3) if row[1] else 0,
+    }
+
+
+def _reconciler_loop() -> None:
+    while True:
+        time.sleep(RECEIPT_RECONCILE_INTERVAL)
+        try:
+            while reconcile_once() >= RECEIPT_RECONCILE_BATCH:
+                pass
+        except Exception as e:
+            logger.error(f"receipt_reconciler.loop_error error={e}")
+
+
+def start_reconciler() -> None:
+    global _reconciler_pid
+    if not enabled():
+        return
+    pid = os.getpid()
+    if _reconciler_pid == pid:
+        return
+    with _reconciler_lock:
+        if _reconciler_pid == pid:
+            return
+        threading.Thread(target=_reconciler_loop, name="receipt-reconciler", daemon=True).start()
+        _reconciler_pid = pid
+    logger.info(f"receipt_reconciler.started pid={pid}")
+
+
+if __name__ == "__main__":
+    configure_logging()
+    mode = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if mode == "stats":
+        print(json.dumps(stats()))
+    elif mode == "run":
+        print(json.dumps({"checked": reconcile_once()}))
+    else:
+        logger.error("receipt_reconciler.invalid_mode", extra={"mode": mode})
@@ -1,55 +1,159 @@
 import logging
+import os
 import sys
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
 import zoneinfo
 
-from config import LOG_LEVEL, CHECKBOX_PROFILES
-from checkbox_api import sign_in_for_profile, close_shift_for_profile, ensure_shift_for_profile
-from telegram_notify import send_telegram
-
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.INFO),
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+from config import CHECKBOX_PREWARM_LEAD, CHECKBOX_PROFILES, SHIFT_MAINTENANCE_DEADLINE
+from checkbox_api import (
+    get_cashier_token,
+    close_shift_for_profile,
+    ensure_shift_for_profile,
+    get_current_shift_for_profile,
 )
+from checkbox_common import invalidate_shift_state, mark_shift_closed
+from http_pool import request_deadline
+from log_setup import configure_logging
+from telegram_notify import flush as flush_telegram, send_telegram
+from time_window import next_open_boundary
 
 logger = logging.getLogger("shift_maintenance")
 
 TZ = zoneinfo.ZoneInfo("Europe/Kiev")
 
+_prewarm_pid: Optional[int] = None
+_prewarm_lock = threading.Lock()
+
+
+def _close_profile(profile_id: str) -> None:
+    try:
+        token = get_cashier_token(profile_id)
+        close_shift_for_profile(token, profile_id)
+        mark_shift_closed(profile_id)
+        logger.info("shift_maintenance.close_ok", extra={"profile_id": profile_id})
+        send_telegram("Смена закрыта", profile_id)
+    except Exception as e:
+        invalidate_shift_state(profile_id)
+        logger.error("shift_maintenance.close_error", extra={"profile_id": profile_id, "error": str(e)})
+        send_telegram(f"Ошибка закрытия смены: {e}", profile_id)
+
+
+def _open_profile(profile_id: str) -> None:
+    try:
+        token = get_cashier_token(profile_id)
+        invalidate_shift_state(profile_id)
+        ensure_shift_for_profile(token, profile_id)
+        logger.info("shift_maintenance.open_ok", extra={"profile_id": profile_id})
+        send_telegram("Смена открыта", profile_id)
+    except Exception as e:
+        logger.error("shift_maintenance.open_error", extra={"profile_id": profile_id, "error": str(e)})
+        send_telegram(f"Ошибка открытия смены: {e}", profile_id)
+
+
+def _prewarm_profile(profile_id: str) -> None:
+    try:
+        token = get_cashier_token(profile_id)
+        # Any authenticated call leaves a keep-alive connection in the pool.
+        get_current_shift_for_profile(token, profile_id)
+        logger.info("shift_maintenance.prewarm_ok", extra={"profile_id": profile_id})
+    except Exception as e:
+        logger.warning("shift_maintenance.prewarm_error", extra={"profile_id": profile_id, "error": str(e)})
+
+
+def _within(fn: Callable[[str], None], profile_id: str, at: float) -> None:
+    # Bounding the HTTP timeouts lets the worker give up by the deadline instead of outliving it.
+    with request_deadline(at):
+        fn(profile_id)
+
+
+def _run_all(action: str, fn: Callable[[str], None], deadline: float = SHIFT_MAINTENANCE_DEADLINE) -> List[str]:
+    profile_ids = list(CHECKBOX_PROFILES.keys())
+    if not profile_ids:
+        return []
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=len(profile_ids), thread_name_prefix=f"shift-{action}")
+    futures: Dict[str, Future] = {
+        profile_id: pool.submit(_within, fn, profile_id, started + deadline) for profile_id in profile_ids
+    }
+    timed_out: List[str] = []
+    for profile_id, future in futures.items():
+        try:
+            future.result(timeout=max(0.0, deadline - (time.monotonic() - started)))
+        except FutureTimeout:
+            timed_out.append(profile_id)
+            logger.error(f"shift_maintenance.{action}_timeout", extra={"profile_id": profile_id, "deadline": deadline})
+            if action != "prewarm":
+                send_telegram(f"Смена: операция {action} не завершилась за {int(deadline)} с", profile_id)
+    pool.shutdown(wait=False)
+    logger.info(
+        f"shift_maintenance.{action}_all.done",
+        extra={
+            "profiles": len(profile_ids),
+            "timed_out": len(timed_out),
+            "seconds": round(time.monotonic() - started, 3),
+        },
+    )
+    return timed_out
+
 
 def close_all() -> None:
     now = datetime.now(TZ)
     logger.info("shift_maintenance.close_all.start", extra={"now": now.isoformat()})
-    for profile_id in CHECKBOX_PROFILES.keys():
-        try:
-            token = sign_in_for_profile(profile_id)
-            close_shift_for_profile(token, profile_id)
-            logger.info("shift_maintenance.close_ok", extra={"profile_id": profile_id})
-            send_telegram("Смена закрыта", profile_id)
-        except Exception as e:
-            logger.error("shift_maintenance.close_error", extra={"profile_id": profile_id, "error": str(e)})
-            send_telegram(f"Ошибка закрытия смены: {e}", profile_id)
+    _run_all("close", _close_profile)
 
 
 def open_all() -> None:
     now = datetime.now(TZ)
     logger.info("shift_maintenance.open_all.start", extra={"now": now.isoformat()})
-    for profile_id in CHECKBOX_PROFILES.keys():
+    _run_all("open", _open_profile)
+
+
+def prewarm_all() -> None:
+    logger.info("shift_maintenance.prewarm_all.start", extra={"now": datetime.now(TZ).isoformat()})
+    _run_all("prewarm", _prewarm_profile)
+
+
+def _prewarm_loop(lead: int) -> None:
+    while True:
+        target = next_open_boundary() - timedelta(seconds=lead)
+        now = datetime.now(TZ)
+        if target <= now:
+            target += timedelta(days=1)
+        time.sleep((target - now).total_seconds())
         try:
-            token = sign_in_for_profile(profile_id)
-            ensure_shift_for_profile(token, profile_id)
-            logger.info("shift_maintenance.open_ok", extra={"profile_id": profile_id})
-            send_telegram("Смена открыта", profile_id)
+            prewarm_all()
         except Exception as e:
-            logger.error("shift_maintenance.open_error", extra={"profile_id": profile_id, "error": str(e)})
-            send_telegram(f"Ошибка открытия смены: {e}", profile_id)
+            logger.error(f"shift_maintenance.prewarm_loop_error error={e}")
+
+
+def start_prewarm_scheduler(lead: int = CHECKBOX_PREWARM_LEAD) -> None:
+    global _prewarm_pid
+    if lead <= 0:
+        return
+    pid = os.getpid()
+    if _prewarm_pid == pid:
+        return
+    with _prewarm_lock:
+        if _prewarm_pid == pid:
+            return
+        threading.Thread(target=_prewarm_loop, args=(lead,), name="shift-prewarm", daemon=True).start()
+        _prewarm_pid = pid
+    logger.info(f"shift_maintenance.prewarm_scheduled lead={lead} pid={pid}")
 
 
 if __name__ == "__main__":
+    configure_logging()
     mode = sys.argv[1] if len(sys.argv) > 1 else ""
     if mode == "close":
         close_all()
     elif mode == "open":
         open_all()
+    elif mode == "prewarm":
+        prewarm_all()
     else:
         logger.error("shift_maintenance.invalid_mode", extra={"mode": mode})
+    flush_telegram()
@@ -0,0 +1,218 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from amocrm_client import update_leads_custom_field
+from amocrm_common import AmoApiError
+from config import (
+    AMO_FIELD_CHECKBOX_STATUS,
+    AMO_STATUS_FLUSH_INTERVAL,
+    AMO_STATUS_FLUSH_SIZE,
+    AMO_STATUS_LEASE,
+    AMO_STATUS_MAX_ATTEMPTS,
+    AMO_STATUS_QUEUE_PATH,
+)
+from local_store import connect, transaction
+from metrics import inc
+from telegram_notify import send_telegram
+
+logger = logging.getLogger("status_writer")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_status (
+    lead_id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_status_due ON pending_status (next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_status (
+    lead_id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+_MAX_BACKOFF = 300
+
+_wakeup = threading.Event()
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+_unflushed = 0
+_unflushed_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(AMO_STATUS_QUEUE_PATH, _SCHEMA)
+
+
+def enqueue(lead_id: int, text: str) -> None:
+    now = time.time()
+    _conn().execute(
+        "INSERT INTO pending_status (lead_id, text, next_attempt_at, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(lead_id) DO UPDATE SET text = excluded.text, version = version + 1, "
+        "attempts = 0, next_attempt_at = MAX(next_attempt_at, excluded.next_attempt_at), "
+        "updated_at = excluded.updated_at",
+        (int(lead_id), text, now, now),
+    )
+    start_flusher()
+    global _unflushed
+    with _unflushed_lock:
+        _unflushed += 1
+        full = _unflushed >= AMO_STATUS_FLUSH_SIZE
+        if full:
+            _unflushed = 0
+    if full:
+        _wakeup.set()
+
+
+def pending_text(lead_id: int) -> Optional[str]:
+    row = _conn().execute("SELECT text FROM pending_status WHERE lead_id = ?", (int(lead_id),)).fetchone()
+    return row["text"] if row else None
+
+
+def pending_count() -> int:
+    return _conn().execute("SELECT COUNT(*) FROM pending_status").fetchone()[0]
+
+
+def _lease_batch(now: float) -> List[sqlite3.Row]:
+    conn = _conn()
+    with transaction(conn):
+        rows = conn.execute(
+            "SELECT lead_id, text, version, attempts FROM pending_status WHERE next_attempt_at <= ? "
+            "ORDER BY updated_at LIMIT ?",
+            (now, AMO_STATUS_FLUSH_SIZE),
+        ).fetchall()
+        for row in rows:
+            conn.execute(
+                "UPDATE pending_status SET next_attempt_at = ? WHERE lead_id = ?",
+                (now + AMO_STATUS_LEASE, row["lead_id"]),
+            )
+    return rows
+
+
+def _is_permanent(error: Exception) -> bool:
+    return isinstance(error, AmoApiError) and 400 <= error.status_code < 500 and error.status_code != 429
+
+
+def _bury(conn: sqlite3.Connection, row: sqlite3.Row, error: str) -> None:
+    with transaction(conn):
+        cur = conn.execute(
+            "DELETE FROM pending_status WHERE lead_id = ? AND version = ?", (row["lead_id"], row["version"])
+        )
+        if cur.rowcount == 0:
+            # A newer text arrived meanwhile; it gets its own attempts.
+            conn.execute(
+                "UPDATE pending_status SET next_attempt_at = ? WHERE lead_id = ?", (time.time(), row["lead_id"])
+            )
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO dead_status (lead_id, text, attempts, error, failed_at) VALUES (?, ?, ?, ?, ?)",
+            (row["lead_id"], row["text"], row["attempts"] + 1, error[:1000], time.time()),
+        )
+    inc("status_writes_dead_total")
+    logger.error(f"amocrm.checkbox_status.dead lead_id={row['lead_id']} attempts={row['attempts'] + 1} error={error}")
+    send_telegram(
+        f"❌ Сделка <b>{row['lead_id']}</b>: не удалось записать статус Checkbox в AmoCRM\n"
+        f"<code>{error[:500]}</code>"
+    )
+
+
+def _postpone(conn: sqlite3.Connection, row: sqlite3.Row, error: str) -> None:
+    if row["attempts"] + 1 >= AMO_STATUS_MAX_ATTEMPTS:
+        _bury(conn, row, error)
+        return
+    delay = min(_MAX_BACKOFF, AMO_STATUS_FLUSH_INTERVAL * (2 ** row["attempts"]))
+    conn.execute(
+        "UPDATE pending_status SET attempts = attempts + 1, next_attempt_at = ? WHERE lead_id = ?",
+        (time.time() + delay, row["lead_id"]),
+    )
+
+
+def _done(conn: sqlite3.Connection, row: sqlite3.Row) -> None:
+    cur = conn.execute(
+        "DELETE FROM pending_status WHERE lead_id = ? AND version = ?",
+        (row["lead_id"], row["version"]),
+    )
+    if cur.rowcount == 0:
+        conn.execute(
+            "UPDATE pending_status SET next_attempt_at = ? WHERE lead_id = ?",
+            (time.time(), row["lead_id"]),
+        )
+
+
+def _write(rows: Sequence[sqlite3.Row]) -> int:
+    try:
+        update_leads_custom_field(AMO_FIELD_CHECKBOX_STATUS, [(row["lead_id"], row["text"]) for row in rows])
+    except Exception as e:
+        if _is_permanent(e) and len(rows) > 1:
+            # One rejected lead fails the whole PATCH; bisect until it is isolated.
+            logger.warning(f"amocrm.checkbox_status.bulk_split count={len(rows)} error={e}")
+            mid = len(rows) // 2
+            return _write(rows[:mid]) + _write(rows[mid:])
+        conn = _conn()
+        for row in rows:
+            if _is_permanent(e):
+                _bury(conn, row, str(e))
+            else:
+                _postpone(conn, row, str(e))
+        logger.error(f"amocrm.checkbox_status.bulk_error count={len(rows)} error={e}")
+        return 0
+    conn = _conn()
+    for row in rows:
+        _done(conn, row)
+    return len(rows)
+
+
+def flush_once() -> int:
+    rows = _lease_batch(time.time())
+    if not rows:
+        return 0
+    written = _write(rows)
+    if written:
+        logger.info(f"amocrm.checkbox_status.bulk_ok count={written} leased={len(rows)}")
+    return written
+
+
+def flush_all() -> None:
+    try:
+        while flush_once() > 0:
+            pass
+    except Exception as e:
+        logger.error(f"amocrm.checkbox_status.flush_error error={e}")
+
+
+def _flusher_loop() -> None:
+    while True:
+        _wakeup.wait(AMO_STATUS_FLUSH_INTERVAL)
+        _wakeup.clear()
+        flush_all()
+
+
+def start_flusher() -> None:
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _flusher_lock:
+        if _flusher_pid == pid:
+            return
+        threading.Thread(target=_flusher_loop, name="status-writer", daemon=True).start()
+        _flusher_pid = pid
+        atexit.register(flush_all)
+
+
+def dead_count() -> int:
+    return _conn().execute("SELECT COUNT(*) FROM dead_status").fetchone()[0]
+
+
+def stats() -> Dict[str, int]:
+    return {"pending": pending_count(), "dead": dead_count()}
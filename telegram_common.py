@@ -0,0 +1,55 @@
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from config import PROFILES, TELEGRAM_API_BASE
+
+logger = logging.getLogger("telegram")
+
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+
+PROFILE_SENDER_MAP = {profile_id: profile.label for profile_id, profile in PROFILES.items()}
+
+
+def resolve_sender_name(profile_id: str) -> str:
+    return PROFILE_SENDER_MAP.get(profile_id, profile_id)
+
+
+def format_message(text: str, profile_id: str | None) -> str:
+    sender = resolve_sender_name(profile_id) if profile_id else ""
+    return f"<b>{sender}</b>\n{text}" if sender else text
+
+
+def send_url() -> str:
+    return f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/sendMessage"
+
+
+def payload(final_text: str) -> Dict[str, Any]:
+    return {
+        "chat_id": CHAT_ID,
+        "text": final_text,
+        "parse_mode": "HTML",
+    }
+
+
+def backoff(attempt: int) -> float:
+    return min(30, 2 ** attempt)
+
+
+def retry_delay(resp: Any, attempt: int) -> Optional[float]:
+    # None means the response is final: delivered or rejected for good.
+    if resp.status_code == 429:
+        retry_after = 1.0
+        try:
+            retry_after = float(((resp.json() or {}).get("parameters") or {}).get("retry_after") or 1)
+        except Exception:
+            pass
+        logger.warning(f"telegram.rate_limited retry_after={retry_after} attempt={attempt}")
+        return retry_after
+    if resp.status_code >= 500:
+        logger.error(f"telegram_send_error status={resp.status_code} attempt={attempt}")
+        return backoff(attempt)
+    if resp.status_code >= 400:
+        logger.error(f"telegram_send_error status={resp.status_code} body={resp.text[:500]}")
+    return None
@@ -1,39 +1,167 @@
+import atexit
 import os
-import requests
 import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
 
-from config import NP_SENDER_NAME_1, NP_SENDER_NAME_2
+from circuit_breaker import CircuitOpenError
+from config import (
+    TELEGRAM_FLUSH_TIMEOUT,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_OUTBOX,
+    TELEGRAM_OUTBOX_SIZE,
+    TELEGRAM_RATE_PER_MINUTE,
+)
+from http_pool import http_request
+from metrics import inc, stage
+from telegram_common import BOT_TOKEN, CHAT_ID, backoff, format_message, payload, retry_delay, send_url
 
 logger = logging.getLogger("telegram")
 
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+MAX_MESSAGE_LEN = 4096
+RATE_WINDOW = 60.0
 
-PROFILE_SENDER_MAP = {
-    "1": NP_SENDER_NAME_1,
-    "2": NP_SENDER_NAME_2,
-}
+_outbox: "queue.Queue[str]" = queue.Queue(maxsize=TELEGRAM_OUTBOX_SIZE)
+_sent_at: Deque[float] = deque()
+_worker_pid: Optional[int] = None
+_worker_lock = threading.Lock()
 
 
-def resolve_sender_name(profile_id: str) -> str:
-    return PROFILE_SENDER_MAP.get(profile_id, profile_id)
+def _deliver(final_text: str) -> bool:
+    with stage("telegram"):
+        delivered = _send_with_retries(final_text)
+    inc("telegram_messages_total", result="sent" if delivered else "dropped")
+    return delivered
+
+
+def _send_with_retries(final_text: str) -> bool:
+    for attempt in range(1, TELEGRAM_MAX_RETRIES + 1):
+        try:
+            resp = http_request("telegram", "POST", send_url(), json=payload(final_text))
+        except CircuitOpenError as e:
+            logger.error(f"telegram_send_error={e} attempt={attempt}")
+            break
+        except Exception as e:
+            logger.error(f"telegram_send_error={e} attempt={attempt}")
+            time.sleep(backoff(attempt))
+            continue
+        delay = retry_delay(resp, attempt)
+        if delay is None:
+            return resp.status_code < 400
+        time.sleep(delay)
+    logger.error("telegram.dropped", extra={"preview": final_text[:200]})
+    return False
+
+
+def _remaining_budget(now: float) -> int:
+    while _sent_at and now - _sent_at[0] > RATE_WINDOW:
+        _sent_at.popleft()
+    return TELEGRAM_RATE_PER_MINUTE - len(_sent_at)
+
+
+def _wait_for_budget() -> None:
+    while True:
+        now = time.time()
+        if _remaining_budget(now) > 0:
+            return
+        time.sleep(max(0.05, RATE_WINDOW - (now - _sent_at[0])))
+
+
+def _digest(texts: List[str]) -> List[str]:
+    # Items are whole HTML fragments; cutting one could leave a tag open and Telegram rejects the message.
+    messages: List[str] = []
+    current = ""
+    skipped = 0
+    for text in texts:
+        if len(text) > MAX_MESSAGE_LEN:
+            skipped += 1
+            logger.warning(f"telegram.digest_skipped length={len(text)} text={text}")
+            continue
+        candidate = f"{current}\n\n{text}" if current else text
+        if len(candidate) > MAX_MESSAGE_LEN:
+            messages.append(current)
+            candidate = text
+        current = candidate
+    if skipped:
+        footer = f"…и ещё {skipped} (слишком длинные, см. логи)"
+        if current and len(current) + 2 + len(footer) <= MAX_MESSAGE_LEN:
+            current = f"{current}\n\n{footer}"
+        else:
+            if current:
+                messages.append(current)
+            current = footer
+    if current:
+        messages.append(current)
+    return messages
+
+
+def _drain_pending(first: str) -> List[str]:
+    texts = [first]
+    while True:
+        try:
+            texts.append(_outbox.get_nowait())
+        except queue.Empty:
+            return texts
+
+
+def _worker_loop() -> None:
+    while True:
+        first = _outbox.get()
+        try:
+            texts = [first]
+            if _outbox.qsize() + 1 > _remaining_budget(time.time()):
+                texts = _drain_pending(first)
+            messages = _digest(texts) if len(texts) > 1 else texts
+            if len(texts) > 1:
+                logger.info(f"telegram.digest messages={len(texts)} parts={len(messages)}")
+            for message in messages:
+                _wait_for_budget()
+                _sent_at.append(time.time())
+                _deliver(message)
+        except Exception as e:
+            logger.error(f"telegram.outbox_error={e}")
+        finally:
+            for _ in texts:
+                _outbox.task_done()
+
+
+def _ensure_worker() -> None:
+    global _worker_pid
+    pid = os.getpid()
+    if _worker_pid == pid:
+        return
+    with _worker_lock:
+        if _worker_pid == pid:
+            return
+        threading.Thread(target=_worker_loop, name="telegram-outbox", daemon=True).start()
+        _worker_pid = pid
+
+
+def flush(timeout: float = TELEGRAM_FLUSH_TIMEOUT) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if _outbox.unfinished_tasks == 0:
+            return True
+        time.sleep(0.05)
+    logger.warning(f"telegram.flush_timeout pending={_outbox.qsize()}")
+    return False
 
 
 def send_telegram(text: str, profile_id: str | None = None):
     if not BOT_TOKEN or not CHAT_ID:
         return
-    sender = resolve_sender_name(profile_id) if profile_id else ""
-    final_text = f"<b>{sender}</b>\n{text}" if sender else text
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    final_text = format_message(text, profile_id)
+    if not TELEGRAM_OUTBOX:
+        _deliver(final_text)
+        return
+    _ensure_worker()
     try:
-        requests.post(
-            url,
-            json={
-                "chat_id": CHAT_ID,
-                "text": final_text,
-                "parse_mode": "HTML",
-            },
-            timeout=5,
-        )
-    except Exception as e:
-        logger.error(f"telegram_send_error={e}")
+        _outbox.put_nowait(final_text)
+    except queue.Full:
+        logger.error("telegram.outbox_full", extra={"preview": final_text[:200]})
+
+
+atexit.register(flush)
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from async_http import http_request
+from circuit_breaker import CircuitOpenError
+from config import TELEGRAM_MAX_RETRIES, TELEGRAM_OUTBOX
+from metrics import inc, stage
+from telegram_common import BOT_TOKEN, CHAT_ID, backoff, format_message, payload, retry_delay, send_url
+from telegram_notify import send_telegram as enqueue_telegram
+
+logger = logging.getLogger("telegram")
+
+
+async def _send_with_retries(final_text: str) -> bool:
+    for attempt in range(1, TELEGRAM_MAX_RETRIES + 1):
+        try:
+            resp = await http_request("telegram", "POST", send_url(), json=payload(final_text))
+        except CircuitOpenError as e:
+            logger.error(f"telegram_send_error={e} attempt={attempt}")
+            break
+        except Exception as e:
+            logger.error(f"telegram_send_error={e} attempt={attempt}")
+            await asyncio.sleep(backoff(attempt))
+            continue
+        delay = retry_delay(resp, attempt)
+        if delay is None:
+            return resp.status_code < 400
+        await asyncio.sleep(delay)
+    logger.error("telegram.dropped", extra={"preview": final_text[:200]})
+    return False
+
+
+async def _deliver(final_text: str) -> bool:
+    with stage("telegram"):
+        delivered = await _send_with_retries(final_text)
+    inc("telegram_messages_total", result="sent" if delivered else "dropped")
+    return delivered
+
+
+async def send_telegram(text: str, profile_id: str | None = None) -> None:
+    if not BOT_TOKEN or not CHAT_ID:
+        return
+    if TELEGRAM_OUTBOX:
+        # The outbox enqueue never blocks; its worker thread handles rate limits and digests.
+        enqueue_telegram(text, profile_id)
+        return
+    await _deliver(format_message(text, profile_id))
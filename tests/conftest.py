@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# config reads the environment at import time, so set it up before any project module is imported.
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="checkbox-amo-tests-"))
+os.environ.setdefault("AMO_BASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("AMO_ACCESS_TOKEN", "test")
+os.environ.setdefault("AMO_PURCHASES_CATALOG_ID", "1")
+os.environ.setdefault("AMO_RATE_LIMIT", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+import pytest
+
+import amo_rate_limiter
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(amo_rate_limiter.time, "time", clock)
+    monkeypatch.setattr(amo_rate_limiter, "AMO_RATE_LIMIT_PATH", str(tmp_path / "rate.sqlite3"))
+    monkeypatch.setattr(amo_rate_limiter, "AMO_RATE_LIMIT", 5.0)
+    monkeypatch.setattr(amo_rate_limiter, "AMO_RATE_BURST", 3.0)
+    return amo_rate_limiter, clock
+
+
+def test_burst_is_free_then_callers_queue(limiter):
+    module, _ = limiter
+    assert [module._reserve("amocrm") for _ in range(3)] == [0, 0, 0]
+    assert module._reserve("amocrm") == pytest.approx(0.2)
+    assert module._reserve("amocrm") == pytest.approx(0.4)
+
+
+def test_tokens_refill_up_to_burst(limiter):
+    module, clock = limiter
+    for _ in range(4):
+        module._reserve("amocrm")
+    clock.now += 0.4
+    assert module._reserve("amocrm") == pytest.approx(0, abs=1e-9)
+    clock.now += 3600
+    assert [module._reserve("amocrm") for _ in range(3)] == [0, 0, 0]
+    assert module._reserve("amocrm") == pytest.approx(0.2)
+
+
+def test_buckets_are_independent(limiter):
+    module, _ = limiter
+    for _ in range(3):
+        module._reserve("amocrm")
+    assert module._reserve("other") == 0
+
+
+def test_disabled_limit_never_waits(limiter, monkeypatch):
+    module, _ = limiter
+    monkeypatch.setattr(module, "AMO_RATE_LIMIT", 0)
+    assert [module.acquire() for _ in range(10)] == [0.0] * 10
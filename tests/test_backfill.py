@@ -0,0 +1,81 @@
+import argparse
+
+import pytest
+
+import backfill
+from backfill import Checkpoint
+
+_LEADS = [
+    {"id": 1, "created_at": 100},
+    {"id": 2, "created_at": 100},
+    {"id": 3, "created_at": 200},
+    {"id": 4, "created_at": 200},
+    {"id": 5, "created_at": 200},
+    {"id": 6, "created_at": 200},
+    {"id": 7, "created_at": 300},
+]
+_PAGE_SIZE = 2
+
+
+def _fetch_leads_page(filters, page):
+    created_from = int(dict(filters).get("filter[created_at][from]", 0))
+    leads = [lead for lead in _LEADS if lead["created_at"] >= created_from]
+    start = (page - 1) * _PAGE_SIZE
+    return leads[start:start + _PAGE_SIZE], start + _PAGE_SIZE < len(leads)
+
+
+@pytest.fixture
+def args(monkeypatch):
+    monkeypatch.setattr(backfill, "fetch_leads_page", _fetch_leads_page)
+    return argparse.Namespace(pipeline_id=0, status_id=None, created_from=None, created_to=None)
+
+
+def _ids(pages):
+    return [lead["id"] for page in pages for lead in page]
+
+
+def test_advance_moves_cursor_and_keeps_boundary(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "cp.json"), "key")
+    checkpoint.advance([{"id": 1, "created_at": 100}, {"id": 3, "created_at": 200}], True)
+    assert (checkpoint.cursor, checkpoint.page, checkpoint.boundary_ids) == (200, 1, [3])
+    checkpoint.advance([{"id": 3, "created_at": 200}, {"id": 4, "created_at": 200}], True)
+    assert (checkpoint.cursor, checkpoint.page, checkpoint.boundary_ids) == (200, 2, [3, 4])
+    checkpoint.advance([{"id": 5, "created_at": 200}], False)
+    assert (checkpoint.cursor, checkpoint.page, checkpoint.boundary_ids) == (200, 1, [3, 4, 5])
+
+
+def test_checkpoint_roundtrip_and_filter_mismatch(tmp_path):
+    path = str(tmp_path / "sub" / "cp.json")
+    checkpoint = Checkpoint(path, "key")
+    checkpoint.advance([{"id": 3, "created_at": 200}], True)
+    checkpoint.add("scanned", 5)
+    checkpoint.save()
+    loaded = Checkpoint(path, "key")
+    assert loaded.load()
+    assert (loaded.cursor, loaded.page, loaded.boundary_ids, loaded.counts) == (200, 1, [3], {"scanned": 5})
+    assert not Checkpoint(path, "other").load()
+    assert not Checkpoint(str(tmp_path / "missing.json"), "key").load()
+
+
+def test_iter_pages_yields_each_lead_once(tmp_path, args):
+    checkpoint = Checkpoint(str(tmp_path / "cp.json"), "key")
+    assert sorted(_ids(backfill.iter_pages(args, checkpoint))) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_resume_after_interruption_skips_seen_leads(tmp_path, args):
+    path = str(tmp_path / "cp.json")
+    seen = []
+    for stop_after in (1, 2, 1, 10):
+        checkpoint = Checkpoint(path, "key")
+        checkpoint.load()
+        pages = backfill.iter_pages(args, checkpoint)
+        for _, page in zip(range(stop_after), pages):
+            seen.extend(lead["id"] for lead in page)
+            checkpoint.save()
+    assert sorted(seen) == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_rerun_after_completion_finds_nothing_new(tmp_path, args):
+    checkpoint = Checkpoint(str(tmp_path / "cp.json"), "key")
+    list(backfill.iter_pages(args, checkpoint))
+    assert _ids(backfill.iter_pages(args, checkpoint)) == []
@@ -0,0 +1,54 @@
+import pytest
+import requests
+
+import checkbox_service
+from checkbox_common import CheckboxApiError, sell_body
+from models import LeadData, PurchaseItem
+
+
+def _lead() -> LeadData:
+    return LeadData(
+        id=1,
+        status_value=None,
+        discount_minor=0,
+        checkbox_status=None,
+        email=None,
+        ttn="20450000000001",
+        purchases=(PurchaseItem(name="Товар", quantity_milli=1000, price_minor=10000),),
+    )
+
+
+@pytest.fixture
+def sell(monkeypatch):
+    calls = []
+    monkeypatch.setattr(checkbox_service, "is_receipt_allowed_now", lambda: True)
+    monkeypatch.setattr(checkbox_service, "get_cashier_token", lambda profile_id: "token")
+    monkeypatch.setattr(checkbox_service, "ensure_shift_for_profile", lambda token, profile_id: None)
+
+    def patch(error):
+        def create(token, profile_id, goods, total_minor, discount_minor, email=None, receipt_id=None):
+            calls.append(receipt_id)
+            raise error
+
+        monkeypatch.setattr(checkbox_service, "create_sell_receipt_for_profile", create)
+        return calls
+
+    return patch
+
+
+def test_sell_body_carries_client_receipt_id():
+    assert sell_body([], 100, 0, None, "CASHLESS", "abc")["id"] == "abc"
+    assert "id" not in sell_body([], 100, 0, None, "CASHLESS")
+
+
+def test_transport_error_on_sell_is_ambiguous(sell):
+    calls = sell(requests.ReadTimeout("timed out"))
+    with pytest.raises(checkbox_service.SellOutcomeUnknown) as info:
+        checkbox_service.create_receipt_for_lead_data(_lead(), "1")
+    assert info.value.receipt_id == calls[0]
+
+
+def test_rejected_sell_is_not_ambiguous(sell):
+    sell(CheckboxApiError(422, "validation error"))
+    with pytest.raises(CheckboxApiError):
+        checkbox_service.create_receipt_for_lead_data(_lead(), "1")
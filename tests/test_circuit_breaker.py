@@ -0,0 +1,107 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_WINDOW", 60)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_MIN_CALLS", 4)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_OPEN_SECONDS", 30)
+    monkeypatch.setattr(circuit_breaker, "BREAKER_HALF_OPEN_CALLS", 1)
+    return clock
+
+
+def _open(breaker):
+    for ok in (True, False, True, False):
+        breaker.before_call()
+        breaker.record(ok)
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = CircuitBreaker("test")
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_failure_rate_and_rejects(clock):
+    breaker = CircuitBreaker("test")
+    _open(breaker)
+    assert breaker.state == OPEN
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.retry_after == pytest.approx(20)
+    assert breaker.snapshot()["retry_after"] == pytest.approx(20)
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = CircuitBreaker("test")
+    breaker.record(False)
+    breaker.record(False)
+    clock.now += 61
+    breaker.record(True)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_trial_success_closes(clock):
+    breaker = CircuitBreaker("test")
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+    breaker.before_call()
+
+
+def test_half_open_trial_failure_reopens(clock):
+    breaker = CircuitBreaker("test")
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.retry_after == pytest.approx(30)
+
+
+def test_lost_half_open_trial_is_replaced(clock):
+    breaker = CircuitBreaker("test")
+    _open(breaker)
+    clock.now += 30
+    breaker.before_call()
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 1
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_get_breaker_is_keyed(clock):
+    assert circuit_breaker.get_breaker("checkbox", "a") is circuit_breaker.get_breaker("checkbox", "a")
+    assert circuit_breaker.get_breaker("checkbox", "a").name == "checkbox:a"
+    assert circuit_breaker.get_breaker("checkbox", "b") is not circuit_breaker.get_breaker("checkbox", "a")
@@ -0,0 +1,55 @@
+import pytest
+
+import job_queue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(job_queue, "JOB_RETRY_DELAY", 30)
+    return job_queue
+
+
+def _counts(queue):
+    stats = queue.stats()
+    return {key: stats[key] for key in ("ready", "leased", "retry_wait", "delayed", "dead")}
+
+
+def test_claim_leases_job(queue):
+    queue.enqueue_lead(1)
+    queue.enqueue_lead(2, delay=60)
+    job = queue.claim()
+    assert job is not None and job.lead_id == 1 and job.attempts == 1
+    assert queue.claim() is None
+    assert _counts(queue) == {"ready": 0, "leased": 1, "retry_wait": 0, "delayed": 1, "dead": 0}
+    queue.ack(job)
+    assert _counts(queue)["leased"] == 0
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.enqueue_lead(1)
+    first = queue.claim(visibility_timeout=0)
+    second = queue.claim()
+    assert second is not None and second.id == first.id and second.attempts == 2
+
+
+def test_nack_waits_then_dies(queue):
+    queue.enqueue_lead(5)
+    job = queue.claim()
+    queue.nack(job, "boom")
+    assert _counts(queue) == {"ready": 0, "leased": 0, "retry_wait": 1, "delayed": 0, "dead": 0}
+    queue._conn().execute("UPDATE jobs SET visible_at = 0")
+    job = queue.claim()
+    queue.nack(job, "boom again")
+    assert _counts(queue)["dead"] == 1
+    assert queue.claim() is None
+    assert queue.requeue_dead() == 1
+    assert queue.claim().attempts == 1
+
+
+def test_pending_outcome_is_acked(queue, monkeypatch):
+    monkeypatch.setattr(queue, "process_lead", lambda lead_id: ({"status": "pending"}, 202))
+    queue.enqueue_lead(9)
+    queue.run_job(queue.claim())
+    assert _counts(queue) == {"ready": 0, "leased": 0, "retry_wait": 0, "delayed": 0, "dead": 0}
@@ -0,0 +1,71 @@
+import pytest
+
+import lead_dedup
+
+
+@pytest.fixture
+def dedup(tmp_path, monkeypatch):
+    monkeypatch.setattr(lead_dedup, "LEAD_DEDUP_PATH", str(tmp_path / "dedup.sqlite3"))
+    monkeypatch.setattr(lead_dedup, "LEAD_DEDUP_WINDOW", 60)
+    monkeypatch.setattr(lead_dedup, "LEAD_FLIGHT_TIMEOUT", 30)
+    return lead_dedup
+
+
+def _handler(calls, status_code=200):
+    def handle(lead_id):
+        calls.append(lead_id)
+        return {"status": "ok", "lead_id": lead_id}, status_code
+
+    return handle
+
+
+def test_recent_result_is_replayed(dedup):
+    calls = []
+    first = dedup.run_once(7, _handler(calls))
+    assert dedup.run_once(7, _handler(calls)) == first
+    assert calls == [7]
+
+
+def test_server_error_is_not_replayed(dedup):
+    calls = []
+    dedup.run_once(7, _handler(calls, 500))
+    dedup.run_once(7, _handler(calls, 500))
+    assert calls == [7, 7]
+
+
+def test_result_expires_after_window(dedup, monkeypatch):
+    calls = []
+    dedup.run_once(7, _handler(calls))
+    now = dedup.time.time()
+    monkeypatch.setattr(dedup.time, "time", lambda: now + 61)
+    dedup.run_once(7, _handler(calls))
+    assert calls == [7, 7]
+
+
+def test_failed_run_releases_claim(dedup):
+    def boom(lead_id):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        dedup.run_once(7, boom)
+    calls = []
+    dedup.run_once(7, _handler(calls))
+    assert calls == [7]
+
+
+def test_unfinished_flight_of_other_owner(dedup):
+    assert dedup._claim(7, "other")[0] == "owner"
+    assert dedup._claim(7, "me") == ("wait", None)
+    assert dedup._poll_other(7) == (False, None)
+    dedup._finish(7, "other", ({"status": "ok"}, 200))
+    assert dedup._poll_other(7) == (True, ({"status": "ok"}, 200))
+    assert dedup._claim(7, "me") == ("done", ({"status": "ok"}, 200))
+
+
+def test_stale_flight_is_taken_over(dedup, monkeypatch):
+    dedup._claim(7, "other")
+    now = dedup.time.time()
+    monkeypatch.setattr(dedup.time, "time", lambda: now + 31)
+    assert dedup._claim(7, "me")[0] == "owner"
+    dedup._finish(7, "other", ({"status": "late"}, 200))
+    assert dedup._poll_other(7) == (False, None)
@@ -0,0 +1,37 @@
+import logging
+import queue
+
+import log_setup
+import metrics
+
+
+class _Collect(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def _record(level: int) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, "event.name", None, None)
+
+
+def _counter(name: str, level: str) -> float:
+    return metrics._counters.get(metrics._key(name, {"level": level}), 0.0)
+
+
+def test_full_queue_drops_info_but_keeps_errors(monkeypatch):
+    monkeypatch.setattr(log_setup, "_FULL_QUEUE_WAIT", 0.01)
+    target = _Collect()
+    handler = log_setup._ProcessQueueHandler(queue.Queue(maxsize=1), target)
+    monkeypatch.setattr(handler, "_ensure_listener", lambda: None)
+    handler.enqueue(_record(logging.INFO))
+    dropped = _counter("log_records_dropped_total", "INFO")
+    handler.enqueue(_record(logging.INFO))
+    assert _counter("log_records_dropped_total", "INFO") == dropped + 1
+    assert target.records == []
+    handler.enqueue(_record(logging.ERROR))
+    assert [r.levelno for r in target.records] == [logging.ERROR]
+    assert handler.queue.qsize() == 1
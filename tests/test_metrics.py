@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_gauges", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+    return tmp_path
+
+
+def _dead_snapshot(directory, pid: int, value: float) -> None:
+    path = directory / f"{pid}.json"
+    path.write_text(
+        json.dumps(
+            {
+                "pid": pid,
+                "counters": [["leads_total", {"kind": "ok"}, value]],
+                "gauges": [["busy", {}, 3.0]],
+                "histograms": [],
+            }
+        )
+    )
+    os.utime(path, (0, 0))
+
+
+def _total(text: str) -> str:
+    return next(line for line in text.splitlines() if line.startswith("amocheckbox_leads_total"))
+
+
+def test_dead_process_counters_are_retired_not_lost(metrics_dir, monkeypatch):
+    monkeypatch.setattr(metrics, "_pid_alive", lambda pid: pid == os.getpid())
+    _dead_snapshot(metrics_dir, 999991, 2.0)
+    _dead_snapshot(metrics_dir, 999992, 3.0)
+    metrics.inc("leads_total", kind="ok")
+    assert _total(metrics.render()).endswith(" 6")
+    assert sorted(os.listdir(metrics_dir)) == [f"{os.getpid()}.json", "retired.json", "retired.json.lock"]
+    assert _total(metrics.render()).endswith(" 6")
+    assert "amocheckbox_busy" not in metrics.render()
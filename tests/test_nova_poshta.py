@@ -0,0 +1,107 @@
+import json
+from typing import Any
+
+import pytest
+
+import nova_poshta_common
+import nova_poshta_service
+from circuit_breaker import CircuitOpenError
+
+
+class _Response:
+    def __init__(self, payload: Any, status_code: int = 200) -> None:
+        self.status_code = status_code
+        self.text = payload if isinstance(payload, str) else json.dumps(payload)
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+def _doc(number: str, sender: str) -> dict:
+    return {"Number": number, "CounterpartySenderDescription": sender}
+
+
+def _match(payload: Any, ttns=("1", "2", "3")):
+    return nova_poshta_common.matched_from_response(_Response(payload), list(ttns), "Shop LLC")
+
+
+def test_batch_matches_only_own_sender():
+    payload = {
+        "success": True,
+        "data": [_doc("1", " shop llc "), _doc("2", "Other"), _doc("3", "Shop LLC"), _doc("9", "Shop LLC")],
+        "errors": [],
+    }
+    assert _match(payload) == {"1", "3"}
+
+
+def test_single_ttn_without_number_uses_request():
+    assert _match({"success": True, "data": [_doc("", "Shop LLC")]}, ttns=("42",)) == {"42"}
+
+
+def test_clean_success_without_docs_is_no_match():
+    assert _match({"success": True, "data": [], "errors": []}) == set()
+
+
+def test_api_failure_is_failed_check():
+    assert _match({"success": False, "data": [], "errors": ["API key expired"]}) is None
+    assert _match({"success": True, "data": [_doc("1", "Shop LLC")], "errors": ["Too many requests"]}) is None
+    assert _match("<html>bad gateway</html>") is None
+
+
+@pytest.fixture
+def accounts(tmp_path, monkeypatch):
+    import ttn_cache
+    from config import Profile
+
+    monkeypatch.setattr(ttn_cache, "NP_TTN_CACHE_PATH", str(tmp_path / "ttn.sqlite3"))
+    profiles = {pid: Profile(pid, f"key-{pid}", f"Sender {pid}", None, pid) for pid in ("a", "b")}
+    monkeypatch.setattr(nova_poshta_common, "PROFILES", profiles)
+    monkeypatch.setattr(nova_poshta_common, "NP_FANOUT_CONCURRENCY", 0)
+
+    def patch(answers):
+        def check(api_key, ttns, sender_name):
+            answer = answers[api_key]
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        monkeypatch.setattr(nova_poshta_service, "_check_ttns_with_key", check)
+
+    return patch
+
+
+def test_fanout_assigns_owners_and_caches_misses(accounts):
+    import ttn_cache
+
+    accounts({"key-a": ({"1"}, set()), "key-b": ({"2"}, set())})
+    assert nova_poshta_service.detect_profiles_for_ttns(["1", "2", "3"]) == {"1": "a", "2": "b", "3": None}
+    assert ttn_cache.lookup("3") == (True, None)
+
+
+def test_failed_key_leaves_only_unmatched_ttn_incomplete(accounts):
+    import ttn_cache
+
+    accounts({"key-a": ({"1"}, set()), "key-b": (set(), {"1", "2"})})
+    assert nova_poshta_service.detect_profiles_for_ttns(["1", "2"]) == {"1": "a"}
+    assert ttn_cache.lookup("1") == (True, "a")
+    assert ttn_cache.lookup("2") == (False, None)
+    with pytest.raises(CircuitOpenError):
+        nova_poshta_service.detect_profile_for_ttn("2")
+
+
+def test_batch_fails_only_unresolved_ttn(accounts, monkeypatch):
+    accounts({"key-a": ({"1"}, set()), "key-b": (set(), {"1", "2"})})
+    monkeypatch.setattr(nova_poshta_service, "NP_BATCH_SIZE", 2)
+    batcher = nova_poshta_service._MicroBatcher(60.0)
+    resolved = batcher.submit("1")
+    incomplete = batcher.submit("2")
+    assert resolved.result(timeout=5) == "a"
+    with pytest.raises(CircuitOpenError):
+        incomplete.result(timeout=5)
+
+
+def test_rejected_key_defers(accounts):
+    accounts({"key-a": (set(), set()), "key-b": CircuitOpenError("novaposhta:key-", 5.0)})
+    assert nova_poshta_service.detect_profiles_for_ttns(["7"]) == {}
+    with pytest.raises(CircuitOpenError):
+        nova_poshta_service.detect_profile_for_ttn("7")
@@ -0,0 +1,31 @@
+import pytest
+
+import lead_outcomes
+import pipeline
+from circuit_breaker import CircuitOpenError
+
+
+@pytest.fixture
+def breaker_open(monkeypatch):
+    parked = []
+
+    def load(lead_id):
+        raise CircuitOpenError("amocrm", 12.0)
+
+    monkeypatch.setattr(pipeline, "load_lead_with_details", load)
+    monkeypatch.setattr(pipeline, "defer_lead", lambda *args: parked.append(args))
+    return parked
+
+
+def test_open_circuit_parks_lead_when_deferral_enabled(breaker_open, monkeypatch):
+    monkeypatch.setattr(lead_outcomes, "deferral_enabled", lambda: True)
+    body, status_code = pipeline._process_lead(7)
+    assert status_code == 202 and body["status"] == "deferred"
+    assert breaker_open == [(7, "", 12.0)]
+
+
+def test_open_circuit_asks_for_retry_when_deferral_disabled(breaker_open, monkeypatch):
+    monkeypatch.setattr(lead_outcomes, "deferral_enabled", lambda: False)
+    body, status_code = pipeline._process_lead(7)
+    assert status_code == 503 and body["retry_after"] == 12.0
+    assert breaker_open == []
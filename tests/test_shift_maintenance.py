@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import http_pool
+import shift_maintenance
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    sent = []
+    monkeypatch.setattr(shift_maintenance, "CHECKBOX_PROFILES", {"1": object()})
+    monkeypatch.setattr(shift_maintenance, "send_telegram", lambda text, profile_id=None: sent.append(profile_id))
+    return sent
+
+
+def _stuck(release):
+    def fn(profile_id):
+        release.wait(5)
+
+    return fn
+
+
+@pytest.mark.parametrize("action, expected", [("close", ["1"]), ("prewarm", [])])
+def test_timeout_alerts_except_prewarm(alerts, action, expected):
+    release = threading.Event()
+    try:
+        assert shift_maintenance._run_all(action, _stuck(release), deadline=0.05) == ["1"]
+    finally:
+        release.set()
+    assert alerts == expected
+
+
+def test_deadline_bounds_http_timeout(alerts):
+    seen = []
+
+    def fn(profile_id):
+        seen.append(http_pool._bounded_timeout("checkbox", 30.0))
+        time.sleep(0.3)
+        with pytest.raises(requests.Timeout):
+            http_pool._bounded_timeout("checkbox", 30.0)
+        seen.append("expired")
+
+    assert shift_maintenance._run_all("open", fn, deadline=0.2) == ["1"]
+    time.sleep(0.3)
+    assert seen[0] <= 0.2 and seen[1] == "expired"
+    assert http_pool._bounded_timeout("checkbox", 30.0) == 30.0
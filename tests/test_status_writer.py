@@ -0,0 +1,75 @@
+from typing import List, Tuple
+
+import pytest
+
+import status_writer
+from amocrm_common import AmoApiError
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(status_writer, "AMO_STATUS_QUEUE_PATH", str(tmp_path / "status.sqlite3"))
+    monkeypatch.setattr(status_writer, "start_flusher", lambda: None)
+    monkeypatch.setattr(status_writer, "send_telegram", lambda *args, **kwargs: None)
+    monkeypatch.setattr(status_writer, "AMO_STATUS_FLUSH_SIZE", 50)
+    monkeypatch.setattr(status_writer, "AMO_STATUS_FLUSH_INTERVAL", 0)
+    return status_writer
+
+
+def _patch(monkeypatch, writer, calls: List[List[Tuple[int, str]]], bad=(), error=None):
+    def update(field_id, values):
+        calls.append(list(values))
+        if error is not None:
+            raise error
+        if any(lead_id in bad for lead_id, _ in values):
+            raise AmoApiError(400, "invalid lead")
+
+    monkeypatch.setattr(writer, "update_leads_custom_field", update)
+
+
+def test_flush_writes_batch(writer, monkeypatch):
+    calls: List[List[Tuple[int, str]]] = []
+    _patch(monkeypatch, writer, calls)
+    writer.enqueue(1, "OK: a")
+    writer.enqueue(2, "OK: b")
+    assert writer.flush_once() == 2
+    assert calls == [[(1, "OK: a"), (2, "OK: b")]]
+    assert writer.stats() == {"pending": 0, "dead": 0}
+
+
+def test_permanent_rejection_is_isolated(writer, monkeypatch):
+    calls: List[List[Tuple[int, str]]] = []
+    _patch(monkeypatch, writer, calls, bad={3})
+    for lead_id in range(1, 6):
+        writer.enqueue(lead_id, f"OK: {lead_id}")
+    assert writer.flush_once() == 4
+    assert writer.stats() == {"pending": 0, "dead": 1}
+    assert writer._conn().execute("SELECT lead_id FROM dead_status").fetchone()[0] == 3
+
+
+def test_transient_errors_are_capped(writer, monkeypatch):
+    monkeypatch.setattr(writer, "AMO_STATUS_MAX_ATTEMPTS", 3)
+    calls: List[List[Tuple[int, str]]] = []
+    _patch(monkeypatch, writer, calls, error=AmoApiError(503, "unavailable"))
+    writer.enqueue(7, "OK: x")
+    for _ in range(3):
+        assert writer.flush_once() == 0
+    assert len(calls) == 3
+    assert writer.stats() == {"pending": 0, "dead": 1}
+
+
+def test_newer_text_survives_inflight_write(writer, monkeypatch):
+    calls: List[List[Tuple[int, str]]] = []
+
+    def update(field_id, values):
+        calls.append(list(values))
+        if len(calls) == 1:
+            writer.enqueue(9, "OK: newer")
+
+    monkeypatch.setattr(writer, "update_leads_custom_field", update)
+    writer.enqueue(9, "PENDING")
+    assert writer.flush_once() == 1
+    assert writer.pending_text(9) == "OK: newer"
+    assert writer.flush_once() == 1
+    assert calls[-1] == [(9, "OK: newer")]
+    assert writer.pending_text(9) is None
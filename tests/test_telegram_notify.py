@@ -0,0 +1,15 @@
+import telegram_notify
+
+
+def test_digest_packs_whole_items(monkeypatch):
+    monkeypatch.setattr(telegram_notify, "MAX_MESSAGE_LEN", 40)
+    items = [f"<b>{idx}</b> <code>{'x' * 10}</code>" for idx in range(3)]
+    messages = telegram_notify._digest(items)
+    assert messages == [items[0], items[1], items[2]]
+    assert all(message.count("<code>") == message.count("</code>") for message in messages)
+
+
+def test_digest_reports_items_too_long_to_send(monkeypatch):
+    monkeypatch.setattr(telegram_notify, "MAX_MESSAGE_LEN", 80)
+    messages = telegram_notify._digest(["<b>1</b> ok", "<code>" + "y" * 200 + "</code>", "<b>2</b> ok"])
+    assert messages == ["<b>1</b> ok\n\n<b>2</b> ok\n\n…и ещё 1 (слишком длинные, см. логи)"]
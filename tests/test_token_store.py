@@ -0,0 +1,21 @@
+import os
+import stat
+import time
+
+import token_store
+
+
+def test_store_is_owner_only_and_roundtrips(tmp_path, monkeypatch):
+    path = tmp_path / "tokens.sqlite3"
+    monkeypatch.setattr(token_store, "CHECKBOX_TOKEN_STORE_PATH", str(path))
+    monkeypatch.setattr(token_store, "_restricted_pid", None)
+    expires_at = time.time() + 60
+    token_store.save("1", "secret", expires_at)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert token_store.load("1") == ("secret", expires_at)
+    token_store.save("1", "older", expires_at - 30)
+    assert token_store.load("1")[0] == "secret"
+    token_store.discard("1", "other")
+    assert token_store.load("1") is not None
+    token_store.discard("1")
+    assert token_store.load("1") is None
@@ -0,0 +1,26 @@
+import webhook_common
+
+
+def _fail():
+    raise RuntimeError("disk I/O error")
+
+
+def test_health_skips_disabled_stores(monkeypatch):
+    monkeypatch.setattr(webhook_common, "AMO_STATUS_WRITE_BEHIND", False)
+    monkeypatch.setattr(webhook_common, "deferral_enabled", lambda: False)
+    monkeypatch.setattr(webhook_common, "reconcile_enabled", lambda: False)
+    for name in ("status_writer_stats", "deferred_queue_stats", "receipt_reconciler_stats"):
+        monkeypatch.setattr(webhook_common, name, _fail)
+    health = webhook_common.health_status()
+    assert health["status"] == "ok"
+    for section in ("status_writer", "deferred_queue", "receipt_reconciler"):
+        assert health[section] == {"enabled": False}
+
+
+def test_health_survives_broken_store(monkeypatch):
+    monkeypatch.setattr(webhook_common, "deferral_enabled", lambda: True)
+    monkeypatch.setattr(webhook_common, "deferred_queue_stats", _fail)
+    health = webhook_common.health_status()
+    assert health["status"] == "ok"
+    assert health["deferred_queue"] == {"error": "disk I/O error"}
+    assert "size" in health["ttn_cache"]
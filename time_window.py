@@ -1,4 +1,5 @@
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
+from typing import Optional
 import zoneinfo
 
 TZ = zoneinfo.ZoneInfo("Europe/Kiev")
@@ -10,3 +11,19 @@ def is_receipt_allowed_now() -> bool:
     if CLOSE_TIME <= now or now < OPEN_TIME:
         return False
     return True
+
+
+def last_close_boundary(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(TZ)
+    boundary = datetime.combine(now.date(), CLOSE_TIME, tzinfo=TZ)
+    if boundary > now:
+        boundary -= timedelta(days=1)
+    return boundary
+
+
+def next_open_boundary(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(TZ)
+    boundary = datetime.combine(now.date(), OPEN_TIME, tzinfo=TZ)
+    if boundary <= now:
+        boundary += timedelta(days=1)
+    return boundary
@@ -0,0 +1,90 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional, Tuple
+
+from config import CHECKBOX_TOKEN_STORE_PATH
+from local_store import connect, resolve_path
+
+logger = logging.getLogger("token_store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cashier_tokens (
+    profile_id TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+
+_restricted_pid: Optional[int] = None
+
+
+def _restrict_permissions() -> None:
+    global _restricted_pid
+    if _restricted_pid == os.getpid():
+        return
+    path = resolve_path(CHECKBOX_TOKEN_STORE_PATH)
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Create the file owner-only before SQLite does; the -wal/-shm files inherit its mode.
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.chmod(path + suffix, 0o600)
+    except OSError as e:
+        logger.warning(f"token_store.permissions_error path={path} error={e}")
+    _restricted_pid = os.getpid()
+
+
+def _conn() -> sqlite3.Connection:
+    _restrict_permissions()
+    return connect(CHECKBOX_TOKEN_STORE_PATH, _SCHEMA)
+
+
+def enabled() -> bool:
+    return bool(CHECKBOX_TOKEN_STORE_PATH)
+
+
+def load(profile_id: str) -> Optional[Tuple[str, float]]:
+    if not enabled():
+        return None
+    try:
+        row = _conn().execute(
+            "SELECT token, expires_at FROM cashier_tokens WHERE profile_id = ? AND expires_at > ?",
+            (profile_id, time.time()),
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"token_store.load_error profile_id={profile_id} error={e}")
+        return None
+    return (row["token"], row["expires_at"]) if row else None
+
+
+def save(profile_id: str, token: str, expires_at: float) -> None:
+    if not enabled():
+        return
+    try:
+        _conn().execute(
+            "INSERT INTO cashier_tokens (profile_id, token, expires_at, stored_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(profile_id) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at, "
+            "stored_at = excluded.stored_at WHERE excluded.expires_at >= cashier_tokens.expires_at",
+            (profile_id, token, expires_at, time.time()),
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"token_store.save_error profile_id={profile_id} error={e}")
+
+
+def discard(profile_id: str, token: Optional[str] = None) -> None:
+    if not enabled():
+        return
+    try:
+        if token is None:
+            _conn().execute("DELETE FROM cashier_tokens WHERE profile_id = ?", (profile_id,))
+        else:
+            _conn().execute(
+                "DELETE FROM cashier_tokens WHERE profile_id = ? AND token = ?", (profile_id, token)
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"token_store.discard_error profile_id={profile_id} error={e}")
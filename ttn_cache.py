@@ -0,0 +1,88 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config import NP_TTN_CACHE_MAX, NP_TTN_CACHE_PATH, NP_TTN_NEGATIVE_TTL
+from local_store import connect
+
+logger = logging.getLogger("ttn_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ttn_owner (
+    ttn TEXT PRIMARY KEY,
+    profile_id TEXT,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ttn_owner_used_at ON ttn_owner (used_at);
+"""
+
+_EVICT_EVERY = 100
+
+_counters: Dict[str, int] = {"hits": 0, "negative_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_counters_lock = threading.Lock()
+
+
+def _conn() -> sqlite3.Connection:
+    return connect(NP_TTN_CACHE_PATH, _SCHEMA)
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _counters_lock:
+        _counters[name] += amount
+
+
+def lookup(ttn: str) -> Tuple[bool, Optional[str]]:
+    now = time.time()
+    conn = _conn()
+    row = conn.execute("SELECT profile_id, stored_at FROM ttn_owner WHERE ttn = ?", (ttn,)).fetchone()
+    if row is None:
+        _count("misses")
+        return False, None
+    profile_id = row["profile_id"]
+    if profile_id is None:
+        if now - row["stored_at"] > NP_TTN_NEGATIVE_TTL:
+            _count("misses")
+            return False, None
+        _count("negative_hits")
+        return True, None
+    conn.execute("UPDATE ttn_owner SET used_at = ? WHERE ttn = ?", (now, ttn))
+    _count("hits")
+    return True, profile_id
+
+
+def store(ttn: str, profile_id: Optional[str]) -> None:
+    now = time.time()
+    _conn().execute(
+        "INSERT OR REPLACE INTO ttn_owner (ttn, profile_id, stored_at, used_at) VALUES (?, ?, ?, ?)",
+        (ttn, profile_id, now, now),
+    )
+    _count("stores")
+    if _counters["stores"] % _EVICT_EVERY == 0:
+        _evict()
+
+
+def _evict() -> None:
+    conn = _conn()
+    total = conn.execute("SELECT COUNT(*) FROM ttn_owner").fetchone()[0]
+    excess = total - NP_TTN_CACHE_MAX
+    if excess <= 0:
+        return
+    conn.execute(
+        "DELETE FROM ttn_owner WHERE ttn IN (SELECT ttn FROM ttn_owner ORDER BY used_at LIMIT ?)",
+        (excess,),
+    )
+    _count("evictions", excess)
+    logger.info(f"ttn_cache.evicted count={excess} total={total}")
+
+
+def stats() -> Dict[str, int]:
+    with _counters_lock:
+        result = dict(_counters)
+    try:
+        result["size"] = _conn().execute("SELECT COUNT(*) FROM ttn_owner").fetchone()[0]
+    except sqlite3.Error:
+        result["size"] = -1
+    return result
@@ -0,0 +1,76 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from amo_rate_limiter import stats as amo_rate_limiter_stats
+from catalog_cache import stats as catalog_cache_stats
+from circuit_breaker import stats as circuit_breaker_stats
+from config import AMO_STATUS_WRITE_BEHIND
+from deferred_queue import enabled as deferral_enabled, stats as deferred_queue_stats
+from nova_poshta_common import hit_scores as ttn_owner_scores
+from receipt_reconciler import enabled as reconcile_enabled, stats as receipt_reconciler_stats
+from status_writer import stats as status_writer_stats
+from ttn_cache import stats as ttn_cache_stats
+
+logger = logging.getLogger("app")
+
+
+def _to_lead_id(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+def lead_ids_from_json(body: Dict[str, Any]) -> List[int]:
+    leads = body.get("leads") or {}
+    status_items = leads.get("status") or leads.get("status_leads") or []
+    ids: List[int] = []
+    if isinstance(status_items, list):
+        for item in status_items:
+            lead_id = _to_lead_id(item.get("id")) if isinstance(item, dict) else None
+            if lead_id:
+                ids.append(lead_id)
+    if not ids and "lead_id" in body:
+        lead_id = _to_lead_id(body["lead_id"])
+        if lead_id:
+            ids.append(lead_id)
+    return list(dict.fromkeys(ids))
+
+
+def lead_ids_from_form(form: Dict[str, Any]) -> List[int]:
+    ids: List[int] = []
+    for key, value in form.items():
+        if key.endswith("[id]") and "leads[status]" in key:
+            lead_id = _to_lead_id(value)
+            if lead_id:
+                ids.append(lead_id)
+    if not ids and "lead_id" in form:
+        lead_id = _to_lead_id(form["lead_id"])
+        if lead_id:
+            ids.append(lead_id)
+    return list(dict.fromkeys(ids))
+
+
+def _section(name: str, collect: Callable[[], Any], enabled: bool = True) -> Any:
+    # A disabled feature's store is never opened; a broken one must not take /health down with it.
+    if not enabled:
+        return {"enabled": False}
+    try:
+        return collect()
+    except Exception as e:
+        logger.error(f"health.stats_error section={name} error={e}")
+        return {"error": str(e)}
+
+
+def health_status() -> Dict[str, Any]:
+    return {
+        "status": "ok",
+        "ttn_cache": _section("ttn_cache", ttn_cache_stats),
+        "catalog_cache": _section("catalog_cache", catalog_cache_stats),
+        "amo_rate_limiter": _section("amo_rate_limiter", amo_rate_limiter_stats),
+        "status_writer": _section("status_writer", status_writer_stats, AMO_STATUS_WRITE_BEHIND),
+        "deferred_queue": _section("deferred_queue", deferred_queue_stats, deferral_enabled()),
+        "receipt_reconciler": _section("receipt_reconciler", receipt_reconciler_stats, reconcile_enabled()),
+        "circuit_breakers": _section("circuit_breakers", circuit_breaker_stats),
+        "ttn_owner_scores": _section("ttn_owner_scores", ttn_owner_scores),
+    }